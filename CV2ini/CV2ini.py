@@ -1,38 +1,28 @@
-import sys
+import argparse
+import hashlib
 import json
+import os
+import sys
 
 # This script assembles a .ini file for the esg-publisher provided a WCRP .json CV files and additinal static content.
 # the CV files are found in https://github.com/WCRP-CMIP/CMIP6_CVs.git
 # The static content is found in  https://ithub.com/ESGF/config.git  under publisher-configs/ini/esg.cmip6.ini.static.txt
 
-if len(sys.argv) == 1:
-  print "Usage:"
-  print  "     python CV2ini.py <project-name> <base-path> <static-content> > <output-file>"
-  print
-  print "where <base-path> is the location of the CV repo"
-  exit(0)
-
-
-
-
-project_in = sys.argv[1]
-base_path_in = sys.argv[2]
-
 
 # TODO : hardcoded values to be replaced by input .json files
 
-facet_dict = { 
+facet_dict = {
                "institute": "institution_id",
-               "model": "source_id", 
-               "experiment": "", 
-               "ensemble": "variant_label", 
-               "cmor_table": "table_id", 
+               "model": "source_id",
+               "experiment": "",
+               "ensemble": "variant_label",
+               "cmor_table": "table_id",
                "grid_label": "grid_label" }
 
 
 
-DRS_list = [ "mip_era", 
-            "activity_id",  
+DRS_list = [ "mip_era",
+            "activity_id",
                "institute",
                "model",
                "experiment",
@@ -45,75 +35,89 @@ DRS_list = [ "mip_era",
 
 delimited_facets = { "realm": "space"}
 
-def load_and_print_static():
-
-  f = open(sys.argv[3])
-  for line in f:
-    print line.rstrip()
-
-def print_delimited():
-
-    for x in delimited_facets:
-
-        print x + "_delimiter = " + delimited_facets[x]
-
-
-
 extract_global_attrs = [  "realm", "frequency", "product",  "nominal_resolution", "source_type", "grid", "branch_method", "source_id", "table_id", "variant_label", "instiution_id"  ]
 
-def print_extract_attrs():
+MODELS_TABLE = "esgcet_models_table.part.txt"
+BATCH_MODELS_TABLE = "esgcet_models_table.{project}.part.txt"
+
 
-    print "extract_global_attrs = " + ', '.join(extract_global_attrs)
+class CVError(ValueError):
+    """A CV file is missing, malformed or inconsistent with the others."""
 
-"""
-Also handles the cohort map generation
-"""
-def gen_models_table_entries_and_print(base_path, project):
-    
 
-    f=open(base_path + "/" + project + "_source_id.json")
+def _check_source_id(cv):
+    for key, child in cv.items():
+        for field, kind in (("label_extended", str), ("institution_id", list), ("cohort", list)):
+            if not isinstance(child.get(field), kind):
+                raise CVError("source_id {} has no valid {}".format(key, field))
 
-    sidjobj = json.loads(f.read())
-    f.close()
 
-    f=open(base_path + "/" + project + "_institution_id.json")
-    
+def _check_institution_id(cv):
+    for key, value in cv.items():
+        if not isinstance(value, str):
+            raise CVError("institution_id {} has no description".format(key))
 
-    insts = json.loads(f.read())
-    f.close()
 
-    outf = open("esgcet_models_table.part.txt", "w")
+def _check_experiment_id(cv):
+    for key, child in cv.items():
+        if not isinstance(child.get("description"), str):
+            raise CVError("experiment_id {} has no description".format(key))
 
-    print "model_options = " + ', '.join(sidjobj["source_id"].keys())
 
-    print "institute_options = " + ', '.join(insts["institution_id"].keys())
+# Checks of the CVs the ini file is built from, beyond their top level key
+VALIDATORS = {
+    "source_id": _check_source_id,
+    "institution_id": _check_institution_id,
+    "experiment_id": _check_experiment_id,
+}
 
-    print "model_cohort_map = map(model : model_cohort)"
 
-    for key in sidjobj["source_id"].keys():
+class CVRepo(object):
+    """The CV files of one project in a WCRP CV repository checkout.
 
-        child = sidjobj["source_id"][key]
-        src_str = child["label_extended"]
-        inst_keys = child["institution_id"]
-        cohorts = " ".join(child["cohort"])
-          
-        if len(cohorts) < 1:
-          cohorts = "none"
-            
-        print "   " + key + " | " + cohorts
-        inst_arr = []
+    Each file is read once, and parsed and validated the first time it is
+    needed; both are kept for the other sections and ini files built from
+    it.
+    """
 
-        for n in inst_keys:
+    def __init__(self, base_path, project):
+        self.base_path = base_path
+        self.project = project
+        self.data = {}
+        self.cache = {}
 
-            inst_arr.append(insts["institution_id"][n])
+    def path(self, name):
+        return os.path.join(self.base_path, self.project + "_" + name + ".json")
 
+    def read(self, name):
+        """The bytes of <project>_<name>.json."""
+        if name not in self.data:
+            self.data[name] = read_file(self.path(name), name)
+        return self.data[name]
 
+    def get(self, name):
+        """The validated contents under the `name` key of <project>_<name>.json."""
+        if name not in self.cache:
+            data = self.read(name)
+            path = self.path(name)
+            try:
+                cv = json.loads(data.decode("utf-8"))[name]
+            except (ValueError, KeyError) as ex:
+                raise CVError("cannot read {} from {}: {}".format(name, path, ex))
+            if not isinstance(cv, (dict, list)):
+                raise CVError("{} in {} is not a list or a table".format(name, path))
+            VALIDATORS.get(name, lambda cv: None)(cv)
+            self.cache[name] = cv
+        return self.cache[name]
 
-        outarr = [project.lower(), key, " ", ', '.join(inst_arr) + ", " + src_str]
+    def institutes(self, source):
+        """Institution descriptions of a source_id entry."""
+        insts = self.get("institution_id")
+        missing = [n for n in source["institution_id"] if n not in insts]
+        if missing:
+            raise CVError("unknown institution_id {}".format(", ".join(missing)))
+        return [insts[n] for n in source["institution_id"]]
 
-        outf.write('  ' +  ' | '.join(outarr) + "\n")
-    outf.close()
-    print
 
 def get_facet_list(first_item, vers):
 
@@ -121,110 +125,336 @@ def get_facet_list(first_item, vers):
     if len(first_item) > 0:
 
       outarr = [first_item]
- 
+
 
     for x in DRS_list:
-        
+
         if (vers or (x != "version")):
 
             outarr.append("%(" + x + ")s")
 
     return outarr
 
-def print_directory_format():
-
-    outarr = get_facet_list("/%(root)s", True)
-
-
-    print "directory_format = " + '/'.join(outarr)
-
-
-
-def print_dataset_id_fmt():
-    
-    outarr = get_facet_list("", False)
-    
-    print "dataset_id = " + '.'.join(outarr)
-
-
-def write_options_list(base_path, project, facet_in, facet_out):
-
-    f=open(base_path + "/" + project + "_" + facet_in + ".json")
-
-    jobj = json.loads(f.read())[facet_in]
-    
-    print facet_out + "_options = " + ', '.join(jobj)
-
-
-def write_experiment_options(base_path, project):
-
-    f=open(base_path + "/" + project + "_experiment_id.json")
-    
-    jobj = json.loads(f.read())["experiment_id"]
-
-    print "experiment_options ="
-    for key in jobj:
-
-        print "  " +  project.lower() + " | " + key + " | " + jobj[key]["description"].replace('%', "pct")
-
-
-def write_categories():
-
-#    f = open(ext_file)
-
-    print "categories ="
-    print "  project  | enum | true | true | 0"
-
-    omit_list = [ "variable", "version"]
-
-    for i, facet_out in enumerate(facet_dict):
-
-        if not facet_out in omit_list:
-        
-          type_str = "enum"
-
-          if facet_out == "ensemble":
-              type_str = "string"
 
-          outarr = [facet_out, type_str, "true", "true" , str(i + 1)  ]
-        
-          conv = facet_dict[facet_out]
+class IniGenerator(object):
+    """Builds the [project:...] ini section of a project from its CVs.
 
-          print "   " + ' | '.join(outarr)
+    Every part of the file is produced by one of the methods named in
+    SECTIONS as a list of lines, in the order of the file.
+    """
 
-    base = len(facet_dict) + 1
+    SECTIONS = ["header", "static", "categories", "model_options", "institute_options",
+                "model_cohort_map", "experiment_options", "cmor_table_options",
+                "grid_label_options", "activity_id_options", "directory_format",
+                "dataset_id", "delimiters", "extract_global_attrs"]
 
-    for i, facet_out in enumerate(extract_global_attrs + ["model_cohort"]):
-    
-        outarr = [facet_out, "string", "false", "true" , str(i + base)  ]
-        print "   " + ' | '.join(outarr)
+    # Input files of the sections reading any, "static" being the static
+    # content; the other sections only depend on this script
+    INPUTS = {
+        "static": ["static"],
+        "model_options": ["source_id"],
+        "institute_options": ["institution_id"],
+        "model_cohort_map": ["source_id"],
+        "models_table": ["source_id", "institution_id"],
+        "experiment_options": ["experiment_id"],
+        "cmor_table_options": [facet_dict["cmor_table"]],
+        "grid_label_options": [facet_dict["grid_label"]],
+        "activity_id_options": ["activity_id"],
+    }
 
-    print "  description  | text | false | false | 99"
+    # CV whose terms a section lists, for the summary of changes
+    TERMS = {
+        "model_options": "source_id",
+        "institute_options": "institution_id",
+        "experiment_options": "experiment_id",
+        "cmor_table_options": facet_dict["cmor_table"],
+        "grid_label_options": facet_dict["grid_label"],
+        "activity_id_options": "activity_id",
+    }
 
-print "[project:" + project_in.lower() + "]"
+    def __init__(self, repo, static_path):
+        self.repo = repo
+        self.project = repo.project
+        self.static_path = static_path
+        self.static_data = None
 
-load_and_print_static()
+    def header(self):
+        return ["[project:" + self.project.lower() + "]"]
 
-write_categories()
+    def static(self):
+        return [line.rstrip() for line in self.input_data("static").decode("utf-8").splitlines()]
 
-gen_models_table_entries_and_print(base_path_in, project_in)
-write_experiment_options(base_path_in, project_in)
+    def categories(self):
 
-# TODO get options list
-for f_out in ["cmor_table", "grid_label"]:
+        lines = ["categories =", "  project  | enum | true | true | 0"]
 
-    
-    f_in = facet_dict[f_out]
+        omit_list = [ "variable", "version"]
 
-    if len(f_in) == 0:
-        f_in = f_out
+        for i, facet_out in enumerate(facet_dict):
 
+            if not facet_out in omit_list:
 
-    write_options_list(base_path_in, project_in, f_in, f_out)    
+              type_str = "enum"
 
-write_options_list(base_path_in, project_in, "activity_id", "activity_id")    
+              if facet_out == "ensemble":
+                  type_str = "string"
+
+              outarr = [facet_out, type_str, "true", "true" , str(i + 1)  ]
 
-print_directory_format()
-print_dataset_id_fmt()
-print_delimited()
-print_extract_attrs()
+              lines.append("   " + ' | '.join(outarr))
+
+        base = len(facet_dict) + 1
+
+        for i, facet_out in enumerate(extract_global_attrs + ["model_cohort"]):
+
+            outarr = [facet_out, "string", "false", "true" , str(i + base)  ]
+            lines.append("   " + ' | '.join(outarr))
+
+        lines.append("  description  | text | false | false | 99")
+        return lines
+
+    def model_options(self):
+        return ["model_options = " + ', '.join(self.repo.get("source_id"))]
+
+    def institute_options(self):
+        return ["institute_options = " + ', '.join(self.repo.get("institution_id"))]
+
+    def model_cohort_map(self):
+        lines = ["model_cohort_map = map(model : model_cohort)"]
+        for key, child in self.repo.get("source_id").items():
+            cohorts = " ".join(child["cohort"])
+            if len(cohorts) < 1:
+                cohorts = "none"
+            lines.append("   " + key + " | " + cohorts)
+        lines.append("")
+        return lines
+
+    def models_table(self):
+        """Lines of the esgcet models table part, one per source_id."""
+        lines = []
+        for key, child in self.repo.get("source_id").items():
+            outarr = [self.project.lower(), key, " ",
+                      ', '.join(self.repo.institutes(child)) + ", " + child["label_extended"]]
+            lines.append('  ' + ' | '.join(outarr))
+        return lines
+
+    def experiment_options(self):
+        lines = ["experiment_options ="]
+        for key, child in self.repo.get("experiment_id").items():
+            lines.append("  " + self.project.lower() + " | " + key + " | " + child["description"].replace('%', "pct"))
+        return lines
+
+    def options_list(self, facet_in, facet_out):
+        return [facet_out + "_options = " + ', '.join(self.repo.get(facet_in))]
+
+    def cmor_table_options(self):
+        return self.options_list(facet_dict["cmor_table"], "cmor_table")
+
+    def grid_label_options(self):
+        return self.options_list(facet_dict["grid_label"], "grid_label")
+
+    def activity_id_options(self):
+        return self.options_list("activity_id", "activity_id")
+
+    def directory_format(self):
+        return ["directory_format = " + '/'.join(get_facet_list("/%(root)s", True))]
+
+    def dataset_id(self):
+        return ["dataset_id = " + '.'.join(get_facet_list("", False))]
+
+    def delimiters(self):
+        return [x + "_delimiter = " + delimited_facets[x] for x in delimited_facets]
+
+    def extract_global_attrs(self):
+        return ["extract_global_attrs = " + ', '.join(extract_global_attrs)]
+
+    def input_data(self, name):
+        if name != "static":
+            return self.repo.read(name)
+        if self.static_data is None:
+            self.static_data = read_file(self.static_path, "the static part")
+        return self.static_data
+
+    def input_hash(self, name):
+        """sha256 of an input file, None when it cannot be read."""
+        try:
+            return hashlib.sha256(self.input_data(name)).hexdigest()
+        except CVError:
+            return None
+
+    def terms(self, name):
+        return list(self.repo.get(self.TERMS[name])) if name in self.TERMS else []
+
+    def build(self, state=None):
+        """{section: lines} of the ini file and the models table.
+
+        Sections whose input files have the same content hash as in
+        `state` reuse the lines kept there, without reading their CVs.
+        Returns the sections, the new state and the terms added and
+        removed per section since `state`.
+        """
+        state = state or {}
+        old_inputs = state.get("inputs", {})
+        old_sections = state.get("sections", {})
+        old_terms = state.get("terms", {})
+        inputs = dict((name, self.input_hash(name))
+                      for name in set(n for names in self.INPUTS.values() for n in names))
+
+        sections, terms, changes = {}, {}, {}
+        for name in self.SECTIONS + ["models_table"]:
+            deps = self.INPUTS.get(name)
+            if deps and name in old_sections and all(inputs[d] is not None and inputs[d] == old_inputs.get(d)
+                                                     for d in deps):
+                sections[name] = old_sections[name]
+                terms[name] = old_terms.get(name, [])
+                continue
+            sections[name] = getattr(self, name)()
+            terms[name] = self.terms(name)
+            before, after = set(old_terms.get(name, [])), set(terms[name])
+            added = [t for t in terms[name] if t not in before]
+            removed = [t for t in old_terms.get(name, []) if t not in after]
+            if added or removed:
+                changes[name] = dict(added=added, removed=removed)
+        return sections, dict(inputs=inputs, sections=sections, terms=terms), changes
+
+    def ini_text(self, sections=None):
+        if sections is None:
+            sections = dict((name, getattr(self, name)()) for name in self.SECTIONS)
+        lines = []
+        for name in self.SECTIONS:
+            lines.extend(sections[name])
+        return "\n".join(lines) + "\n"
+
+    def models_table_text(self, lines=None):
+        if lines is None:
+            lines = self.models_table()
+        return "".join(line + "\n" for line in lines)
+
+
+def read_file(path, what):
+    """The bytes of `path`, a CVError naming `what` when it cannot be read."""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError as ex:
+        raise CVError("cannot read {} from {}: {}".format(what, path, ex))
+
+
+def write_atomic(path, text):
+    """Replace `path` with `text` without readers ever seeing a partial file.
+    Returns False, leaving the file alone, when it already holds `text`."""
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = os.path.join(directory, "." + os.path.basename(path) + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return True
+
+
+_repos = {}
+
+
+def load_state(path):
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def generate(project, base_path, static_path, output=None, models_table=MODELS_TABLE, state_path=None):
+    """Write the ini file of `project` to `output` (stdout when None) and
+    its models table part to `models_table`.
+
+    CV repositories are shared between calls, so every CV file is read
+    once per run.  With `state_path`, the content hashes of the inputs and
+    the sections built from them are kept there, and sections are only
+    built again when their inputs changed.  Files are only rewritten when
+    their contents change.  Returns the written paths and the terms added
+    and removed per section.
+    """
+    key = (os.path.abspath(base_path), project)
+    if key not in _repos:
+        _repos[key] = CVRepo(base_path, project)
+    gen = IniGenerator(_repos[key], static_path)
+
+    # everything is built before anything is written, so an inconsistent
+    # CV leaves the previous files in place
+    sections, state, changes = gen.build(load_state(state_path))
+    models = gen.models_table_text(sections["models_table"])
+    ini = gen.ini_text(sections)
+
+    written = []
+    if models_table and write_atomic(models_table, models):
+        written.append(models_table)
+    if output is None or output == "-":
+        sys.stdout.write(ini)
+    elif write_atomic(output, ini):
+        written.append(output)
+    if state_path:
+        write_atomic(state_path, json.dumps(state, indent=1, sort_keys=True))
+    return dict(project=project, written=written, changes=changes)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Assemble esg-publisher .ini files from the WCRP CV files and static content",
+        epilog="With --batch FILE, FILE is a JSON list of jobs with the keys project, base_path, "
+               "static, output and optionally models_table and state, all run with the CV files read once. "
+               "The models table of a job defaults to {} next to its output.".format(BATCH_MODELS_TABLE))
+    parser.add_argument("project", nargs="?", help="Project name, e.g. CMIP6")
+    parser.add_argument("base_path", nargs="?", help="Location of the CV repo")
+    parser.add_argument("static", nargs="?", help="Static content of the ini file")
+    parser.add_argument("--output", "-o", default=None, help="Output ini file (default is stdout)")
+    parser.add_argument("--models-table", default=MODELS_TABLE,
+                        help="Output models table part (default {})".format(MODELS_TABLE))
+    parser.add_argument("--state", default=None,
+                        help="File keeping the input hashes and sections, to only rebuild what changed")
+    parser.add_argument("--summary", default=None, help="Write the written files and the added and removed "
+                                                          "terms of every job to this JSON file")
+    parser.add_argument("--batch", default=None, help="JSON file listing several ini files to build")
+    args = parser.parse_args()
+
+    if args.batch:
+        with open(args.batch) as f:
+            jobs = json.load(f)
+    elif args.static:
+        jobs = [dict(project=args.project, base_path=args.base_path, static=args.static,
+                     output=args.output, models_table=args.models_table, state=args.state)]
+    else:
+        parser.error("give <project-name> <base-path> <static-content> or --batch")
+
+    if args.batch:
+        # each project gets its own models table unless the job names one
+        for job in jobs:
+            if "models_table" not in job:
+                job["models_table"] = os.path.join(os.path.dirname(job.get("output") or ""),
+                                                   BATCH_MODELS_TABLE.format(project=job["project"]))
+        tables = [job["models_table"] for job in jobs if job["models_table"]]
+        if len(set(tables)) < len(tables):
+            parser.error("several jobs of {} write the same models_table".format(args.batch))
+
+    summary = []
+    try:
+        for job in jobs:
+            result = generate(job["project"], job["base_path"], job["static"], job.get("output"),
+                              job["models_table"], job.get("state"))
+            summary.append(result)
+            for name, change in sorted(result["changes"].items()):
+                print("{} {}: {} added, {} removed".format(result["project"], name, len(change["added"]),
+                                                           len(change["removed"])), file=sys.stderr)
+    except CVError as ex:
+        print("Error: {}".format(ex), file=sys.stderr)
+        sys.exit(1)
+    if args.summary:
+        write_atomic(args.summary, json.dumps(summary, indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import fileinput
+import itertools
+import multiprocessing
+import re
+import sys
+import time
+
+from CV2ini import CVError, CVRepo, DRS_list, facet_dict
+
+# The CV file checked for each DRS facet; the others are checked with PATTERNS
+CV_FACETS = dict((k, v) for k, v in facet_dict.items() if k != "ensemble")
+CV_FACETS.update(experiment="experiment_id", activity_id="activity_id")
+
+PATTERNS = {
+    "ensemble": r"r\d+i\d+p\d+f\d+",
+    "variable": r"[A-Za-z0-9]+",
+    "version": r"v\d{8}",
+}
+
+
+class DRSValidator(object):
+    """Checks dataset ids and directory paths against the DRS of CV2ini.py
+    and the CVs of a project.
+
+    Every CV is compiled once into a frozenset and every other facet into
+    a regular expression, so checking an id is a split and one lookup per
+    facet.  The model and institute of an id must also be a pair listed
+    in the source_id CV.
+    """
+
+    def __init__(self, repo):
+        self.project = repo.project
+        self.checks = []
+        for i, facet in enumerate(DRS_list):
+            if facet == "mip_era":
+                check = frozenset([repo.project])
+            elif facet in CV_FACETS:
+                check = frozenset(repo.get(CV_FACETS[facet]))
+            else:
+                check = re.compile(PATTERNS[facet] + r"\Z").match
+            self.checks.append((i, facet, check))
+        self.institute = DRS_list.index("institute")
+        self.model = DRS_list.index("model")
+        self.pairs = frozenset((source, inst) for source, child in repo.get("source_id").items()
+                               for inst in child["institution_id"])
+        self.id_length = len(DRS_list) - 1
+
+    def check(self, facets):
+        """Errors of a list of DRS facet values, empty when they are valid."""
+        errors = []
+        for i, facet, check in self.checks:
+            if i >= len(facets):
+                break
+            value = facets[i]
+            if not (value in check if isinstance(check, frozenset) else check(value)):
+                errors.append("invalid {} '{}'".format(facet, value))
+        if len(facets) > self.model and (facets[self.model], facets[self.institute]) not in self.pairs \
+                and facets[self.model] in self.checks[self.model][2]:
+            errors.append("model '{}' is not from institute '{}'".format(facets[self.model],
+                                                                           facets[self.institute]))
+        return errors
+
+    def check_id(self, dataset_id):
+        """Errors of a dataset id, with or without .version and |data_node."""
+        facets = dataset_id.split("|", 1)[0].split(".")
+        if len(facets) not in (self.id_length, self.id_length + 1):
+            return ["{} facets instead of {}".format(len(facets), self.id_length)]
+        return self.check(facets)
+
+    def check_path(self, path):
+        """Errors of a dataset directory or file path below any root."""
+        parts = path.strip("/").split("/")
+        try:
+            start = parts.index(self.project)
+        except ValueError:
+            return ["no {} directory".format(self.project)]
+        facets = parts[start:]
+        if len(facets) == len(DRS_list) + 1 and facets[-1].endswith(".nc"):
+            facets = facets[:-1]
+        if len(facets) != len(DRS_list):
+            return ["{} directories instead of {}".format(len(facets), len(DRS_list))]
+        return self.check(facets)
+
+
+def validate(validator, lines, paths=False):
+    """(checked, [(line, errors), ...]) of an iterable of ids or paths."""
+    check = validator.check_path if paths else validator.check_id
+    invalid = []
+    checked = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        checked += 1
+        errors = check(line)
+        if errors:
+            invalid.append((line, errors))
+    return checked, invalid
+
+
+_validator = None
+
+
+def _init_worker(base_path, project):
+    global _validator
+    _validator = DRSValidator(CVRepo(base_path, project))
+
+
+def _validate_chunk(args):
+    lines, paths = args
+    return validate(_validator, lines, paths)
+
+
+def chunks(lines, size):
+    it = iter(lines)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Validate dataset ids or paths against the DRS and CVs of a project")
+    parser.add_argument("project", help="Project name, e.g. CMIP6")
+    parser.add_argument("base_path", help="Location of the CV repo")
+    parser.add_argument("files", nargs="*", help="Files with one id or path per line (default is stdin)")
+    parser.add_argument("--paths", action="store_true", help="Lines are directory or file paths, not dataset ids")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Worker processes (default 1)")
+    parser.add_argument("--chunk", type=int, default=20000, help="Lines per work unit with --jobs")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Only print the summary")
+    args = parser.parse_args()
+
+    try:
+        validator = DRSValidator(CVRepo(args.base_path, args.project))
+    except CVError as ex:
+        print("Error: {}".format(ex), file=sys.stderr)
+        sys.exit(2)
+
+    start = time.time()
+    lines = fileinput.input(args.files or ["-"])
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs, _init_worker, (args.base_path, args.project))
+        results = pool.imap(_validate_chunk, ((chunk, args.paths) for chunk in chunks(lines, args.chunk)))
+    else:
+        pool = None
+        results = (validate(validator, chunk, args.paths) for chunk in chunks(lines, args.chunk))
+
+    checked = bad = 0
+    out = sys.stdout
+    for n, invalid in results:
+        checked += n
+        bad += len(invalid)
+        if not args.quiet:
+            out.write("".join("{}\t{}\n".format(line, "; ".join(errors)) for line, errors in invalid))
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    seconds = time.time() - start
+    print("{} checked, {} invalid in {:.1f} s ({:.0f} per minute)".format(
+        checked, bad, seconds, checked * 60.0 / max(seconds, 1e-6)), file=sys.stderr)
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import json
+
+import pytest
+
+import CV2ini
+from CV2ini import CVError, CVRepo, IniGenerator
+
+
+def test_missing_static_file(tmp_path):
+    gen = IniGenerator(CVRepo(str(tmp_path), "CMIP6"), str(tmp_path / "static.ini"))
+    with pytest.raises(CVError):
+        gen.static()
+    assert gen.input_hash("static") is None
+
+
+def test_cv_files_are_read_once(tmp_path, monkeypatch):
+    with open(str(tmp_path / "CMIP6_activity_id.json"), "w") as f:
+        json.dump({"activity_id": {"CMIP": "DECK and historical"}}, f)
+    reads = []
+    read_file = CV2ini.read_file
+    monkeypatch.setattr(CV2ini, "read_file", lambda path, what: reads.append(path) or read_file(path, what))
+    gen = IniGenerator(CVRepo(str(tmp_path), "CMIP6"), str(tmp_path / "static.ini"))
+    assert gen.input_hash("activity_id") is not None
+    assert gen.repo.get("activity_id") == {"CMIP": "DECK and historical"}
+    assert reads == [str(tmp_path / "CMIP6_activity_id.json")]
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from CV2ini import CVError, CVRepo
+from drs_validate import DRSValidator, chunks, validate
+
+CVS = {
+    "institution_id": {"NCAR": "National Center for Atmospheric Research", "IPSL": "Institut Pierre Simon Laplace"},
+    "source_id": {"CESM2": dict(label_extended="CESM2", institution_id=["NCAR"], cohort=["Published"]),
+                  "IPSL-CM6A-LR": dict(label_extended="IPSL", institution_id=["IPSL"], cohort=["Published"])},
+    "experiment_id": {"historical": dict(description="all forcing"), "piControl": dict(description="control")},
+    "activity_id": {"CMIP": "DECK and historical"},
+    "table_id": ["Amon", "Omon"],
+    "grid_label": {"gn": "native grid", "gr": "regridded"},
+}
+
+ID = "CMIP6.CMIP.NCAR.CESM2.historical.r1i1p1f1.Amon.tas.gn"
+
+
+@pytest.fixture
+def validator(tmp_path):
+    for name, cv in CVS.items():
+        with open(str(tmp_path / ("CMIP6_" + name + ".json")), "w") as f:
+            json.dump({name: cv}, f)
+    return DRSValidator(CVRepo(str(tmp_path), "CMIP6"))
+
+
+def test_valid_ids(validator):
+    assert validator.check_id(ID) == []
+    assert validator.check_id(ID + ".v20190308") == []
+    assert validator.check_id(ID + ".v20190308|esgf-data.ucar.edu") == []
+
+
+def test_invalid_facets(validator):
+    assert validator.check_id(ID.replace("historical", "ssp585")) == ["invalid experiment 'ssp585'"]
+    assert validator.check_id(ID.replace("r1i1p1f1", "r1i1p1")) == ["invalid ensemble 'r1i1p1'"]
+    assert validator.check_id(ID + ".20190308") == ["invalid version '20190308'"]
+    assert validator.check_id("CMIP5" + ID[5:]) == ["invalid mip_era 'CMIP5'"]
+    assert validator.check_id("CMIP6.CMIP.NCAR") == ["3 facets instead of 9"]
+
+
+def test_model_must_belong_to_the_institute(validator):
+    assert validator.check_id(ID.replace("NCAR", "IPSL")) == ["model 'CESM2' is not from institute 'IPSL'"]
+    # an unknown model is only reported once
+    assert validator.check_id(ID.replace("CESM2", "CESM3")) == ["invalid model 'CESM3'"]
+
+
+def test_paths(validator):
+    path = "/data/" + ID.replace(".", "/") + "/v20190308"
+    assert validator.check_path(path) == []
+    assert validator.check_path(path + "/tas_Amon_CESM2_historical_r1i1p1f1_gn_185001-201412.nc") == []
+    assert validator.check_path(path.replace("/CMIP6/", "/CMIP5/")) == ["no CMIP6 directory"]
+    assert validator.check_path(path.rsplit("/", 1)[0]) == ["9 directories instead of 10"]
+
+
+def test_validate_and_chunks(validator):
+    lines = [ID + "\n", "\n", ID.replace("gn", "gx") + "\n"]
+    assert validate(validator, lines) == (2, [(ID.replace("gn", "gx"), ["invalid grid_label 'gx'"])])
+    assert [len(c) for c in chunks(iter(range(5)), 2)] == [2, 2, 1]
+
+
+def test_missing_cv(tmp_path):
+    with pytest.raises(CVError):
+        DRSValidator(CVRepo(str(tmp_path), "CMIP6"))
@@ -1,5 +1,12 @@
-import requests, json
-from urlparse import urlparse
+from __future__ import print_function
+import argparse, csv, json, requests
+try:
+	from urlparse import urlparse
+except ImportError:
+	from urllib.parse import urlparse
+
+SEARCH_URL = "https://esgf-node.llnl.gov/esg-search/search/"
+SOLR_URL = "https://esgf-node.llnl.gov/solr/files/select"
 
 # Load this table from a .json file
 sample_table = { 'esg_dataroot' : '/path/to/data',
@@ -7,19 +14,41 @@ sample_table = { 'esg_dataroot' : '/path/to/data',
 		 '/cmip5_css01_data': '/path/to/cmip5_01/data',
 		  'css03_data': '/path/to/css03/data', 'user_pub_work': '/path/to/user/data' }
 
+# Separates the values of multi-valued fields such as url in the CSV rows
+MV_SEPARATOR = '\t'
+
+
+def get_shards():
+
+	# The files core shards esg-search distributes its File queries over
+	resp = requests.get(SEARCH_URL, params={'type': 'File', 'limit': 0, 'format': 'application/solr+json'})
+	resp.raise_for_status()
 
+	return json.loads(resp.text)["responseHeader"]["params"]["shards"]
 
-def get_mapped_dataset(id):
 
-	search_url = "https://esgf-node.llnl.gov/esg-search/search/?type=File&dataset_id={}&format=application%2fsolr%2bjson".format(id)
+def file_rows(id, fields=('url',), shards=None):
 
-	resp = requests.get(search_url)
+	"""Stream the File records of a dataset from Solr as CSV, with only
+	the requested fields, and yield them one dict per row; multi-valued
+	fields are lists."""
 
-	docs = json.loads(resp.text)["response"]["docs"]
+	params = {'q': '*:*', 'fq': 'dataset_id:"{}"'.format(id), 'fl': ','.join(fields), 'wt': 'csv',
+		  'csv.mv.separator': MV_SEPARATOR, 'rows': 1000000, 'shards': shards or get_shards()}
+	resp = requests.get(SOLR_URL, params=params, stream=True)
+	resp.raise_for_status()
 
-	urllst = [x['url'][0] for x in docs]
+	lines = (ln if isinstance(ln, str) else ln.decode('utf-8') for ln in resp.iter_lines())
+	reader = csv.reader(lines)
+	header = next(reader, [])
+	for row in reader:
+		yield dict((name, value.split(MV_SEPARATOR) if name == 'url' else value)
+			   for name, value in zip(header, row))
 
-	return urllst
+
+def get_mapped_dataset(id, shards=None):
+
+	return [x['url'][0] for x in file_rows(id, shards=shards)]
 
 
 def parse_and_map(url, table):
@@ -36,18 +65,29 @@ def parse_and_map(url, table):
 	return '/'.join([mappedroot] + pathparts[4:])
 
 
-def map_datasets(id):
+def map_datasets(id, shards=None, checksums=False):
 
-	for url in get_mapped_dataset(id):
+	if not checksums:
+		for url in get_mapped_dataset(id, shards):
+			print(parse_and_map(url, sample_table))
+		return
 
-		print parse_and_map(url, sample_table)
+	for row in file_rows(id, ('url', 'checksum', 'size'), shards):
+		print('\t'.join([parse_and_map(row['url'][0], sample_table), row.get('checksum', ''), row.get('size', '')]))
 
 
-import sys
-
 # test example files:
 #  'cmip5.output1.CMCC.CMCC-CM.historical.day.atmos.day.r1i1p1.v20120514|aims3.llnl.gov'
 # 'CMIP6.CMIP.NASA-GISS.GISS-E2-1-G.historical.r1i1p1f1.3hr.clt.gn.v20181015|aims3.llnl.gov'
 
-map_datasets(sys.argv[1])
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description="Map the files of datasets to their physical paths")
+	parser.add_argument("ids", nargs="+", help="Dataset ids such as 'cmip5.output1...v20120514|aims3.llnl.gov'")
+	parser.add_argument("--checksums", action="store_true", help="Also print the checksum and size of every file")
+	args = parser.parse_args()
 
+	# discovered once for all the datasets
+	shards = get_shards()
+	for id in args.ids:
+		map_datasets(id, shards, args.checksums)
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# Index x data node dataset count matrix of a project across the federation
+from __future__ import print_function
+import argparse,json,sys
+from collections import Counter
+from esgsearch import read_nodes,facet_counts,parallel
+
+def gather(indexes,proj,workers=8,distrib=True,**constraints):
+	"""{index: {data_node: count}}, None for the indexes that failed"""
+	def query(site):
+		return facet_counts(site,['data_node'],project=proj,replica=False,distrib=distrib,**constraints)['data_node']
+	return dict(parallel(query,indexes,workers))
+
+def consensus(matrix,data_nodes):
+	"""{data_node: count} most indexes agree on, the larger count on a tie"""
+	result={}
+	for dn in data_nodes:
+		counts=Counter(row.get(dn,0) for row in matrix.values() if row is not None)
+		if counts:
+			result[dn]=max(counts.items(),key=lambda c:(c[1],c[0]))[0]
+	return result
+
+def check(matrix,expected=(),tolerance=0):
+	"""(data_nodes, consensus, flags) where flags lists the cells
+	(index, data_node, count, consensus) off the consensus by more than
+	tolerance"""
+	data_nodes=set(expected)
+	for row in matrix.values():
+		if row is not None:
+			data_nodes.update(row)
+	data_nodes=sorted(data_nodes)
+	agreed=consensus(matrix,data_nodes)
+	flags=[]
+	for index in sorted(matrix):
+		if matrix[index] is None:
+			continue
+		for dn in data_nodes:
+			n=matrix[index].get(dn,0)
+			if abs(n-agreed.get(dn,0))>tolerance:
+				flags.append((index,dn,n,agreed.get(dn,0)))
+	return data_nodes,agreed,flags
+
+def render_text(proj,indexes,matrix,data_nodes,agreed,flags,out=sys.stdout):
+	flagged=set((i,dn) for i,dn,n,c in flags)
+	print('Dataset counts of project %s, data nodes by index node (* off the consensus)'%proj,file=out)
+	for k,index in enumerate(indexes):
+		print('  [%d] %s%s'%(k,index,' (failed to respond)' if matrix.get(index) is None else ''),file=out)
+	width=max([len(dn) for dn in data_nodes]+[9])
+	print('%-*s %9s'%(width,'data_node','consensus')+''.join('%10s'%('[%d]'%k) for k in range(len(indexes))),file=out)
+	for dn in data_nodes:
+		cells=[]
+		for index in indexes:
+			if matrix.get(index) is None:
+				cells.append('%10s'%'-')
+			else:
+				cells.append('%9d%s'%(matrix[index].get(dn,0),'*' if (index,dn) in flagged else ' '))
+		print('%-*s %9d'%(width,dn,agreed.get(dn,0))+''.join(cells),file=out)
+	if not flags:
+		print('All responding index nodes agree',file=out)
+	for index,dn,n,c in flags:
+		print('%s: %d datasets of %s, consensus %d (%+d)'%(index,n,dn,c,n-c),file=out)
+
+def render_json(proj,indexes,matrix,data_nodes,agreed,flags,out=sys.stdout):
+	json.dump({'project':proj,'indexes':indexes,'data_nodes':data_nodes,'matrix':matrix,'consensus':agreed,
+		'failed':[i for i in indexes if matrix.get(i) is None],
+		'flags':[dict(index=i,data_node=dn,count=n,consensus=c) for i,dn,n,c in flags]},out,indent=1,sort_keys=True)
+	out.write('\n')
+
+def main():
+	aparser=argparse.ArgumentParser(description='Compare the data_node dataset counts of a project across index nodes')
+	aparser.add_argument('--proj', type=str,required=True)
+	aparser.add_argument('--indexes', type=str,default='fednodes',help='Index node list (default fednodes)')
+	aparser.add_argument('--datanodes', type=str,default=None,help='Data node list of the project, e.g. cmip5nodes, listed even when no index has them')
+	aparser.add_argument('--local', action='store_true',help='Count only the local shard of each index (distrib=false)')
+	aparser.add_argument('--tolerance', type=int,default=0,help='Differences from the consensus allowed per cell (default 0)')
+	aparser.add_argument('--format', choices=('text','json'),default='text')
+	aparser.add_argument('--workers', type=int,default=8,help='Index nodes queried in parallel (default 8)')
+	args=aparser.parse_args()
+
+	indexes=read_nodes(args.indexes)
+	expected=read_nodes(args.datanodes) if args.datanodes else []
+	matrix=gather(indexes,args.proj,args.workers,not args.local)
+	data_nodes,agreed,flags=check(matrix,expected,args.tolerance)
+	render=render_json if args.format=='json' else render_text
+	render(args.proj,indexes,matrix,data_nodes,agreed,flags)
+	sys.exit(1 if flags else 0)
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# Facet count queries against the esg-search API of many index nodes at once
+from __future__ import print_function
+import json,sys
+from multiprocessing.dummy import Pool
+try:
+	from urllib import urlencode
+	from urllib2 import urlopen
+except ImportError:
+	from urllib.parse import urlencode
+	from urllib.request import urlopen
+
+def read_nodes(path):
+	"""Host names of a node list file such as fednodes, skipping comments"""
+	with open(path) as f:
+		return [ln.strip() for ln in f if ln.strip() and not ln.startswith('#')]
+
+def search(site,params,timeout=120):
+	"""Solr JSON response of an esg-search query on one index node"""
+	query=[('format','application/solr+json')]
+	if 'limit' not in params:
+		query.append(('limit','0'))
+	for k,v in sorted(params.items()):
+		for value in (v if isinstance(v,list) else [v]):
+			query.append((k,str(value).lower() if isinstance(value,bool) else value))
+	url='http://%s/esg-search/search?%s'%(site,urlencode(query))
+	resp=urlopen(url,timeout=timeout)
+	try:
+		return json.loads(resp.read().decode('utf-8'))
+	finally:
+		resp.close()
+
+def count(site,timeout=120,**constraints):
+	return search(site,constraints,timeout)['response']['numFound']
+
+def facet_counts(site,facets,timeout=120,**constraints):
+	"""{facet: {value: count}} of the datasets matching the constraints"""
+	params=dict(constraints,facets=','.join(facets))
+	js=search(site,params,timeout)
+	result={}
+	for facet in facets:
+		values=js['facet_counts']['facet_fields'].get(facet,[])
+		result[facet]=dict(zip(values[::2],values[1::2]))
+	return result
+
+def pivot_counts(site,facets,timeout=120,**constraints):
+	"""{(value, ...): count} of a facet.pivot on the facets over the whole
+	federation. The esg-search API has no pivots, so the query goes to
+	the index's Solr with the shards esg-search distributes to."""
+	shards=search(site,dict(distrib=True),timeout)['responseHeader']['params']['shards']
+	query=[('q','*:*'),('wt','json'),('rows','0'),('facet','true'),('facet.limit','-1'),
+		('facet.mincount','1'),('facet.pivot',','.join(facets)),('fq','type:Dataset'),('shards',shards)]
+	for k,v in sorted(constraints.items()):
+		query.append(('fq','%s:"%s"'%(k,str(v).lower() if isinstance(v,bool) else v)))
+	resp=urlopen('http://%s/solr/datasets/select?%s'%(site,urlencode(query)),timeout=timeout)
+	try:
+		js=json.loads(resp.read().decode('utf-8'))
+	finally:
+		resp.close()
+	result={}
+	def walk(entries,path):
+		for entry in entries:
+			if entry.get('pivot'):
+				walk(entry['pivot'],path+(entry['value'],))
+			elif len(path)==len(facets)-1:
+				result[path+(entry['value'],)]=entry['count']
+	walk(js['facet_counts']['facet_pivot'][','.join(facets)],())
+	return result
+
+def ids(site,page=10000,timeout=120,**constraints):
+	"""Dataset ids matching the constraints, paged with offset"""
+	result=[]
+	while True:
+		js=search(site,dict(constraints,fields='id',limit=page,offset=len(result)),timeout)
+		docs=js['response']['docs']
+		result.extend(d['id'] for d in docs)
+		if not docs or len(result)>=js['response']['numFound']:
+			return result
+
+def parallel(func,items,workers=8):
+	"""[(item, result)] of func over items run in threads; the result is
+	None for the items whose query failed"""
+	def call(item):
+		try:
+			return item,func(item)
+		except Exception as ex:
+			print('%s failed to respond: %s'%(item,ex),file=sys.stderr)
+			return item,None
+	pool=Pool(max(1,min(workers,len(items))))
+	try:
+		return pool.map(call,items)
+	finally:
+		pool.close()
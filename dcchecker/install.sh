@@ -59,7 +59,7 @@ echo "$cronmin */6 * * * root bash $quoted_inst/runquery.sh 0" >>checkdscount;
 
 #Copy section
 
-cp cordexnodes cmip5nodes fednodes query.py activatedchecks LICENSE "$instdir/";
+cp cordexnodes cmip5nodes fednodes query.py esgsearch.py consistency.py reconcile.py replication.py activatedchecks LICENSE "$instdir/";
 cp runquery.sh-tocopy "$instdir/runquery.sh";
 cp runsitespecificquery.sh-tocopy "$instdir/runsitespecificquery.sh";
 
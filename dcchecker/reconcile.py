@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# Find the datasets one index node has and another lacks without listing every id
+from __future__ import print_function
+import argparse,sys
+from esgsearch import count,facet_counts,ids,parallel
+
+FACETS='institute,model,experiment,time_frequency,realm,cmor_table,ensemble'
+
+class Reconciler(object):
+	"""Compares the datasets of two index nodes partition by partition.
+
+	A partition is a set of facet constraints. Both indexes facet it on
+	the next partition facet, and only the children whose counts differ
+	are split further, so matching subtrees cost one query per index.
+	A facet whose counts do not add up to the partition's, because some
+	datasets lack it or have several values, is skipped and the
+	partition is split on the following facet instead. Ids are listed
+	only for the small or last level partitions that still differ.
+	"""
+
+	def __init__(self,index_a,index_b,facets,leaf_size=1000,workers=8,**constraints):
+		self.indexes=(index_a,index_b)
+		self.facets=facets
+		self.leaf_size=leaf_size
+		self.workers=workers
+		self.constraints=constraints
+		self.queries=0
+
+	def run(self,func,jobs):
+		self.queries+=len(jobs)
+		results=parallel(func,jobs,self.workers)
+		failed=[job for job,result in results if result is None]
+		if failed:
+			raise RuntimeError('%d queries failed'%len(failed))
+		return [result for job,result in results]
+
+	def children(self,level,partitions):
+		"""Facet counts of every partition on both indexes"""
+		facet=self.facets[level]
+		def query(job):
+			index,partition=job
+			return facet_counts(index,[facet],**dict(self.constraints,**partition))[facet]
+		results=self.run(query,[(index,p) for p,counts in partitions for index in self.indexes])
+		return [(results[2*k],results[2*k+1]) for k in range(len(partitions))]
+
+	def leaves(self,partitions):
+		"""(only on index a, only on index b) ids of the partitions"""
+		def query(job):
+			index,partition=job
+			return ids(index,**dict(self.constraints,**partition))
+		results=self.run(query,[(index,p) for p in partitions for index in self.indexes])
+		only_a=set()
+		only_b=set()
+		for k in range(len(partitions)):
+			a,b=set(results[2*k]),set(results[2*k+1])
+			only_a|=a-b
+			only_b|=b-a
+		return only_a,only_b
+
+	def reconcile(self):
+		# partitions still to split, with their counts on both indexes
+		totals=self.run(lambda index:count(index,**self.constraints),list(self.indexes))
+		pending=[({},tuple(totals))]
+		leaves=[]
+		for level in range(len(self.facets)):
+			if not pending:
+				break
+			split=[]
+			for (partition,counts),(a,b) in zip(pending,self.children(level,pending)):
+				if sum(a.values())!=counts[0] or sum(b.values())!=counts[1]:
+					# datasets without the facet, or with several values, are not in exactly one child
+					split.append((partition,counts))
+					continue
+				for value in sorted(set(a)|set(b)):
+					n=(a.get(value,0),b.get(value,0))
+					if n[0]==n[1]:
+						continue
+					child=dict(partition,**{self.facets[level]:value})
+					if max(n)<=self.leaf_size or level==len(self.facets)-1:
+						leaves.append(child)
+					else:
+						split.append((child,n))
+			pending=split
+		leaves.extend(p for p,counts in pending)
+		return self.leaves(leaves),len(leaves)
+
+def main():
+	aparser=argparse.ArgumentParser(description='List the datasets of a project present on only one of two index nodes')
+	aparser.add_argument('index_a', type=str)
+	aparser.add_argument('index_b', type=str)
+	aparser.add_argument('--proj', type=str,required=True)
+	aparser.add_argument('--datanode', type=str,default=None,help='Only the datasets published on this data node')
+	aparser.add_argument('--facets', type=str,default=FACETS,help='Facets partitioned on, in order (default %s)'%FACETS)
+	aparser.add_argument('--leaf-size', type=int,default=1000,help='List the ids of differing partitions up to this many datasets (default 1000)')
+	aparser.add_argument('--local', action='store_true',help='Compare only the local shards (distrib=false)')
+	aparser.add_argument('--workers', type=int,default=8,help='Queries run in parallel (default 8)')
+	args=aparser.parse_args()
+
+	constraints=dict(project=args.proj,replica=False,distrib=not args.local)
+	if args.datanode:
+		constraints['data_node']=args.datanode
+	rec=Reconciler(args.index_a,args.index_b,args.facets.split(','),args.leaf_size,args.workers,**constraints)
+	try:
+		(only_a,only_b),nleaves=rec.reconcile()
+	except RuntimeError as ex:
+		print('Reconciliation failed: %s'%ex,file=sys.stderr)
+		sys.exit(2)
+	for i in sorted(only_a):
+		print('%s\tonly on %s'%(i,args.index_a))
+	for i in sorted(only_b):
+		print('%s\tonly on %s'%(i,args.index_b))
+	print('%d datasets only on %s, %d only on %s; %d queries, %d partitions listed'%(
+		len(only_a),args.index_a,len(only_b),args.index_b,rec.queries,nleaves),file=sys.stderr)
+	sys.exit(1 if only_a or only_b else 0)
+
+if __name__=='__main__':
+	main()
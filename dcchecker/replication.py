@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# How far the replicas at each data node are behind the original datasets
+from __future__ import print_function
+import argparse,json,sys
+from esgsearch import pivot_counts
+
+GROUPS='institute,model,experiment'
+
+def gather(index,proj,groups,timeout=300,**constraints):
+	"""(masters, replicas): {group: count} of the original datasets and
+	{(group, data_node): count} of their replicas, a group being a tuple
+	of values of the group facets.
+
+	Both come from one facet.pivot on replica, the group facets and
+	data_node over the whole federation, asked of one index.
+	"""
+	constraints=dict(constraints,project=proj,latest=True)
+	masters={}
+	replicas={}
+	for path,n in pivot_counts(index,['replica']+groups+['data_node'],timeout,**constraints).items():
+		replica,group,dn=path[0],path[1:-1],path[-1]
+		if replica:
+			replicas[(group,dn)]=n
+		else:
+			masters[group]=masters.get(group,0)+n
+	return masters,replicas
+
+def lag(masters,replicas,min_lag=1):
+	"""[(data_node, institute, replicas, masters)] of the replica sites at
+	least min_lag datasets behind, the furthest behind first.
+
+	A site is only compared with the originals of the groups it holds
+	replicas of, so replicating part of an institute is not lag; the
+	counts are summed per site and first group facet.
+	"""
+	sites={}
+	for (group,dn),n in replicas.items():
+		total=sites.setdefault((dn,group[0]),[0,0])
+		total[0]+=n
+		total[1]+=masters.get(group,0)
+	behind=[(dn,inst,n,m) for (dn,inst),(n,m) in sites.items() if m-n>=min_lag]
+	return sorted(behind,key=lambda b:(b[2]-b[3],b[0],b[1]))
+
+def main():
+	aparser=argparse.ArgumentParser(description='Report the data nodes whose replicas of a project are behind the originals')
+	aparser.add_argument('--proj', type=str,required=True)
+	aparser.add_argument('--index', type=str,default='esgf-node.llnl.gov',help='Index node queried for the whole federation (default esgf-node.llnl.gov)')
+	aparser.add_argument('--groups', type=str,default=GROUPS,help='Facets the replicas are compared on, the first one reported (default %s)'%GROUPS)
+	aparser.add_argument('--min-lag', type=int,default=1,help='Report replica sites at least this many datasets behind (default 1)')
+	aparser.add_argument('--fail-on-lag', action='store_true',help='Exit with 1 when a replica site is behind')
+	aparser.add_argument('--format', choices=('text','json'),default='text')
+	args=aparser.parse_args()
+
+	try:
+		masters,replicas=gather(args.index,args.proj,args.groups.split(','))
+	except Exception as ex:
+		print('%s failed to respond: %s'%(args.index,ex),file=sys.stderr)
+		sys.exit(2)
+	behind=lag(masters,replicas,args.min_lag)
+	if args.format=='json':
+		json.dump([dict(data_node=dn,institute=inst,replicas=n,originals=m) for dn,inst,n,m in behind],sys.stdout,indent=1,sort_keys=True)
+		print()
+	else:
+		print('Replicas of project %s behind the originals (latest versions)'%args.proj)
+		for dn,inst,n,m in behind:
+			print('%-35s %-20s %8d of %8d replicated, %8d behind (%.1f%%)'%(dn,inst,n,m,m-n,100.0*(m-n)/max(m,1)))
+		if not behind:
+			print('All replica sites are up to date')
+	sys.exit(1 if behind and args.fail_on_lag else 0)
+
+if __name__=='__main__':
+	main()
@@ -29,6 +29,10 @@ dostuff() {
 	fi
 	echo "Now running site-specific dataset count checks for Project $prj";
 	bash runsitespecificquery.sh $prj $prjfile $firsttime
+	echo "Now comparing the data node counts of the index nodes for Project $prj";
+	python consistency.py --proj $prj --datanodes $prjfile
+	echo "Now checking the replicas of Project $prj";
+	python replication.py --proj $prj
 }
 
 while read ln; do
@@ -0,0 +1,53 @@
+import reconcile
+
+# datasets of two indexes: id -> facets, realm being multi-valued
+INDEXES={
+	'a':{'d1':dict(institute='NCAR',realm=['atmos']),
+		'd2':dict(institute='NCAR',realm=['atmos','land']),
+		'd3':dict(institute='NCAR',realm=['ocean']),
+		'd4':dict(institute='IPSL',realm=['atmos'])},
+	'b':{'d1':dict(institute='NCAR',realm=['atmos']),
+		'd3':dict(institute='NCAR',realm=['ocean']),
+		'd4':dict(institute='IPSL',realm=['atmos']),
+		'd5':dict(institute='IPSL',realm=['atmos'])},
+}
+
+def matching(index,constraints):
+	def match(facets,name,value):
+		values=facets.get(name,[])
+		return value in (values if isinstance(values,list) else [values])
+	return dict((i,f) for i,f in INDEXES[index].items()
+		if all(match(f,k,v) for k,v in constraints.items() if k in ('institute','realm')))
+
+def fake(monkeypatch,listed):
+	def facet_counts(index,facets,**constraints):
+		result=dict((facet,{}) for facet in facets)
+		for f in matching(index,constraints).values():
+			for facet in facets:
+				values=f[facet] if isinstance(f[facet],list) else [f[facet]]
+				for v in values:
+					result[facet][v]=result[facet].get(v,0)+1
+		return result
+	def ids(index,**constraints):
+		found=sorted(matching(index,constraints))
+		listed.append((index,len(found)))
+		return found
+	monkeypatch.setattr(reconcile,'count',lambda index,**c:len(matching(index,c)))
+	monkeypatch.setattr(reconcile,'facet_counts',facet_counts)
+	monkeypatch.setattr(reconcile,'ids',ids)
+
+def test_reconcile_finds_the_differences(monkeypatch):
+	listed=[]
+	fake(monkeypatch,listed)
+	rec=reconcile.Reconciler('a','b',['institute','realm'],leaf_size=1,workers=2,project='CMIP5')
+	(only_a,only_b),nleaves=rec.reconcile()
+	assert (only_a,only_b)==(set(['d2']),set(['d5']))
+
+def test_multi_valued_facet_is_skipped(monkeypatch):
+	listed=[]
+	fake(monkeypatch,listed)
+	# realm does not partition the datasets, so the split goes on to institute
+	rec=reconcile.Reconciler('a','b',['realm','institute'],leaf_size=1,workers=2,project='CMIP5')
+	(only_a,only_b),nleaves=rec.reconcile()
+	assert (only_a,only_b)==(set(['d2']),set(['d5']))
+	assert nleaves==2 and max(n for _index,n in listed)==3
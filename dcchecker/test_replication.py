@@ -0,0 +1,33 @@
+import io,json
+import esgsearch,replication
+
+def pivot(*entries):
+	return [dict(value=v,count=c,pivot=pivot(*sub)) if sub else dict(value=v,count=c) for v,c,sub in entries]
+
+RESPONSE=dict(facet_counts=dict(facet_pivot={'replica,institute,model,data_node':pivot(
+	(False,30,[('NCAR',30,[('CESM1',20,[('ncar.ucar.edu',20,[])]),('CCSM4',10,[('ncar.ucar.edu',10,[])])])]),
+	(True,12,[('NCAR',12,[('CESM1',12,[('dkrz.de',8,[]),('llnl.gov',4,[])])])]),
+)}))
+
+def fake(monkeypatch,urls):
+	def urlopen(url,timeout):
+		urls.append(url)
+		return io.BytesIO(json.dumps(RESPONSE).encode('utf-8'))
+	monkeypatch.setattr(esgsearch,'search',lambda site,params,timeout:dict(responseHeader=dict(params=dict(shards='s1,s2'))))
+	monkeypatch.setattr(esgsearch,'urlopen',urlopen)
+
+def test_gather_is_one_pivot(monkeypatch):
+	urls=[]
+	fake(monkeypatch,urls)
+	masters,replicas=replication.gather('index','CMIP5',['institute','model'])
+	assert masters=={('NCAR','CESM1'):20,('NCAR','CCSM4'):10}
+	assert replicas=={(('NCAR','CESM1'),'dkrz.de'):8,(('NCAR','CESM1'),'llnl.gov'):4}
+	assert len(urls)==1 and 'facet.pivot=replica%2Cinstitute%2Cmodel%2Cdata_node' in urls[0]
+	assert 'fq=latest%3A%22true%22' in urls[0] and 'shards=s1%2Cs2' in urls[0]
+
+def test_lag_ignores_groups_a_site_does_not_replicate():
+	masters={('NCAR','CESM1'):20,('NCAR','CCSM4'):10,('IPSL','CM5A'):5}
+	replicas={(('NCAR','CESM1'),'dkrz.de'):20,(('NCAR','CESM1'),'llnl.gov'):4,
+		(('NCAR','CCSM4'),'llnl.gov'):10,(('IPSL','CM5A'),'llnl.gov'):4}
+	assert replication.lag(masters,replicas)==[('llnl.gov','NCAR',14,30),('llnl.gov','IPSL',4,5)]
+	assert replication.lag(masters,replicas,min_lag=2)==[('llnl.gov','NCAR',14,30)]
@@ -0,0 +1,249 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+import requests
+
+UPDATE_URL = 'https://esgf-node.llnl.gov/esg-search/ws/update'
+
+
+class Update(object):
+    """One <update>: a query selecting records and the fields to change."""
+
+    def __init__(self, query, fields):
+        self.query = query
+        self.fields = fields
+
+    def xml(self):
+        fields = ''.join('<field name="{}">{}</field>'.format(
+            escape(name), ''.join('<value>{}</value>'.format(escape(v)) for v in values))
+            for name, values in self.fields)
+        return '<update><query>{}</query>{}</update>'.format(escape(self.query), fields)
+
+    def key(self, core, action):
+        """Journal key of this update applied to `core` with `action`."""
+        return hashlib.sha1('{} {} {}'.format(core, action, self.xml()).encode('utf-8')).hexdigest()
+
+
+def updates_document(core, action, updates):
+    return '<updates core="{}" action="{}">\n{}\n</updates>\n'.format(
+        core, action, '\n'.join(u.xml() for u in updates))
+
+
+def parse_fields(assignments):
+    # name=value options, repeated names give several values
+    fields = {}
+    for assignment in assignments:
+        name, _sep, value = assignment.partition('=')
+        fields.setdefault(name, []).append(value)
+    return list(fields.items())
+
+
+def read_lines(path):
+    with (sys.stdin if path == '-' else open(path)) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def read_xml(path):
+    """(core, action, updates) of an <updates> document such as update.xml."""
+    root = ET.parse(path).getroot()
+    updates = []
+    for update in root.iter('update'):
+        fields = [(field.get('name'), [v.text or '' for v in field.iter('value')])
+                  for field in update.iter('field')]
+        updates.append(Update(update.findtext('query').strip(), fields))
+    return root.get('core', 'datasets'), root.get('action', 'set'), updates
+
+
+class Journal(object):
+    """Append-only record of the updates applied or failed, one JSON line
+    each, so an interrupted run can be resumed without repeating work."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        self.failed = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by an interrupted run
+                        continue
+                    if entry['status'] == 'done':
+                        self.done.add(entry['key'])
+                        self.failed.pop(entry['key'], None)
+                    else:
+                        self.failed[entry['key']] = entry.get('error')
+        self.file = open(path, 'a') if path else None
+
+    def record(self, core, action, updates, status, error=None):
+        keys = [u.key(core, action) for u in updates]
+        with self.lock:
+            for key in keys:
+                if status == 'done':
+                    self.done.add(key)
+                else:
+                    self.failed[key] = error
+            if self.file is not None:
+                self.file.write(''.join(json.dumps(dict(key=key, core=core, action=action, query=u.query,
+                                                        status=status, error=error)) + '\n'
+                                        for key, u in zip(keys, updates)))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class BulkUpdater(object):
+    """Posts <updates> documents over one client certificate session.
+
+    A chunk that keeps failing after `retries` attempts is split in two
+    and each half posted again, down to single updates, so a bad record
+    only fails itself.
+    """
+
+    def __init__(self, session, url, core, action, journal, retries=2, backoff=2.0, timeout=600):
+        self.session = session
+        self.url = url
+        self.core = core
+        self.action = action
+        self.journal = journal
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def post(self, updates):
+        """None when the index accepted the document, else the error."""
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                resp = self.session.post(self.url, data=updates_document(self.core, self.action, updates),
+                                         headers={'Content-Type': 'text/xml'}, timeout=self.timeout)
+                if resp.status_code == 200:
+                    return None
+                error = 'HTTP {}: {}'.format(resp.status_code, resp.text.strip()[:200])
+            except requests.RequestException as ex:
+                error = str(ex)
+        return error
+
+    def apply(self, updates):
+        """(applied, failed) counts of a chunk, bisecting on failure."""
+        error = self.post(updates)
+        if error is None:
+            self.journal.record(self.core, self.action, updates, 'done')
+            return len(updates), 0
+        if len(updates) == 1:
+            self.journal.record(self.core, self.action, updates, 'failed', error)
+            print("Failed: {}: {}".format(updates[0].query, error), file=sys.stderr)
+            return 0, 1
+        half = len(updates) // 2
+        ok1, bad1 = self.apply(updates[:half])
+        ok2, bad2 = self.apply(updates[half:])
+        return ok1 + ok2, bad1 + bad2
+
+
+def make_session(cert, key=None, ca=None, insecure=False, workers=4):
+    session = requests.Session()
+    session.cert = (cert, key) if key else cert
+    session.verify = False if insecure else (ca or True)
+    # keep one connection per worker alive between the chunks
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Apply large sets of atomic metadata updates to esg-search")
+    parser.add_argument("inputs", nargs="*", default=[],
+                        help="<updates> XML documents such as update.xml, merged in order")
+    parser.add_argument("--ids", action="append", default=[], help="File of dataset (or file) ids, one per line, '-' for stdin")
+    parser.add_argument("--queries", action="append", default=[], help="File of ESGF queries, one per line")
+    parser.add_argument("--set", dest="fields", action="append", default=[], metavar="FIELD=VALUE",
+                        help="Field to change for --ids and --queries, e.g. latest=false")
+    parser.add_argument("--core", default="datasets", choices=("datasets", "files"),
+                        help="Core of --ids and --queries (default datasets)")
+    parser.add_argument("--action", default="set", choices=("set", "add", "remove"),
+                        help="Action of --ids and --queries (default set)")
+    parser.add_argument("--url", default=UPDATE_URL, help="Update service (default {})".format(UPDATE_URL))
+    parser.add_argument("--cert", default=os.path.expanduser("~/.globus/certificate-file"),
+                        help="Client certificate, e.g. from myproxy-logon (default ~/.globus/certificate-file)")
+    parser.add_argument("--key", default=None, help="Private key when not in the certificate file")
+    parser.add_argument("--ca", default=None, help="CA bundle to verify the index node with")
+    parser.add_argument("--insecure", action="store_true", help="Do not verify the index node certificate")
+    parser.add_argument("--chunk", type=int, default=500, help="Updates per document (default 500)")
+    parser.add_argument("--workers", type=int, default=4, help="Documents posted concurrently (default 4)")
+    parser.add_argument("--retries", type=int, default=2, help="Attempts per document before bisecting (default 2)")
+    parser.add_argument("--journal", default=None, help="Progress journal, updates already done there are skipped")
+    parser.add_argument("--retry-failed", action="store_true", help="Also retry updates that failed in the journal")
+    parser.add_argument("--dry-run", metavar="DIR", default=None, help="Write the documents to DIR instead of posting")
+    args = parser.parse_args()
+
+    batches = []
+    for path in args.inputs:
+        batches.append(read_xml(path))
+    if args.ids or args.queries:
+        if not args.fields:
+            parser.error("--ids and --queries need at least one --set")
+        fields = parse_fields(args.fields)
+        updates = [Update('id=' + i, fields) for path in args.ids for i in read_lines(path)]
+        updates += [Update(q, fields) for path in args.queries for q in read_lines(path)]
+        batches.append((args.core, args.action, updates))
+    if not batches:
+        parser.error("nothing to update")
+
+    journal = Journal(args.journal)
+    chunks = []
+    skipped = 0
+    for core, action, updates in batches:
+        todo = [u for u in updates if u.key(core, action) not in journal.done and
+                (args.retry_failed or u.key(core, action) not in journal.failed)]
+        skipped += len(updates) - len(todo)
+        chunks += [(core, action, todo[k:k + args.chunk]) for k in range(0, len(todo), args.chunk)]
+
+    if args.dry_run:
+        os.makedirs(args.dry_run, exist_ok=True)
+        for n, (core, action, updates) in enumerate(chunks):
+            with open(os.path.join(args.dry_run, 'updates-{:05d}.xml'.format(n)), 'w') as f:
+                f.write(updates_document(core, action, updates))
+        print("{} documents written to {}, {} updates skipped".format(len(chunks), args.dry_run, skipped))
+        return
+
+    if not os.path.exists(args.cert):
+        parser.error("no client certificate {}, run myproxy-logon or give --cert".format(args.cert))
+    session = make_session(args.cert, args.key, args.ca, args.insecure, args.workers)
+    updaters = {}
+    for core, action, _updates in chunks:
+        updaters.setdefault((core, action), BulkUpdater(session, args.url, core, action, journal, args.retries))
+
+    start = time.time()
+    applied = failed = 0
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(updaters[(core, action)].apply, updates) for core, action, updates in chunks]
+        for future in concurrent.futures.as_completed(futures):
+            ok, bad = future.result()
+            applied += ok
+            failed += bad
+    journal.close()
+
+    print("{} updates applied, {} failed, {} skipped in {:.0f} s".format(applied, failed, skipped, time.time() - start))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import concurrent.futures
+import sys
+
+from bulk_update import Update
+from plan_update import SOLR_URL, Planner, discover_shards, write_batches
+
+
+class DuplicateScanner(object):
+    """Finds the master_ids with more than one latest, non-retracted
+    original dataset.
+
+    The index is partitioned on a facet such as institution_id and every
+    partition is scanned concurrently.  The master_ids of a partition seen
+    more than once are found by a distributed master_id facet with
+    facet.mincount=2, so the versions of a dataset sitting on different
+    shards are counted together by Solr, and documents are only fetched
+    for those master_ids.
+    """
+
+    def __init__(self, planner, project, partition='institution_id', page=10000):
+        self.planner = planner
+        self.project = project
+        self.partition = partition
+        self.page = page
+        self.shards = ','.join(s + '/datasets' for s in planner.shards)
+        self.filters = ['project:"{}"'.format(project), 'latest:true', 'replica:false', '-retracted:true']
+
+    def select(self, fq, rows=0, **params):
+        return self.planner.select('datasets', dict(params, fq=self.filters + fq, shards=self.shards,
+                                                    rows=rows))
+
+    def stream(self, fq, fl, sort):
+        """Documents matching `fq`, paged with a cursor; `sort` must end on id."""
+        cursor = '*'
+        while True:
+            js = self.select(fq, self.page, fl=fl, sort=sort, cursorMark=cursor)
+            for doc in js['response']['docs']:
+                yield doc
+            if js['nextCursorMark'] == cursor:
+                return
+            cursor = js['nextCursorMark']
+
+    def facet(self, fq, field, mincount=1):
+        js = self.select(fq, **{'facet': 'true', 'facet.field': field, 'facet.limit': -1,
+                                'facet.mincount': mincount, 'facet.sort': 'index'})
+        return js['facet_counts']['facet_fields'][field][::2]
+
+    def partitions(self):
+        # None stands for the datasets without a partition value
+        return self.facet([], self.partition) + [None]
+
+    def duplicates(self, value):
+        """master_ids with several latest versions in one partition."""
+        if value is None:
+            fq = ['-{}:[* TO *]'.format(self.partition)]
+        else:
+            fq = ['{}:"{}"'.format(self.partition, value)]
+        return self.facet(fq, 'master_id', mincount=2)
+
+    def versions(self, master_ids):
+        """{master_id: [(version, _timestamp, id), ...]} of the latest datasets."""
+        fq = ['master_id:({})'.format(' OR '.join('"{}"'.format(m) for m in master_ids))]
+        result = {}
+        for doc in self.stream(fq, 'id,master_id,version,_timestamp', 'id asc'):
+            result.setdefault(doc['master_id'], []).append((str(doc.get('version', '')), doc.get('_timestamp', ''),
+                                                            doc['id']))
+        return result
+
+    def scan(self, workers=8, group=50):
+        """[(master_id, kept id, [superseded ids])] over the whole project."""
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            master_ids = sorted(m for found in pool.map(self.duplicates, self.partitions()) for m in found)
+            groups = [master_ids[k:k + group] for k in range(0, len(master_ids), group)]
+            result = []
+            for versions in pool.map(self.versions, groups):
+                for master_id, docs in sorted(versions.items()):
+                    # newest version first, numerically when versions are vYYYYMMDD or digits
+                    docs.sort(key=lambda d: (version_key(d[0]), d[1]), reverse=True)
+                    result.append((master_id, docs[0][2], [d[2] for d in docs[1:]]))
+            return result
+
+
+def version_key(version):
+    digits = version.lstrip('v')
+    if digits.isdigit():
+        return (1, int(digits), version)
+    return (0, 0, version)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Find datasets with several latest versions and write the "
+                                                 "updates setting latest=false on the older ones")
+    parser.add_argument("project", help="Project to scan, e.g. input4MIPs")
+    parser.add_argument("--solr", default=SOLR_URL, help="Solr base URL (default {})".format(SOLR_URL))
+    parser.add_argument("--shards", default=None,
+                        help="Comma separated host:port/solr shards (default discovered from esg-search)")
+    parser.add_argument("--partition", default="institution_id",
+                        help="Facet the scan is partitioned on (default institution_id)")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent requests (default 8)")
+    parser.add_argument("--output", "-o", metavar="DIR", default=None,
+                        help="Write <updates> documents for bulk_update.py to DIR")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Updates per document (default 1000)")
+    args = parser.parse_args()
+
+    shards = args.shards.split(',') if args.shards else discover_shards()
+    scanner = DuplicateScanner(Planner(args.solr, shards), args.project, args.partition)
+    duplicates = scanner.scan(args.workers)
+
+    superseded = []
+    for master_id, kept, older in duplicates:
+        print("{}\tkeep {}\tsupersede {}".format(master_id, kept, ' '.join(older)))
+        superseded += older
+    print("{} datasets with several latest versions, {} versions to supersede".format(
+        len(duplicates), len(superseded)), file=sys.stderr)
+
+    if args.output and superseded:
+        batches = write_batches(args.output, args.project + '-latest', 'datasets', 'set',
+                                Update('', [('latest', ['false'])]), superseded, args.batch_size)
+        print("{} update documents written to {}".format(len(batches), args.output), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import urllib.parse
+
+import requests
+
+from bulk_update import Update, read_xml, updates_document
+
+SOLR_URL = 'https://esgf-node.llnl.gov/solr'
+SEARCH_URL = 'https://esgf-node.llnl.gov/esg-search/search/?limit=0&format=application%2Fsolr%2Bjson'
+
+# Search API parameters that are not facet constraints
+KEYWORDS = {'type', 'distrib', 'limit', 'offset', 'format', 'fields', 'sort', 'facets', 'replica', 'latest',
+            'shards', 'query'}
+
+
+def solr_filters(query):
+    """Solr fq parameters of an ESGF search query such as
+    project=input4MIPs&institution=PCMDI; repeated fields are OR-ed."""
+    values = {}
+    free = []
+    for name, value in urllib.parse.parse_qsl(query):
+        if name == 'query':
+            free.append(value)
+        elif name in ('replica', 'latest'):
+            values.setdefault(name, []).append(value.lower())
+        elif name not in KEYWORDS:
+            values.setdefault(name, []).append(value)
+    fq = ['{}:({})'.format(name, ' OR '.join('"{}"'.format(v.replace('"', r'\"')) for v in vals))
+          for name, vals in sorted(values.items())]
+    return fq + ['({})'.format(q) for q in free]
+
+
+def discover_shards(timeout=30):
+    """host:port/solr/<core> addresses behind the index, without the core."""
+    req = requests.get(SEARCH_URL, timeout=timeout)
+    req.raise_for_status()
+    shards = json.loads(req.text)['responseHeader']['params']['shards'].split(',')
+    return [s.rsplit('/', 1)[0] for s in shards]
+
+
+class Planner(object):
+    """Resolves updates against the index with count-only requests."""
+
+    def __init__(self, solr_url, shards, session=None, timeout=120):
+        self.solr_url = solr_url.rstrip('/')
+        self.shards = shards
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    def select(self, core, params):
+        req = self.session.get('{}/{}/select'.format(self.solr_url, core), timeout=self.timeout,
+                               params=dict(params, q='*:*', wt='json'))
+        req.raise_for_status()
+        return json.loads(req.text)
+
+    def count(self, core, query, shard=None):
+        params = dict(fq=solr_filters(query), rows=0)
+        if shard is not None:
+            params['shards'] = shard + '/' + core
+        return self.select(core, params)['response']['numFound']
+
+    def counts(self, cores, updates, workers=8):
+        """{(update index, core, shard): count} for every shard and core."""
+        jobs = [(n, core, shard) for n in range(len(updates)) for core in cores for shard in self.shards]
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            counts = pool.map(lambda job: self.count(job[1], updates[job[0]].query, job[2]), jobs)
+            return dict(zip(jobs, counts))
+
+    def total(self, core, query):
+        """Records matching `query` in `core`, summed over the shards."""
+        return sum(self.count(core, query, shard) for shard in self.shards)
+
+    def ranges(self, core, query, size=5000):
+        """(first id, last id, records) of consecutive runs of `size`
+        records matching `query`, paged with one cursor over all the shards
+        so that the runs do not overlap across shards."""
+        params = dict(fq=solr_filters(query), fl='id', sort='id asc', rows=size,
+                      shards=','.join(shard + '/' + core for shard in self.shards))
+        cursor = '*'
+        while True:
+            js = self.select(core, dict(params, cursorMark=cursor))
+            docs = js['response']['docs']
+            if docs:
+                yield docs[0]['id'], docs[-1]['id'], len(docs)
+            if js['nextCursorMark'] == cursor:
+                break
+            cursor = js['nextCursorMark']
+
+
+def id_range(first, last):
+    """Free text query parameter of the ids from `first` to `last`."""
+    value = 'id:["{}" TO "{}"]'.format(first.replace('"', r'\"'), last.replace('"', r'\"'))
+    return 'query=' + urllib.parse.quote(value)
+
+
+def write_document(directory, prefix, n, core, action, updates):
+    path = os.path.join(directory, '{}-{:05d}.xml'.format(prefix, n))
+    with open(path + '.tmp', 'w') as f:
+        f.write(updates_document(core, action, updates))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def write_ranges(directory, prefix, core, action, update, ranges):
+    """Split one update into <updates> documents for bulk_update.py, one
+    per id range of Planner.ranges, restricting the update's query to the
+    ids of its range."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for first, last, _records in ranges:
+        query = '&'.join(q for q in (update.query, id_range(first, last)) if q)
+        paths.append(write_document(directory, prefix, len(paths), core, action, [Update(query, update.fields)]))
+    return paths
+
+
+def write_batches(directory, prefix, core, action, update, ids, size):
+    """Split one update into <updates> documents of at most `size` records,
+    each selecting its records by id, for bulk_update.py."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for k in range(0, len(ids), size):
+        updates = [Update('id=' + record_id, update.fields) for record_id in ids[k:k + size]]
+        paths.append(write_document(directory, prefix, len(paths), core, action, updates))
+    return paths
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Count the records esg-search updates would change, per shard and "
+                                                 "core, before applying them")
+    parser.add_argument("inputs", nargs="+", help="<updates> XML documents such as update.xml")
+    parser.add_argument("--solr", default=SOLR_URL, help="Solr base URL (default {})".format(SOLR_URL))
+    parser.add_argument("--shards", default=None,
+                        help="Comma separated host:port/solr shards (default discovered from esg-search)")
+    parser.add_argument("--cores", default="datasets,files", help="Cores to count in (default datasets,files)")
+    parser.add_argument("--max-records", type=int, default=10000,
+                        help="Reject updates changing more records of their core than this (default 10000)")
+    parser.add_argument("--split", metavar="DIR", default=None,
+                        help="Split oversized updates into id range batches written to DIR instead of rejecting them")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Records per batch with --split (default 5000)")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent count requests (default 8)")
+    args = parser.parse_args()
+
+    shards = args.shards.split(',') if args.shards else discover_shards()
+    cores = args.cores.split(',')
+    planner = Planner(args.solr, shards)
+
+    rejected = 0
+    for path in args.inputs:
+        core, action, updates = read_xml(path)
+        counts = planner.counts(cores, updates, args.workers)
+        for n, update in enumerate(updates):
+            print("{} update {}: {}".format(path, n, update.query))
+            for c in cores:
+                for shard in shards:
+                    print("  {:8s} {:40s} {:10d}".format(c, shard, counts[(n, c, shard)]))
+                print("  {:8s} {:40s} {:10d}".format(c, 'total', sum(counts[(n, c, s)] for s in shards)))
+
+            total = sum(counts[(n, core, s)] for s in shards) if core in cores else planner.total(core, update.query)
+            if total <= args.max_records:
+                continue
+            if args.split is None:
+                print("  rejected: {} {} records, more than {}".format(total, core, args.max_records))
+                rejected += 1
+                continue
+            prefix = '{}-{}'.format(os.path.splitext(os.path.basename(path))[0], n)
+            batches = write_ranges(args.split, prefix, core, action, update,
+                                   planner.ranges(core, update.query, args.batch_size))
+            print("  split into {} batches in {}".format(len(batches), args.split))
+    sys.exit(1 if rejected else 0)
+
+
+if __name__ == '__main__':
+    main()
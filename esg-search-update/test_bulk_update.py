@@ -0,0 +1,15 @@
+from bulk_update import Journal, Update
+
+
+def test_journal_keys_include_core_and_action(tmp_path):
+    path = str(tmp_path / 'journal')
+    update = Update('id=a', [('latest', ['false'])])
+    journal = Journal(path)
+    journal.record('datasets', 'set', [update], 'done')
+    journal.close()
+
+    journal = Journal(path)
+    assert update.key('datasets', 'set') in journal.done
+    assert update.key('files', 'set') not in journal.done
+    assert update.key('datasets', 'add') not in journal.done
+    journal.close()
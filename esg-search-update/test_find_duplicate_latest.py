@@ -0,0 +1,78 @@
+import collections
+import re
+
+from find_duplicate_latest import DuplicateScanner, version_key
+
+
+def doc(master_id, version, institution='NCAR'):
+    d = dict(id='{}.v{}|node'.format(master_id, version), master_id=master_id, version=version,
+             _timestamp='2020-01-01T00:00:00Z')
+    if institution is not None:
+        d['institution_id'] = institution
+    return d
+
+
+class FakePlanner(object):
+    """Applies the partition and master_id filters, facets, sorts and pages
+    with a cursor over the documents of the shards named in `shards`."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.shards = sorted(docs)
+        self.requests = []
+
+    def select(self, core, params):
+        self.requests.append(params)
+        docs = [d for s in params['shards'].split(',') for d in self.docs[s.rsplit('/', 1)[0]]]
+        for fq in params['fq']:
+            m = re.match(r'(-?)institution_id:(?:"(.*)"|\[\* TO \*\])$', fq)
+            if m and m.group(1):
+                docs = [d for d in docs if 'institution_id' not in d]
+            elif m:
+                docs = [d for d in docs if d.get('institution_id') == m.group(2)]
+            elif fq.startswith('master_id:'):
+                wanted = re.findall(r'"([^"]*)"', fq)
+                docs = [d for d in docs if d['master_id'] in wanted]
+        if params.get('facet') == 'true':
+            field = params['facet.field']
+            counts = collections.Counter(d[field] for d in docs if field in d)
+            values = [(v, n) for v, n in sorted(counts.items()) if n >= params['facet.mincount']]
+            return dict(facet_counts=dict(facet_fields={field: [x for item in values for x in item]}))
+        keys = [key.split()[0] for key in params['sort'].split(',')]
+        docs.sort(key=lambda d: tuple(d[k] for k in keys))
+        start = 0 if params['cursorMark'] == '*' else int(params['cursorMark'])
+        page = docs[start:start + params['rows']]
+        return dict(response=dict(docs=page), nextCursorMark=str(start + len(page)))
+
+
+def scanner():
+    planner = FakePlanner({
+        's1:8983/solr': [doc('a', '20200101'), doc('b', '20200101'), doc('c', '1'), doc('d', '1', 'IPSL')],
+        's2:8985/solr': [doc('a', '20210101'), doc('c', '2'), doc('c', '10'), doc('e', '1', None)],
+    })
+    return DuplicateScanner(planner, 'CMIP6', page=2)
+
+
+def test_duplicates_across_shards():
+    s = scanner()
+    assert s.partitions() == ['IPSL', 'NCAR', None]
+    assert s.duplicates('NCAR') == ['a', 'c']
+    assert s.duplicates('IPSL') == [] and s.duplicates(None) == []
+    assert all(p['shards'] == 's1:8983/solr/datasets,s2:8985/solr/datasets' for p in s.planner.requests)
+
+
+def test_versions_are_paged():
+    s = scanner()
+    versions = s.versions(['c'])
+    assert sorted(v[0] for v in versions['c']) == ['1', '10', '2']
+
+
+def test_scan_keeps_the_newest_version():
+    assert scanner().scan(workers=2, group=1) == [
+        ('a', 'a.v20210101|node', ['a.v20200101|node']),
+        ('c', 'c.v10|node', ['c.v2|node', 'c.v1|node']),
+    ]
+
+
+def test_version_key():
+    assert sorted(['v2', 'v10', 'latest'], key=version_key) == ['latest', 'v2', 'v10']
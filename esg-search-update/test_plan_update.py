@@ -0,0 +1,71 @@
+import json
+import os
+
+from bulk_update import Update, read_xml
+from plan_update import Planner, solr_filters, write_batches, write_ranges
+
+
+class Response(object):
+
+    def __init__(self, js):
+        self.text = json.dumps(js)
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+    """Pages of the sorted ids of the shards named in a request, as Solr
+    cursors return them."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.requests = []
+
+    def get(self, url, timeout, params):
+        self.requests.append(params)
+        ids = sorted(i for s in params['shards'].split(',') for i in self.ids[s.rsplit('/', 1)[0]])
+        if 'cursorMark' not in params:
+            return Response(dict(response=dict(numFound=len(ids))))
+        start = 0 if params['cursorMark'] == '*' else int(params['cursorMark'])
+        docs = [dict(id=i) for i in ids[start:start + params['rows']]]
+        return Response(dict(response=dict(docs=docs), nextCursorMark=str(start + len(docs))))
+
+
+def test_solr_filters():
+    fq = solr_filters('project=input4MIPs&institution=PCMDI&institution=NCAR&latest=True&limit=0'
+                      '&query=title:"a b"')
+    assert fq == ['institution:("PCMDI" OR "NCAR")', 'latest:("true")', 'project:("input4MIPs")', '(title:"a b")']
+
+
+def test_ranges_and_total_cover_every_shard():
+    shards = ['s1:8983/solr', 's2:8985/solr']
+    session = FakeSession({'s1:8983/solr': ['a', 'c', 'd'], 's2:8985/solr': ['b', 'e']})
+    planner = Planner('http://solr/solr', shards, session)
+    assert planner.total('files', 'project=CMIP6') == 5
+    assert list(planner.ranges('files', 'project=CMIP6', size=2)) == [('a', 'b', 2), ('c', 'd', 2), ('e', 'e', 1)]
+    assert set(p['shards'] for p in session.requests) == {'s1:8983/solr/files', 's2:8985/solr/files',
+                                                          's1:8983/solr/files,s2:8985/solr/files'}
+
+
+def test_write_ranges(tmp_path):
+    update = Update('project=CMIP6', [('retracted', ['true'])])
+    directory = str(tmp_path / 'batches')
+    paths = write_ranges(directory, 'update-0', 'files', 'set', update, [('a', 'b', 2), ('c|x&y', 'e', 2)])
+    assert sorted(os.listdir(directory)) == [os.path.basename(p) for p in paths]
+    core, action, updates = read_xml(paths[1])
+    assert (core, action) == ('files', 'set') and updates[0].fields == [('retracted', ['true'])]
+    assert solr_filters(updates[0].query) == ['project:("CMIP6")', '(id:["c|x&y" TO "e"])']
+
+
+def test_write_batches(tmp_path):
+    update = Update('project=CMIP6', [('retracted', ['true'])])
+    directory = str(tmp_path / 'batches')
+    paths = write_batches(directory, 'update-0', 'files', 'set', update, list('abcde'), 2)
+    assert [os.path.basename(p) for p in paths] == ['update-0-00000.xml', 'update-0-00001.xml',
+                                                    'update-0-00002.xml']
+    assert sorted(os.listdir(directory)) == [os.path.basename(p) for p in paths]
+    core, action, updates = read_xml(paths[2])
+    assert (core, action) == ('files', 'set')
+    assert [u.query for u in updates] == ['id=e'] and updates[0].fields == [('retracted', ['true'])]
+    assert write_batches(directory, 'empty', 'files', 'set', update, [], 2) == []
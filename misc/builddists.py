@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+
+# Files of each component besides its dist/ directory, as in packagedists.sh
+COMPONENTS = {
+    'esgf-dashboard': 'bin/esg-dashboard INSTALL README LICENSE',
+    'esgf-desktop': 'bin/esg-desktop INSTALL README LICENSE',
+    'esgf-idp': 'bin/esg-idp INSTALL README LICENSE',
+    'esgf-installer': 'jar_security_scan setup-autoinstall globus/esg-globus esg-bootstrap esg-node esg-init '
+                      'esg-functions esg-gitstrap esg-node.completion esg-purge.sh esg-autoinstall-testnode '
+                      'compute-tools/esg-compute-languages compute-tools/esg-compute-tools INSTALL README LICENSE',
+    'esgf-node-manager': 'bin/esg-node-manager bin/esgf-sh bin/esgf-spotcheck '
+                         'etc/xsd/registration/registration.xsd INSTALL README LICENSE',
+    'esgf-security': 'bin/esgf-user-migrate bin/esg-security bin/esgf-policy-check INSTALL README LICENSE',
+    # 'esgf-web-fe': 'bin/esg-web-fe INSTALL README LICENSE',
+    'esg-orp': 'bin/esg-orp INSTALL README LICENSE',
+    'esgf-getcert': 'INSTALL README LICENSE',
+    'esg-search': 'bin/esg-search bin/esgf-crawl bin/esgf-optimize-index etc/conf/jetty/jetty.xml-auth '
+                  'etc/conf/jetty/realm.properties etc/conf/solr/schema.xml etc/conf/solr/solrconfig.xml '
+                  'etc/conf/solr/solrconfig.xml-replica etc/conf/solr/solr.xml-master etc/conf/solr/solr.xml-slave '
+                  'etc/conf/jetty/webdefault.xml-auth INSTALL README LICENSE',
+    'esgf-product-server': 'esg-product-server',
+    'filters': 'esg-access-logging-filter esg-drs-resolving-filter esg-security-las-ip-filter '
+               'esg-security-tokenless-filters',
+    'esgf-cog': 'esg-cog',
+}
+
+# Installer scripts placed in the <script_maj_version>/ directory of esgf-installer-dist.tgz
+VERSIONED = ['esg-node*', 'jar_security_scan*', 'setup-autoinstall*', 'esg-purge.sh*', 'esg-init*',
+             'esg-functions*', 'esg-bootstrap*']
+
+# Bump when the tarball layout changes so every component is rebuilt
+BUILD_FORMAT = 1
+
+CACHE = '.builddists-cache.json'
+MANIFEST = 'dists.md5'
+
+
+def md5_file(path, cache):
+    """md5 of a file, from the cache while its size and mtime are unchanged."""
+    st = os.stat(path)
+    entry = cache.get(path)
+    if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+        return entry[2]
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    cache[path] = [st.st_size, st.st_mtime_ns, md5.hexdigest()]
+    return md5.hexdigest()
+
+
+def component_inputs(root, name, files):
+    """[(archive name, path)] of a component, warning about missing files."""
+    inputs = {}
+    dist = os.path.join(root, name, 'dist')
+    if os.path.isdir(dist):
+        for f in sorted(os.listdir(dist)):
+            if os.path.isfile(os.path.join(dist, f)) and not fnmatch.fnmatch(f, 'ivy*.xml'):
+                inputs[f] = os.path.join(dist, f)
+    for f in files.split():
+        path = os.path.join(root, name, f)
+        if not os.path.exists(path):
+            print("File {}/{} not found".format(name, f))
+            continue
+        inputs[os.path.basename(f)] = path
+    return sorted(inputs.items())
+
+
+class Versions(object):
+    """The version strings substituted into esg-node and esg-bootstrap."""
+
+    def __init__(self, script_version, script_release, script_maj_version,
+                 replace_version, replace_release, replace_maj_version):
+        self.maj_version = script_maj_version
+        self.rules = {
+            'esg-node': [('script_version', replace_version, script_version),
+                         ('script_release', replace_release, script_release),
+                         ('script_maj_version', replace_maj_version, script_maj_version)],
+            'esg-bootstrap': [('script_maj_version', replace_maj_version, script_maj_version)],
+        }
+
+    def key(self):
+        return json.dumps([self.maj_version, sorted(self.rules.items())])
+
+    def apply(self, name, data):
+        for var, old, new in self.rules.get(name, ()):
+            data = data.replace('{}="{}"'.format(var, old).encode(), '{}="{}"'.format(var, new).encode())
+        return data
+
+
+def archive_name(component, name, versions):
+    if component == 'esgf-installer' and any(fnmatch.fnmatch(name, p) for p in VERSIONED):
+        return versions.maj_version + '/' + name
+    return name
+
+
+def build(component, inputs, versions, output, pigz):
+    """Write <component>-dist.tgz with a .md5 next to every file; returns
+    the member names for listoffiles."""
+    members = []
+    entries = []
+    names = set(name for name, _path in inputs)
+    for name, path in inputs:
+        if name.endswith('.md5'):
+            # a checksum shipped in dist/ is kept unless it is regenerated below
+            if name[:-4] not in names:
+                entries.append((name, path, None))
+            continue
+        with open(path, 'rb') as f:
+            data = versions.apply(name, f.read())
+        entries.append((name, path, data))
+        entries.append((name + '.md5', path, '{}  {}\n'.format(hashlib.md5(data).hexdigest(), name).encode()))
+
+    tmp = output + '.tmp'
+    if pigz:
+        out = open(tmp, 'wb')
+        proc = subprocess.Popen([pigz, '-c'], stdin=subprocess.PIPE, stdout=out)
+        stream = proc.stdin
+    else:
+        proc = None
+        stream = gzip.open(tmp, 'wb', compresslevel=6)
+    with tarfile.open(fileobj=stream, mode='w|') as tar:
+        if any('/' in archive_name(component, name, versions) for name, _path, _data in entries):
+            info = tarfile.TarInfo(versions.maj_version)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.uname = info.gname = 'root'
+            info.mtime = int(time.time())
+            tar.addfile(info)
+            members.append(versions.maj_version + '/')
+        for name, path, data in sorted(entries, key=lambda m: archive_name(component, m[0], versions)):
+            info = tar.gettarinfo(path, archive_name(component, name, versions))
+            info.uid = info.gid = 0
+            info.uname = info.gname = 'root'
+            if data is None:
+                with open(path, 'rb') as f:
+                    tar.addfile(info, f)
+            else:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            members.append(info.name)
+    stream.close()
+    if proc is not None:
+        if proc.wait() != 0:
+            raise RuntimeError('pigz failed for {}'.format(output))
+        out.close()
+    os.replace(tmp, output)
+    return members
+
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'files': {}, 'components': {}}
+
+
+def plan(root, output_dir, names, versions, cache, force=False):
+    """{component: (key, inputs, output)} of the components to rebuild: the
+    ones whose inputs, versions or tarball changed since the cached build."""
+    jobs = {}
+    for name in names:
+        if not os.path.isdir(os.path.join(root, name)):
+            print("Directory {} not found. Bailing out.".format(name))
+            continue
+        inputs = component_inputs(root, name, COMPONENTS[name])
+        key = hashlib.md5(json.dumps([BUILD_FORMAT, versions.key()] +
+                                     [(a, md5_file(p, cache['files'])) for a, p in inputs]).encode()).hexdigest()
+        output = os.path.join(output_dir, name + '-dist.tgz')
+        built = cache['components'].get(name)
+        if not force and built and built['key'] == key and os.path.exists(output):
+            continue
+        jobs[name] = (key, inputs, output)
+    return jobs
+
+
+def prune(output_dir, cache):
+    """Drop the tarballs and cache entries of components no longer in
+    COMPONENTS, and the checksums of files that no longer exist; returns
+    the pruned component names."""
+    pruned = sorted(n for n in cache['components'] if n not in COMPONENTS)
+    for name in pruned:
+        output = os.path.join(output_dir, name + '-dist.tgz')
+        if os.path.exists(output):
+            os.remove(output)
+        del cache['components'][name]
+        print("Removed {}".format(output))
+    for path in [p for p in cache['files'] if not os.path.exists(p)]:
+        del cache['files'][path]
+    return pruned
+
+
+def write_atomic(path, text):
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Build the ESGF component dist tarballs, rebuilding only the "
+                                                 "components whose files changed")
+    parser.add_argument("--root", default=".", help="Directory holding the component checkouts (default .)")
+    parser.add_argument("--output", default="final-dists", help="Tarball directory (default final-dists)")
+    parser.add_argument("--script-version", required=True)
+    parser.add_argument("--script-release", required=True)
+    parser.add_argument("--script-maj-version", required=True)
+    parser.add_argument("--replace-version", required=True, help="esg-node script_version to replace")
+    parser.add_argument("--replace-release", required=True, help="esg-node script_release to replace")
+    parser.add_argument("--replace-maj-version", required=True, help="script_maj_version to replace")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Components built in parallel")
+    parser.add_argument("--force", action="store_true", help="Rebuild every component")
+    parser.add_argument("components", nargs="*", help="Components to build (default all)")
+    args = parser.parse_args()
+
+    start = time.time()
+    versions = Versions(args.script_version, args.script_release, args.script_maj_version,
+                        args.replace_version, args.replace_release, args.replace_maj_version)
+    pigz = shutil.which('pigz')
+    os.makedirs(args.output, exist_ok=True)
+    cache_path = os.path.join(args.output, CACHE)
+    cache = load_cache(cache_path)
+
+    names = args.components or sorted(COMPONENTS)
+    for name in names:
+        if name not in COMPONENTS:
+            parser.error("unknown component {}".format(name))
+    prune(args.output, cache)
+    jobs = plan(args.root, args.output, names, versions, cache, args.force)
+
+    with concurrent.futures.ProcessPoolExecutor(max(1, min(args.jobs, len(jobs) or 1))) as pool:
+        futures = {pool.submit(build, name, inputs, versions, output, pigz): (name, key, output)
+                   for name, (key, inputs, output) in jobs.items()}
+        for future in concurrent.futures.as_completed(futures):
+            name, key, output = futures[future]
+            cache['components'][name] = dict(key=key, members=future.result(),
+                                             md5=md5_file(output, cache['files']))
+            print("Built {}".format(output))
+            write_atomic(cache_path, json.dumps(cache))
+
+    # after prune() the manifest and listoffiles only list current components
+    listed = [n for n in sorted(cache['components']) if os.path.exists(os.path.join(args.output, n + '-dist.tgz'))]
+    write_atomic(os.path.join(args.output, MANIFEST), ''.join(
+        '{}  {}-dist.tgz\n'.format(md5_file(os.path.join(args.output, n + '-dist.tgz'), cache['files']), n)
+        for n in listed))
+    write_atomic(os.path.join(args.root, 'listoffiles'), ''.join(
+        '{}/{}\n'.format(n, m) for n in listed for m in cache['components'][n]['members']))
+    write_atomic(cache_path, json.dumps(cache))
+    print("{} of {} components rebuilt in {:.1f} s{}".format(len(jobs), len(names), time.time() - start,
+                                                             '' if pigz else ' (pigz not found, used gzip)'))
+
+
+if __name__ == '__main__':
+    main()
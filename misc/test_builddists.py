@@ -0,0 +1,67 @@
+import os
+import tarfile
+
+import builddists
+from builddists import Versions, build, plan, prune
+
+
+def versions(maj='v4'):
+    return Versions('4.0.1', 'Gum', maj, '0.0.0', 'dev', 'v0')
+
+
+def checkout(root):
+    os.makedirs(str(root / 'esgf-installer' / 'dist'))
+    (root / 'esgf-installer' / 'dist' / 'installer.jar').write_bytes(b'jar')
+    (root / 'esgf-installer' / 'dist' / 'ivy-1.xml').write_text('ivy')
+    (root / 'esgf-installer' / 'esg-node').write_text('script_version="0.0.0"\nscript_maj_version="v0"\n')
+    (root / 'esgf-installer' / 'README').write_text('readme')
+
+
+def rebuilt(root, output, cache, vers):
+    jobs = plan(str(root), output, ['esgf-installer'], vers, cache)
+    for name, (key, inputs, path) in jobs.items():
+        cache['components'][name] = dict(key=key, members=build(name, inputs, vers, path, None), md5='')
+    return sorted(jobs)
+
+
+def test_only_changed_components_are_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(builddists, 'COMPONENTS', {'esgf-installer': 'esg-node README'})
+    checkout(tmp_path)
+    output = str(tmp_path / 'final-dists')
+    os.makedirs(output)
+    cache = {'files': {}, 'components': {}}
+    assert rebuilt(tmp_path, output, cache, versions()) == ['esgf-installer']
+    assert rebuilt(tmp_path, output, cache, versions()) == []
+    assert rebuilt(tmp_path, output, cache, versions('v5')) == ['esgf-installer']
+    (tmp_path / 'esgf-installer' / 'README').write_text('changed readme')
+    assert rebuilt(tmp_path, output, cache, versions('v5')) == ['esgf-installer']
+    os.remove(os.path.join(output, 'esgf-installer-dist.tgz'))
+    assert rebuilt(tmp_path, output, cache, versions('v5')) == ['esgf-installer']
+
+
+def test_build_substitutes_versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(builddists, 'COMPONENTS', {'esgf-installer': 'esg-node README'})
+    checkout(tmp_path)
+    vers = versions()
+    inputs = builddists.component_inputs(str(tmp_path), 'esgf-installer', 'esg-node README')
+    assert [name for name, _path in inputs] == ['README', 'esg-node', 'installer.jar']
+    output = str(tmp_path / 'esgf-installer-dist.tgz')
+    members = build('esgf-installer', inputs, vers, output, None)
+    assert members == ['v4/', 'README', 'README.md5', 'installer.jar', 'installer.jar.md5',
+                       'v4/esg-node', 'v4/esg-node.md5']
+    with tarfile.open(output) as tar:
+        node = tar.extractfile('v4/esg-node').read()
+    assert node == b'script_version="4.0.1"\nscript_maj_version="v4"\n'
+
+
+def test_prune_drops_removed_components(tmp_path, monkeypatch):
+    monkeypatch.setattr(builddists, 'COMPONENTS', {'esg-search': ''})
+    output = str(tmp_path)
+    for name in ('esg-search', 'esgf-web-fe'):
+        (tmp_path / (name + '-dist.tgz')).write_bytes(b'tgz')
+    gone = str(tmp_path / 'gone')
+    cache = {'files': {gone: [1, 1, 'md5']},
+             'components': {'esg-search': dict(key='k'), 'esgf-web-fe': dict(key='k')}}
+    assert prune(output, cache) == ['esgf-web-fe']
+    assert sorted(os.listdir(output)) == ['esg-search-dist.tgz']
+    assert cache == {'files': {}, 'components': {'esg-search': dict(key='k')}}
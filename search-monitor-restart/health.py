@@ -0,0 +1,131 @@
+import asyncio
+import json
+import time
+
+import requests
+
+
+class CheckResult(object):
+
+    def __init__(self, name, ok, latency, detail="", samples=None):
+        self.name = name
+        self.ok = ok
+        self.latency = latency
+        self.detail = detail
+        # (shard, query, seconds) latency samples taken during the check
+        self.samples = samples or []
+
+    def __repr__(self):
+        return "{}: {} ({:.3f}s) {}".format(self.name, "OK" if self.ok else "FAIL",
+                                            self.latency, self.detail)
+
+
+class Check(object):
+    """Base class for a health signal.
+
+    Subclasses implement probe(), a blocking call that returns (ok, detail)
+    and may raise; the engine runs it in a worker thread under a timeout.
+    """
+
+    name = "check"
+    shard = "all"
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self.samples = []
+
+    def probe(self):
+        raise NotImplementedError
+
+    def record(self, shard, query, seconds):
+        self.samples.append((shard, query, seconds))
+
+    def _get_json(self, url):
+        resp = requests.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        return json.loads(resp.text)
+
+
+class FacetShardCheck(Check):
+    """The distributed search must still report enough index_node facets."""
+
+    name = "facet_shards"
+
+    def __init__(self, url, min_facets=4, timeout=10):
+        Check.__init__(self, timeout)
+        self.url = url
+        self.min_facets = min_facets
+
+    def probe(self):
+        jo = self._get_json(self.url)
+        facets = jo["facet_counts"]["facet_fields"]["index_node"]
+        num = len(facets[::2])
+        return num >= self.min_facets, "{} index_node facets".format(num)
+
+
+class QueryLatencyCheck(Check):
+    """A representative search must answer within the latency budget."""
+
+    name = "query_latency"
+
+    def __init__(self, url, budget=5.0, timeout=10):
+        Check.__init__(self, timeout)
+        self.url = url
+        self.budget = budget
+
+    def probe(self):
+        start = time.time()
+        self._get_json(self.url)
+        elapsed = time.time() - start
+        return elapsed <= self.budget, "{:.2f}s (budget {:.2f}s)".format(elapsed, self.budget)
+
+
+class HeapCheck(Check):
+    """JVM heap usage reported by the Solr admin endpoint must stay below a limit."""
+
+    name = "jvm_heap"
+
+    def __init__(self, url, max_used=0.95, timeout=5):
+        Check.__init__(self, timeout)
+        self.url = url
+        self.max_used = max_used
+
+    def probe(self):
+        jo = self._get_json(self.url)
+        raw = jo["jvm"]["memory"]["raw"]
+        used = float(raw["used"]) / float(raw["max"])
+        return used < self.max_used, "heap {:.0%} used".format(used)
+
+
+class HealthEngine(object):
+    """Runs all checks concurrently and decides whether a restart is needed.
+
+    A check that raises or exceeds its timeout counts as failed.  A restart
+    is only requested when at least `quorum` checks fail in the same round.
+    """
+
+    def __init__(self, checks, quorum=2):
+        self.checks = checks
+        self.quorum = quorum
+
+    async def _run_check(self, check):
+        loop = asyncio.get_running_loop()
+        check.samples = []
+        start = time.time()
+        try:
+            ok, detail = await asyncio.wait_for(loop.run_in_executor(None, check.probe),
+                                                check.timeout)
+        except asyncio.TimeoutError:
+            ok, detail = False, "timed out after {}s".format(check.timeout)
+        except Exception as ex:
+            ok, detail = False, "{}: {}".format(type(ex).__name__, ex)
+        latency = time.time() - start
+        samples = [(check.shard, check.name, latency)] + check.samples
+        return CheckResult(check.name, ok, latency, detail, samples)
+
+    async def run(self):
+        return await asyncio.gather(*[self._run_check(c) for c in self.checks])
+
+    def needs_restart(self, results):
+        failed = [r for r in results if not r.ok]
+        return len(failed) >= min(self.quorum, len(results))
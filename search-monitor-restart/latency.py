@@ -0,0 +1,154 @@
+import collections
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyHistogram(object):
+    """HDR-style log-linear histogram of latencies.
+
+    Values are recorded in microseconds.  Each power-of-two range is split
+    into 2**(significant_bits-1) linear sub-buckets, so the relative error of
+    a reported percentile is bounded by 2**-(significant_bits-1) whatever the
+    magnitude, and memory only grows with the number of distinct buckets hit.
+    """
+
+    def __init__(self, significant_bits=7):
+        self.sub_count = 1 << significant_bits
+        self.half = self.sub_count >> 1
+        self.bits = significant_bits
+        self.buckets = collections.defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.bits)
+        sub = value >> shift
+        if shift == 0:
+            return sub
+        return self.sub_count + (shift - 1) * self.half + (sub - self.half)
+
+    def _value(self, index):
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        sub = (index - self.sub_count) % self.half + self.half
+        # report the upper edge of the bucket, as HDR histograms do
+        return ((sub + 1) << shift) - 1
+
+    def record(self, seconds):
+        self.buckets[self._index(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, pct):
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(round(pct / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return self._value(index) / 1e6
+        return self._value(max(self.buckets)) / 1e6
+
+
+class SloWindow(object):
+    """Flags sustained latency SLO violations.
+
+    The search is degraded when, over the last `window` seconds, at least
+    `ratio` of the samples exceeded the SLO.  Samples must have been
+    recorded for a whole window before a verdict is given, so a single slow
+    probe never counts.
+    """
+
+    def __init__(self, slo, window=1800, ratio=0.5):
+        self.slo = slo
+        self.window = window
+        self.ratio = ratio
+        self.samples = collections.deque()
+        self.since = None
+
+    def record(self, seconds, now=None):
+        now = time.time() if now is None else now
+        if self.since is None:
+            self.since = now
+        self.samples.append((now, seconds))
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def degraded(self, now=None):
+        now = time.time() if now is None else now
+        recent = [s for t, s in self.samples if t >= now - self.window]
+        if not recent or now - self.since < self.window:
+            return False
+        slow = sum(1 for s in recent if s > self.slo)
+        return slow >= self.ratio * len(recent)
+
+
+class LatencyMetrics(object):
+    """Histograms per (shard, query), gauges and counters exported in the
+    Prometheus text format."""
+
+    QUANTILES = (50, 95, 99)
+
+    def __init__(self):
+        self.histograms = collections.defaultdict(LatencyHistogram)
+        self.gauges = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, shard, query, seconds):
+        with self.lock:
+            self.histograms[(shard, query)].record(seconds)
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def set_counter(self, name, value):
+        # counters are named with _total and only ever go up
+        with self.lock:
+            self.counters[name] = value
+
+    def render(self):
+        lines = ["# TYPE esgf_search_probe_latency_seconds summary"]
+        with self.lock:
+            for (shard, query), hist in sorted(self.histograms.items()):
+                labels = 'shard="{}",query="{}"'.format(shard, query)
+                for q in self.QUANTILES:
+                    lines.append('esgf_search_probe_latency_seconds{{{},quantile="{}"}} {:.6f}'.format(
+                        labels, q / 100.0, hist.percentile(q)))
+                lines.append("esgf_search_probe_latency_seconds_sum{{{}}} {:.6f}".format(labels, hist.total))
+                lines.append("esgf_search_probe_latency_seconds_count{{{}}} {}".format(labels, hist.count))
+            for name, value in sorted(self.gauges.items()):
+                lines.append("# TYPE {} gauge".format(name))
+                lines.append("{} {}".format(name, value))
+            for name, value in sorted(self.counters.items()):
+                lines.append("# TYPE {} counter".format(name))
+                lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -1,35 +1,125 @@
-import os
-import requests
-import json
+import argparse
+import asyncio
 
-from time import sleep
+from health import HealthEngine, FacetShardCheck, QueryLatencyCheck, HeapCheck
+from latency import LatencyMetrics, SloWindow
+from restart import BackgroundCommand, RestartController
+from shards import ShardCheck
 
 URL = "https://esgf-node.llnl.gov/esg-search/search/?limit=0&facets=index_node&format=application%2Fsolr%2Bjson"
+LATENCY_URL = "https://esgf-node.llnl.gov/esg-search/search/?limit=10&project=CMIP6&format=application%2Fsolr%2Bjson"
 ANSIBLE_RESTART = "ansible-playbook -i esgf.hosts --limit esgf-node.llnl.gov stop.yml start.yml"
 
-def do_check():
+# Local Solr shards of the LLNL index (see update-reports/esgf_holdings_report.py)
+SOLR_HOST = "localhost"
+SOLR_PORTS = [8983, 8985, 8987, 8988, 8990, 8993, 8995]
+HEAP_URL = "http://localhost:8983/solr/admin/info/system?wt=json"
 
-    resp = requests.get(URL)
 
-    print(type(resp.status_code), resp.status_code)
+def build_engine(args):
+    checks = [
+        FacetShardCheck(URL, min_facets=args.min_facets, timeout=args.timeout),
+        ShardCheck(SOLR_PORTS, SOLR_HOST, max_qtime=args.max_qtime, timeout=args.timeout),
+        QueryLatencyCheck(LATENCY_URL, budget=args.latency_budget, timeout=args.timeout),
+        HeapCheck(HEAP_URL, max_used=args.max_heap, timeout=args.timeout),
+    ]
+    return HealthEngine(checks, quorum=args.quorum)
 
-    if resp.status_code != 200:
-        print("Need to Restart")
-        os.system(ANSIBLE_RESTART)
-        return
 
+def handle_shards(shard_check, shard_controllers, args):
+    # A minority of failing shards does not fail the node; deal with them one by one
+    for state in shard_check.failing(args.shard_rounds):
+        print("Shard {} failing for {} checks: {}".format(state.name, state.failures, state.error))
+        if args.shard_restart_cmd:
+            if state.port not in shard_controllers:
+                # the node lock is held shared so no shard restarts during a node restart
+                shard_controllers[state.port] = RestartController(
+                    "{}.{}".format(args.lock_file, state.port), timeout=args.restart_timeout,
+                    cooldown=args.cooldown, shared_lock=args.lock_file)
+            shard_controllers[state.port].request(args.shard_restart_cmd.format(port=state.port))
+    for state in shard_check.states:
+        if not state.failures and state.port in shard_controllers:
+            shard_controllers[state.port].healthy()
 
-    try:
-        jo = json.loads(resp.text)
-        facets = jo["facet_counts"]["facet_fields"]["index_node"]    
 
-        if len(facets) < 4:
-            print("Need to restart")
-            os.system(ANSIBLE_RESTART)
-            return
-    except BaseException as ex:
-        print("JSON Parse error or other", ex)
+async def do_check(engine, metrics, slo, controller, shard_controllers, degraded_action, args):
 
-while (True):
-    do_check()
-    sleep(600)
+    results = await engine.run()
+    for res in results:
+        print(res)
+        for shard, query, seconds in res.samples:
+            metrics.observe(shard, query, seconds)
+            if query == QueryLatencyCheck.name:
+                slo.record(seconds)
+
+    degraded = slo.degraded()
+    metrics.set_gauge("esgf_search_degraded", int(degraded))
+
+    if engine.needs_restart(results):
+        print("Need to restart")
+        controller.request(ANSIBLE_RESTART)
+    else:
+        controller.healthy()
+        if not controller.recovering:
+            for check in engine.checks:
+                if isinstance(check, ShardCheck):
+                    handle_shards(check, shard_controllers, args)
+
+    metrics.set_counter("esgf_search_restarts_total", controller.restarts)
+    if controller.last_recovery is not None:
+        metrics.set_gauge("esgf_search_last_recovery_seconds", round(controller.last_recovery, 1))
+
+    if degraded and not controller.recovering:
+        print("Search degraded: latency above {}s SLO for the last {}s".format(slo.slo, slo.window))
+        if degraded_action is not None:
+            degraded_action.trigger()
+
+
+async def monitor(engine, metrics, slo, args):
+    controller = RestartController(args.lock_file, timeout=args.restart_timeout, cooldown=args.cooldown)
+    shard_controllers = {}
+    degraded_action = BackgroundCommand(args.degraded_cmd, args.degraded_timeout) if args.degraded_cmd else None
+    while True:
+        await do_check(engine, metrics, slo, controller, shard_controllers, degraded_action, args)
+        # probe faster while a restart runs or the index is warming up
+        if controller.recovering or any(c.recovering for c in shard_controllers.values()):
+            await asyncio.sleep(args.recovery_interval)
+        else:
+            await asyncio.sleep(args.interval)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Monitor the ESGF search index and restart it when unhealthy")
+    parser.add_argument("--interval", type=int, default=600, help="Seconds between checks (default 600)")
+    parser.add_argument("--recovery-interval", type=int, default=30, help="Seconds between checks while recovering from a restart (default 30)")
+    parser.add_argument("--timeout", type=float, default=10, help="Timeout in seconds for each check (default 10)")
+    parser.add_argument("--quorum", type=int, default=2, help="Number of failed checks that triggers a restart (default 2)")
+    parser.add_argument("--min-facets", type=int, default=4, help="Minimum number of index_node facets (default 4)")
+    parser.add_argument("--max-qtime", type=int, default=2000, help="Maximum shard query time in milliseconds (default 2000)")
+    parser.add_argument("--shard-rounds", type=int, default=2, help="Consecutive failed checks before a shard is acted on (default 2)")
+    parser.add_argument("--shard-restart-cmd", type=str, default=None,
+                        help="Command restarting a single shard, {port} is replaced by the shard port (default: only report)")
+    parser.add_argument("--latency-budget", type=float, default=5.0, help="Query latency budget in seconds (default 5)")
+    parser.add_argument("--max-heap", type=float, default=0.95, help="Maximum fraction of JVM heap in use (default 0.95)")
+    parser.add_argument("--slo", type=float, default=2.0, help="Search latency SLO in seconds (default 2)")
+    parser.add_argument("--slo-window", type=int, default=1800, help="Seconds the SLO must be missed before the search is degraded (default 1800)")
+    parser.add_argument("--slo-ratio", type=float, default=0.5, help="Fraction of slow probes in the window that means degraded (default 0.5)")
+    parser.add_argument("--degraded-cmd", type=str, default=None, help="Command to run while the search is degraded")
+    parser.add_argument("--degraded-timeout", type=int, default=300, help="Seconds before the degraded command is killed (default 300)")
+    parser.add_argument("--metrics-port", type=int, default=9105, help="Port of the local Prometheus /metrics endpoint (default 9105, 0 disables)")
+    parser.add_argument("--lock-file", type=str, default="/tmp/esgf-search-restart.lock", help="Lock file held while a restart runs")
+    parser.add_argument("--restart-timeout", type=int, default=1800, help="Seconds before the restart playbook is killed (default 1800)")
+    parser.add_argument("--cooldown", type=int, default=900, help="Seconds after a restart before another may start (default 900)")
+    args = parser.parse_args()
+
+    metrics = LatencyMetrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    slo = SloWindow(args.slo, args.slo_window, args.slo_ratio)
+
+    asyncio.run(monitor(build_engine(args), metrics, slo, args))
+
+
+if __name__ == '__main__':
+    main()
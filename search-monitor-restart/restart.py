@@ -0,0 +1,133 @@
+import asyncio
+import fcntl
+import os
+import time
+
+
+class RestartController(object):
+    """Runs restart commands in the background, one at a time.
+
+    The command runs as a tracked subprocess with a timeout while the
+    monitor keeps probing.  An exclusive lock on `lock_path` keeps other
+    monitor instances (or a manual restart using the same lock) from
+    overlapping, and no new restart is started until `cooldown` seconds
+    after the previous one finished, so a slowly warming index is not
+    restarted again.
+
+    A restart of part of the node, such as one shard, passes the node's
+    lock as `shared_lock`: it is held shared for the duration, so shard
+    restarts may overlap each other but never a full node restart.
+    """
+
+    def __init__(self, lock_path, timeout=1800, cooldown=900, shared_lock=None):
+        self.lock_path = lock_path
+        self.shared_lock = shared_lock
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.task = None
+        self.started = None
+        self.finished = None
+        self.recovering = False
+        self.restarts = 0
+        self.last_recovery = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def in_cooldown(self, now=None):
+        now = time.time() if now is None else now
+        return self.finished is not None and now - self.finished < self.cooldown
+
+    def request(self, command, now=None):
+        """Start `command` unless a restart is running or cooling down."""
+        if self.running:
+            print("Restart already running since {:.0f}s".format(time.time() - self.started))
+            return False
+        if self.in_cooldown(now):
+            print("Restart skipped, still in post-restart cooldown")
+            return False
+        wanted = [(self.lock_path, fcntl.LOCK_EX)]
+        if self.shared_lock is not None:
+            wanted.insert(0, (self.shared_lock, fcntl.LOCK_SH))
+        locks = []
+        for path, mode in wanted:
+            fd = self._lock(path, mode)
+            if fd is None:
+                self._unlock(locks)
+                print("Restart skipped, {} is held by another restart".format(path))
+                return False
+            locks.append(fd)
+        self.started = time.time()
+        self.recovering = True
+        self.restarts += 1
+        self.task = asyncio.ensure_future(self._run(command, locks))
+        return True
+
+    def healthy(self):
+        """Called after a healthy check; ends the recovery period."""
+        if self.recovering and not self.running:
+            self.recovering = False
+            self.last_recovery = time.time() - self.started
+            print("Recovered {:.0f}s after restart".format(self.last_recovery))
+
+    @staticmethod
+    def _lock(path, mode):
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, mode | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        if mode == fcntl.LOCK_EX:
+            os.ftruncate(fd, 0)
+            os.write(fd, "{}\n".format(os.getpid()).encode())
+        return fd
+
+    @staticmethod
+    def _unlock(locks):
+        for fd in locks:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    async def _run(self, command, locks):
+        try:
+            proc = await asyncio.create_subprocess_shell(command)
+            try:
+                code = await asyncio.wait_for(proc.wait(), self.timeout)
+                print("Restart command exited with {} after {:.0f}s".format(code, time.time() - self.started))
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                print("Restart command killed after {}s timeout".format(self.timeout))
+        finally:
+            self.finished = time.time()
+            self._unlock(locks)
+
+
+class BackgroundCommand(object):
+    """Runs a command such as the degraded-search hook as a subprocess
+    without blocking the monitor; a new run only starts once the previous
+    one has exited or been killed after `timeout` seconds."""
+
+    def __init__(self, command, timeout=300):
+        self.command = command
+        self.timeout = timeout
+        self.task = None
+
+    def trigger(self):
+        if self.task is not None and not self.task.done():
+            return False
+        self.task = asyncio.ensure_future(self._run())
+        return True
+
+    async def _run(self):
+        proc = await asyncio.create_subprocess_shell(self.command)
+        try:
+            code = await asyncio.wait_for(proc.wait(), self.timeout)
+            if code:
+                print("{} exited with {}".format(self.command, code))
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            print("{} killed after {}s timeout".format(self.command, self.timeout))
@@ -0,0 +1,111 @@
+import concurrent.futures
+import json
+import time
+
+import requests
+
+from health import Check
+
+
+class ShardState(object):
+    """What the monitor knows about one local Solr shard core."""
+
+    def __init__(self, port, host="localhost", core="datasets"):
+        self.port = port
+        self.name = "{}:{}".format(host, port)
+        self.base = "http://{}:{}/solr/{}".format(host, port, core)
+        self.failures = 0
+        self.num_docs = None
+        self.qtime = None
+        self.error = ""
+
+    def __repr__(self):
+        if self.failures:
+            return "{} FAIL x{} {}".format(self.name, self.failures, self.error)
+        return "{} OK numDocs={} QTime={}ms".format(self.name, self.num_docs, self.qtime)
+
+
+class ShardCheck(Check):
+    """Probes every local shard core directly and keeps per-shard state.
+
+    Each shard is pinged and asked for its document count; a shard fails
+    when it does not answer, when its query time exceeds `max_qtime`
+    milliseconds or when it suddenly loses more than `max_doc_drop` of its
+    documents.  The signal as a whole only fails when at least
+    `max_failed` shards fail at once: a single bad replica is reported
+    through failing() so it can be handled on its own.
+
+    The shards are probed concurrently and each request gets a third of
+    the check timeout, so a hung shard fails on its own before the engine
+    times out the whole signal.  Shard state only changes once all probes
+    have returned within the check timeout.
+    """
+
+    name = "shards"
+
+    def __init__(self, ports, host="localhost", core="datasets", max_failed=None,
+                 max_qtime=2000, max_doc_drop=0.1, timeout=10):
+        Check.__init__(self, timeout)
+        self.states = [ShardState(port, host, core) for port in ports]
+        self.max_failed = max_failed or len(ports) // 2 + 1
+        self.max_qtime = max_qtime
+        self.max_doc_drop = max_doc_drop
+
+    @property
+    def request_timeout(self):
+        # ping and select run one after the other within the check timeout
+        return self.timeout / 3.0
+
+    def _get(self, url):
+        resp = requests.get(url, timeout=self.request_timeout)
+        resp.raise_for_status()
+        return json.loads(resp.text)
+
+    def _probe_shard(self, state):
+        """(error or None, numDocs, QTime) of one shard; does not touch its state."""
+        start = time.time()
+        try:
+            ping = self._get(state.base + "/admin/ping?wt=json")
+            self.record(state.name, "ping", time.time() - start)
+            if ping.get("status") != "OK":
+                return "ping status {}".format(ping.get("status")), state.num_docs, state.qtime
+
+            start = time.time()
+            jo = self._get(state.base + "/select?q=*:*&rows=0&wt=json")
+            self.record(state.name, "numdocs", time.time() - start)
+            num_docs = jo["response"]["numFound"]
+            qtime = jo["responseHeader"]["QTime"]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as ex:
+            # a malformed response fails this shard only
+            return "{}: {}".format(type(ex).__name__, ex), state.num_docs, state.qtime
+
+        if qtime > self.max_qtime:
+            return "QTime {}ms".format(qtime), num_docs, qtime
+        if state.num_docs and num_docs < state.num_docs * (1 - self.max_doc_drop):
+            return "numDocs dropped from {} to {}".format(state.num_docs, num_docs), num_docs, qtime
+        return None, num_docs, qtime
+
+    def probe(self):
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(len(self.states)) as pool:
+            results = list(pool.map(self._probe_shard, self.states))
+        if time.time() - start > self.timeout:
+            # the engine has already counted this round as timed out
+            return False, "shard probes took {:.1f}s".format(time.time() - start)
+        for state, (error, num_docs, qtime) in zip(self.states, results):
+            state.num_docs = num_docs
+            state.qtime = qtime
+            if error:
+                state.failures += 1
+                state.error = error
+            else:
+                state.failures = 0
+                state.error = ""
+        failed = [s.name for s in self.states if s.failures]
+        if len(failed) >= self.max_failed:
+            return False, "failed shards: " + ", ".join(failed)
+        return True, "{} of {} shards healthy".format(len(self.states) - len(failed), len(self.states))
+
+    def failing(self, rounds=1):
+        """Shards that failed at least `rounds` checks in a row."""
+        return [s for s in self.states if s.failures >= rounds]
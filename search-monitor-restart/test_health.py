@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from health import Check, HealthEngine
+
+
+class FakeCheck(Check):
+
+    def __init__(self, name, ok=True, delay=0.0, error=None, timeout=1):
+        Check.__init__(self, timeout)
+        self.name = name
+        self.ok = ok
+        self.delay = delay
+        self.error = error
+
+    def probe(self):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.ok, "fake"
+
+
+def run(engine):
+    return asyncio.run(engine.run())
+
+
+def test_checks_run_concurrently():
+    engine = HealthEngine([FakeCheck("a", delay=0.2), FakeCheck("b", delay=0.2), FakeCheck("c", delay=0.2)])
+    start = time.time()
+    results = run(engine)
+    assert time.time() - start < 0.5
+    assert [r.ok for r in results] == [True, True, True]
+
+
+def test_timeout_and_exception_fail_the_check():
+    engine = HealthEngine([FakeCheck("slow", delay=0.5, timeout=0.1), FakeCheck("bad", error=ValueError("boom"))])
+    slow, bad = run(engine)
+    assert not slow.ok and "timed out" in slow.detail
+    assert not bad.ok and "ValueError: boom" in bad.detail
+
+
+def test_restart_needs_quorum():
+    engine = HealthEngine([FakeCheck("a", ok=False), FakeCheck("b"), FakeCheck("c")], quorum=2)
+    assert not engine.needs_restart(run(engine))
+    engine.checks[1].ok = False
+    assert engine.needs_restart(run(engine))
+
+
+def test_quorum_capped_by_number_of_checks():
+    engine = HealthEngine([FakeCheck("a", ok=False)], quorum=2)
+    assert engine.needs_restart(run(engine))
@@ -0,0 +1,64 @@
+import random
+
+from latency import LatencyHistogram, LatencyMetrics, SloWindow
+
+
+def test_histogram_percentiles_within_relative_error():
+    rng = random.Random(1)
+    values = sorted(rng.uniform(0.001, 30.0) for _ in range(10000))
+    hist = LatencyHistogram(significant_bits=7)
+    for v in values:
+        hist.record(v)
+    for pct in (50, 95, 99):
+        exact = values[int(round(pct / 100.0 * len(values))) - 1]
+        assert abs(hist.percentile(pct) - exact) <= exact * 2 ** -6 + 1e-6
+
+
+def test_histogram_small_values_exact():
+    hist = LatencyHistogram()
+    for us in (10, 20, 30):
+        hist.record(us / 1e6)
+    assert hist.percentile(50) == 20 / 1e6
+    assert LatencyHistogram().percentile(99) == 0.0
+
+
+def test_slo_window_needs_a_whole_window():
+    slo = SloWindow(1.0, window=1800, ratio=0.5)
+    for t in range(0, 1800, 600):
+        slo.record(5.0, now=t)
+    # slow since the first probe, but only 1200s observed
+    assert not slo.degraded(now=1200)
+    slo.record(5.0, now=1800.5)
+    assert slo.degraded(now=1800.5)
+
+
+def test_slo_window_ratio_over_recent_samples():
+    slo = SloWindow(1.0, window=1800, ratio=0.5)
+    slo.record(0.1, now=0)
+    for t in (600, 1200, 1800, 2400):
+        slo.record(0.1, now=t)
+    slo.record(5.0, now=3000)
+    assert not slo.degraded(now=3000)
+    slo.record(5.0, now=3600)
+    slo.record(5.0, now=4200)
+    # samples from 2400 on: 0.1, 5, 5, 5
+    assert slo.degraded(now=4200)
+
+
+def test_slo_window_ignores_stale_samples():
+    slo = SloWindow(1.0, window=1800, ratio=0.5)
+    slo.record(5.0, now=0)
+    slo.record(5.0, now=1800)
+    assert not slo.degraded(now=10000)
+
+
+def test_metrics_render():
+    metrics = LatencyMetrics()
+    metrics.observe("localhost:8983", "ping", 0.01)
+    metrics.set_gauge("esgf_search_degraded", 1)
+    metrics.set_counter("esgf_search_restarts_total", 2)
+    text = metrics.render()
+    assert 'esgf_search_probe_latency_seconds_count{shard="localhost:8983",query="ping"} 1' in text
+    assert "esgf_search_degraded 1" in text
+    assert "# TYPE esgf_search_restarts_total counter\nesgf_search_restarts_total 2" in text
+
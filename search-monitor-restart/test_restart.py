@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from restart import BackgroundCommand, RestartController
+
+
+def test_cooldown_blocks_a_second_restart(tmp_path):
+    async def run():
+        ctl = RestartController(str(tmp_path / "lock"), timeout=5, cooldown=100)
+        assert ctl.request("true")
+        assert not ctl.request("true")  # still running
+        await ctl.task
+        assert ctl.in_cooldown()
+        assert not ctl.request("true")
+        assert ctl.request("true", now=time.time() + 101)
+        await ctl.task
+        assert ctl.restarts == 2
+
+    asyncio.run(run())
+
+
+def test_recovery_ends_on_first_healthy_check(tmp_path):
+    async def run():
+        ctl = RestartController(str(tmp_path / "lock"), timeout=5, cooldown=0)
+        ctl.request("true")
+        ctl.healthy()
+        assert ctl.recovering  # the command is still running
+        await ctl.task
+        ctl.healthy()
+        assert not ctl.recovering and ctl.last_recovery is not None
+
+    asyncio.run(run())
+
+
+def test_timeout_kills_the_command(tmp_path):
+    async def run():
+        ctl = RestartController(str(tmp_path / "lock"), timeout=0.2, cooldown=0)
+        start = time.time()
+        ctl.request("sleep 5")
+        await ctl.task
+        return time.time() - start
+
+    assert asyncio.run(run()) < 2
+
+
+def test_shard_restarts_exclude_node_restart(tmp_path):
+    node_lock = str(tmp_path / "lock")
+
+    async def run():
+        node = RestartController(node_lock, timeout=5, cooldown=0)
+        shard1 = RestartController(node_lock + ".8983", timeout=5, cooldown=0, shared_lock=node_lock)
+        shard2 = RestartController(node_lock + ".8985", timeout=5, cooldown=0, shared_lock=node_lock)
+        # shards may restart together, but not with the node
+        assert shard1.request("sleep 0.3")
+        assert shard2.request("sleep 0.3")
+        assert not node.request("true")
+        await asyncio.gather(shard1.task, shard2.task)
+        assert node.request("sleep 0.3")
+        assert not shard1.request("true")
+        await node.task
+        assert shard1.request("true")
+        await shard1.task
+
+    asyncio.run(run())
+
+
+def test_background_command_does_not_block_the_loop():
+    async def run():
+        cmd = BackgroundCommand("sleep 5", timeout=0.3)
+        start = time.time()
+        assert cmd.trigger()
+        assert not cmd.trigger()
+        await asyncio.sleep(0.05)
+        # the loop kept running while the command sleeps
+        assert time.time() - start < 0.3
+        await cmd.task
+        return time.time() - start
+
+    assert asyncio.run(run()) < 2
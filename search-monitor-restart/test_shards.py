@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import requests
+
+from health import HealthEngine
+from shards import ShardCheck
+
+
+class FakeShards(ShardCheck):
+    """Answers from a table of {port: numDocs}; ports in `hung` never
+    answer and ports in `malformed` answer without a response."""
+
+    def __init__(self, docs, hung=(), qtime=5, malformed=(), **kwargs):
+        ShardCheck.__init__(self, sorted(docs), **kwargs)
+        self.docs = docs
+        self.hung = set(hung)
+        self.malformed = set(malformed)
+        self.qtime = qtime
+
+    def _get(self, url):
+        port = int(url.split(":")[2].split("/")[0])
+        if port in self.hung:
+            time.sleep(self.request_timeout)
+            raise requests.Timeout("read timed out")
+        if "ping" in url:
+            return {"status": "OK"}
+        if port in self.malformed:
+            return {"error": "no response"}
+        return {"response": {"numFound": self.docs[port]}, "responseHeader": {"QTime": self.qtime}}
+
+
+def test_one_hung_shard_fails_alone():
+    check = FakeShards({8983: 100, 8985: 100, 8987: 100}, hung=[8985], timeout=0.6)
+    results = asyncio.run(HealthEngine([check]).run())
+    assert results[0].ok
+    assert [s.port for s in check.failing()] == [8985]
+    assert "Timeout" in check.states[1].error
+
+
+def test_majority_failing_fails_the_signal():
+    check = FakeShards({8983: 100, 8985: 100, 8987: 100}, hung=[8983, 8985], timeout=0.6)
+    ok, detail = check.probe()
+    assert not ok and "localhost:8983" in detail
+
+
+def test_doc_drop_and_qtime():
+    check = FakeShards({8983: 100}, max_failed=2)
+    check.probe()
+    check.docs[8983] = 50
+    check.probe()
+    assert check.states[0].failures == 1 and "dropped" in check.states[0].error
+    check.qtime = 5000
+    check.probe()
+    assert check.states[0].failures == 2 and "QTime" in check.states[0].error
+    assert check.failing(2) == check.states
+
+
+def test_malformed_response_fails_one_shard():
+    check = FakeShards({8983: 100, 8985: 100, 8987: 100}, malformed=[8985])
+    ok, _detail = check.probe()
+    assert ok
+    assert [s.failures for s in check.states] == [0, 1, 0]
+    assert "KeyError" in check.states[1].error and check.states[0].num_docs == 100
+
+
+class LateShards(FakeShards):
+
+    @property
+    def request_timeout(self):
+        # above the check timeout, as if a request ignored its own timeout
+        return self.timeout * 2
+
+
+def test_late_probe_leaves_state_alone():
+    check = LateShards({8983: 100}, hung=[8983], timeout=0.3)
+    ok, _detail = check.probe()
+    assert not ok
+    assert check.states[0].failures == 0
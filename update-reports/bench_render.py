@@ -0,0 +1,91 @@
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import esgf_holdings_report as report
+from pivot import PivotMatrix
+
+
+def synthetic_tables(nrows, ncols, density=0.3, seed=0):
+    """A holdings matrix and the other tables of a page, with random
+    contents on a grid of the given size."""
+    rng = np.random.default_rng(seed)
+    rows = ['model-{:03d}'.format(i) for i in range(nrows)]
+    columns = ['experiment-{:03d}'.format(j) for j in range(ncols)]
+    matrix = PivotMatrix(rows, columns)
+    present = rng.random((nrows, ncols)) < density
+    matrix.count = np.where(present, rng.integers(1, 5000, (nrows, ncols)), 0)
+    now = np.datetime64(datetime.datetime.now(), 's')
+    matrix.timestamp = now - rng.integers(0, 60 * 86400, (nrows, ncols)).astype('timedelta64[s]')
+
+    frequencies = ['1hr', '3hr', '6hr', 'day', 'mon', 'yr', 'fx']
+    cells = matrix.cells(matrix.count)
+    tables = dict(frequencies=frequencies,
+                  variable_counts=dict((r, dict((c, v % 300) for c, v in row.items())) for r, row in cells.items()),
+                  simulation_counts=dict((r, dict((c, v % 20) for c, v in row.items())) for r, row in cells.items()),
+                  exp_sim_counts=dict((r, dict((c, dict(num_exp=v % 50, num_sim=v % 200)) for c, v in row.items()))
+                                      for r, row in cells.items()),
+                  models_per_frequency=dict((f, dict((c, nrows // 2) for c in columns)) for f in frequencies))
+    return matrix, tables
+
+
+def measure(func, repeat):
+    """Best wall time over `repeat` runs and the tracemalloc peak of one run."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rendering of the holdings pages on synthetic grids")
+    parser.add_argument("--models", type=int, default=200, help="Number of rows (default 200)")
+    parser.add_argument("--experiments", type=int, default=300, help="Number of columns (default 300)")
+    parser.add_argument("--density", type=float, default=0.3, help="Fraction of populated cells (default 0.3)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per page, the best time is reported (default 3)")
+    parser.add_argument("--gzip", help="Render gzipped pages", action="store_true")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail when a page takes longer than this")
+    parser.add_argument("--max-peak-mb", type=float, default=None, help="Fail when a page peaks above this many MB")
+    args = parser.parse_args()
+
+    matrix, tables = synthetic_tables(args.models, args.experiments, args.density)
+    timestamp = datetime.datetime.now().strftime("%A %d %B %Y %H:%M:%S")
+    output_dir = tempfile.mkdtemp(prefix='bench-render-')
+    pages = [
+        ('project', lambda: report.write_project_page('BENCH', output_dir, timestamp, matrix, tables, args.gzip)),
+        ('activity', lambda: report.write_activity_page('BENCH', 'ACT', output_dir, timestamp, matrix, tables,
+                                                        args.gzip)),
+    ]
+
+    print("{} x {} grid, {} populated cells".format(args.models, args.experiments, int(matrix.present.sum())))
+    failed = False
+    for name, render in pages:
+        seconds, peak = measure(render, args.repeat)
+        peak_mb = peak / float(1 << 20)
+        print("{:10s} {:8.3f} s {:8.1f} MB peak".format(name, seconds, peak_mb))
+        if (args.max_seconds is not None and seconds > args.max_seconds) or \
+                (args.max_peak_mb is not None and peak_mb > args.max_peak_mb):
+            failed = True
+    for path, _dirs, files in os.walk(output_dir, topdown=False):
+        for f in files:
+            os.remove(os.path.join(path, f))
+        os.rmdir(path)
+    if failed:
+        print("Rendering is slower or larger than allowed", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
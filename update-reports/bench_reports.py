@@ -0,0 +1,76 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixtures import FixtureServer, FixtureStore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    'mk_report': lambda project, out: (['mk_report.py', project], os.path.join(out, 'mk_report.html')),
+    'mk_report2': lambda project, out: (['mk_report2.py', '--project', project,
+                                         '--output', os.path.join(out, 'mk_report2.html')], None),
+    'esgf_holdings_report': lambda project, out: (['esgf_holdings_report.py', '--project', project,
+                                                   '--output', out], None),
+}
+
+
+def run_script(name, project, base_url, workdir):
+    """(wall seconds, peak RSS in MB, exit status) of one report run."""
+    out = os.path.join(workdir, name)
+    os.makedirs(out)
+    argv, stdout_path = SCRIPTS[name](project, out)
+    env = dict(os.environ, ESGF_REPORTS_BASE_URL=base_url,
+               ESGF_REPORTS_SHARD_CACHE=os.path.join(workdir, name + '-shards.json'))
+    with open(stdout_path or os.devnull, 'w') as stdout:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable] + argv, cwd=HERE, env=env, stdout=stdout)
+        _pid, status, usage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - start
+    # reaped by wait4, which also gives the child's own peak RSS (kB on Linux)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return seconds, usage.ru_maxrss / 1024.0, proc.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the report scripts end to end against recorded Solr "
+                                                 "responses and report requests, wall time and peak RSS")
+    parser.add_argument("--store", type=str, required=True, help="Fixture directory of fixtures.py")
+    parser.add_argument("--project", "-p", type=str, default="CMIP6", help="MIP project name (default is CMIP6)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--record", type=str, metavar="UPSTREAM", default=None,
+                        help="Record missing responses from this index node instead of failing on them")
+    parser.add_argument("--scripts", type=str, default=",".join(sorted(SCRIPTS)),
+                        help="Comma separated scripts to run (default all)")
+    args = parser.parse_args()
+
+    fixtures = FixtureServer(FixtureStore(args.store), args.record, args.latency)
+    server = fixtures.serve()
+    base_url = 'http://{}:{}'.format(*server.server_address[:2])
+    workdir = tempfile.mkdtemp(prefix='bench-reports-')
+
+    failed = False
+    print("{:22s} {:>8s} {:>8s} {:>10s} {:>10s}".format('script', 'requests', 'missing', 'wall s', 'peak MB'))
+    try:
+        for name in args.scripts.split(','):
+            fixtures.reset()
+            seconds, rss, status = run_script(name, args.project, base_url, workdir)
+            print("{:22s} {:8d} {:8d} {:10.2f} {:10.1f}{}".format(
+                name, fixtures.requests, len(fixtures.misses), seconds, rss,
+                '' if status == 0 else '  (exit status {})'.format(status)))
+            for key in fixtures.misses:
+                print("  no fixture for {}".format(key), file=sys.stderr)
+            failed = failed or status != 0 or bool(fixtures.misses)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,231 +1,213 @@
 
 import requests
 import os
+import sys
 import json
 import datetime
 import argparse
-import jinja2
-
-
-def get_solr_query_url():
-    # search_url = 'https://esgf-node.llnl.gov/esg-search/search/' \
-    #              '?limit=0&format=application%2Fsolr%2Bjson'
-
-    # req = requests.get(search_url)
-    # js = json.loads(req.text)
-    # shards = js['responseHeader']['params']['shards']
-
-    shards = ",".join(
-        [
-            "localhost:8983/solr/datasets",
-            "localhost:8985/solr/datasets",
-            "localhost:8987/solr/datasets",
-            "localhost:8988/solr/datasets",
-            "localhost:8990/solr/datasets",
-            "localhost:8993/solr/datasets",
-            "localhost:8995/solr/datasets"
-        ]
-    )
-
-    solr_url = 'https://esgf-node.llnl.gov/solr/datasets/select' \
-               '?q=*:*&wt=json&facet=true&fq=type:Dataset' \
-               '&fq=replica:false&fq=latest:true&shards={shards}&{{query}}'
-    
-    return solr_url.format(shards=shards)
-
-
-def get_latest_data_holdings(project, row_facet, col_facet, selected_columns=None, activity_id=None):
-	solr_url = get_solr_query_url()
-
-	if activity_id is None:
-		query = 'rows=0&fq=project:{project}' \
-				'&facet.field={row_facet}&facet.field={col_facet}' \
-				'&stats=true&stats.field={{!tag=piv max=true}}_timestamp' \
-				'&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
-		query_url = solr_url.format(query=query.format(project=project, 
-													row_facet=row_facet, 
-													col_facet=col_facet))
-	else:
-		query = 'rows=0&fq=project:{project}&fq=activity_id:{activity_id}' \
-				'&facet.field={row_facet}&facet.field={col_facet}' \
-				'&stats=true&stats.field={{!tag=piv max=true}}_timestamp' \
-				'&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
-		query_url = solr_url.format(query=query.format(project=project, 
-													activity_id=activity_id,
-													row_facet=row_facet, 
-													col_facet=col_facet))
-	req = requests.get(query_url)
-	js = json.loads(req.text)
-
-	rows = js['facet_counts']['facet_fields'][row_facet][::2]
-	if selected_columns is None:
-		columns = js['facet_counts']['facet_fields'][col_facet][::2]
-	else:
-		columns = selected_columns
-	row_totals = {k: 0 for k in rows}
-	column_totals = {k: 0 for k in columns}
-	total = 0
-
-	current_time = datetime.datetime.now()
-	pivot = list(js['facet_counts']['facet_pivot'].keys())[0]
-	result = {}
-	for row in js['facet_counts']['facet_pivot'][pivot]:
-		row_val = {}
-		for col in row['pivot']:
-			if col['value'] in columns:
-				ts_str = col['stats']['stats_fields']['_timestamp']['max']
-				timestamp = datetime.datetime.strptime(ts_str[:19], '%Y-%m-%dT%H:%M:%S')
-				diff = current_time - timestamp
-				row_val[col['value']] = dict(num=col['count'], days=diff.days)
-				row_totals[row['value']] += 1
-				column_totals[col['value']] += 1
-		total += row_totals[row['value']]
-		result[row['value']] = row_val
-		
-	holdings = dict(row_totals=row_totals, 
-					column_totals=column_totals, 
-					total=total, 
-					datasets=result)
-	return (rows, columns, holdings)
-
-
-def get_exp_sim_stats(project, row_facet, col_facet):
-    solr_url = get_solr_query_url()
-    
-    query = 'rows=0&fq=project:{project}' \
-            '&facet.field={row_facet}&facet.field={col_facet}' \
-            '&stats=true&stats.field={{!tag=piv countDistinct=true}}variant_label' \
-            '&facet.pivot={{!stats=piv}}{row_facet},{col_facet},experiment_id'
-    query_url = solr_url.format(query=query.format(project=project, 
-                                                   row_facet=row_facet, 
-                                                   col_facet=col_facet))
-    req = requests.get(query_url)
-    js = json.loads(req.text)
-    
-    rows = js['facet_counts']['facet_fields'][row_facet][::2]
-    columns = js['facet_counts']['facet_fields'][col_facet][::2]
-    
-    pivot = list(js['facet_counts']['facet_pivot'].keys())[0]
-    result = {}
-    for row in js['facet_counts']['facet_pivot'][pivot]:
-        row_val = {}
-        for col in row['pivot']:
-            num_exp = 0
-            num_sim = 0
-            for exp in col['pivot']:
-                num_exp += 1
-                num_sim += exp['stats']['stats_fields']['variant_label']['countDistinct']
-            row_val[col['value']] = dict(num_exp=num_exp, num_sim=num_sim)
-        result[row['value']] = row_val
-            
-    return (rows, columns, result)
-
-
-def get_facet_value_count(project, row_facet, col_facet, count_facet, selected_columns=None, activity_id=None):
-	solr_url = get_solr_query_url()
-
-	if activity_id is None:
-		query = 'rows=0&fq=project:{project}' \
-		'&facet.field={row_facet}&facet.field={col_facet}' \
-		'&stats=true&stats.field={{!tag=piv countDistinct=true}}{count_facet}' \
-		'&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
-		query_url = solr_url.format(query=query.format(project=project, 
-													row_facet=row_facet, 
-													col_facet=col_facet,
-													count_facet=count_facet))
-	else:
-		query = 'rows=0&fq=project:{project}&fq=activity_id:{activity_id}' \
-		'&facet.field={row_facet}&facet.field={col_facet}' \
-		'&stats=true&stats.field={{!tag=piv countDistinct=true}}{count_facet}' \
-		'&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
-		query_url = solr_url.format(query=query.format(project=project,
-													activity_id=activity_id,
-													row_facet=row_facet, 
-													col_facet=col_facet,
-													count_facet=count_facet))
-	req = requests.get(query_url)
-	js = json.loads(req.text)
-
-	rows = js['facet_counts']['facet_fields'][row_facet][::2]
-	if selected_columns is None:
-		columns = js['facet_counts']['facet_fields'][col_facet][::2]
-	else:
-		columns = selected_columns
+import numpy as np
+
+from pivot import decode_pivot
+from topology import solr_query_url
+from render import write_template, template_environment, holdings_grid, cells_grid
+import export
+import incremental
+import sharded
+
+
+def source_id_filter(source_ids):
+	# Restrict a query to the given models, used to refresh only changed rows
+	if source_ids is None:
+		return ''
+	return '&fq=source_id:({})'.format(' OR '.join('"{}"'.format(s) for s in source_ids))
+
+
+def project_filter(project, activity_id=None, source_ids=None):
+	# fq parameters selecting the datasets of a table
+	filters = 'fq=project:{}'.format(project)
+	if activity_id is not None:
+		filters += '&fq=activity_id:{}'.format(activity_id)
+	return filters + source_id_filter(source_ids)
+
+
+class QueryMode(object):
+	"""How the pivots are computed: by the distributed query, or with
+	`sharded` on every shard core in parallel and merged here (see
+	sharded.py).  With `validate` the merged pivots are also compared with
+	the distributed query and the differences collected in `mismatches`.
+	Both ways limit the row and column values to `facet_limit`, all of
+	them by default."""
+
+	def __init__(self, sharded=False, validate=False, facet_limit=-1):
+		self.sharded = sharded
+		self.validate = sharded and validate
+		self.facet_limit = facet_limit
+		self.mismatches = []
+
+	def pivot(self, query, filters, row_facet, col_facet, selected_columns=None, levels=(), timestamps=False):
+		if self.sharded:
+			matrix = sharded.shard_pivot(filters, row_facet, col_facet, selected_columns, levels, timestamps,
+										 self.facet_limit)
+			if matrix is None:
+				print("Sharded {},{} pivot truncated, using the distributed query".format(row_facet, col_facet),
+					  file=sys.stderr)
+			elif not self.validate:
+				return matrix
+
+		query += '&facet.limit={}'.format(self.facet_limit)
+		req = requests.get(solr_query_url().format(query=query))
+		reference = decode_pivot(json.loads(req.text), row_facet, col_facet, selected_columns)
+		if not self.sharded or matrix is None:
+			return reference
+
+		diffs = sharded.compare(matrix, reference, levels)
+		for diff in diffs:
+			print("Sharded {},{} pivot differs: {}".format(row_facet, col_facet, diff), file=sys.stderr)
+		self.mismatches.extend(diffs)
+		return matrix
+
+
+DISTRIBUTED = QueryMode()
+
+
+def get_latest_data_matrix(project, row_facet, col_facet, selected_columns=None, activity_id=None, source_ids=None,
+						   mode=DISTRIBUTED):
+	filters = project_filter(project, activity_id, source_ids)
+	query = 'rows=0&{filters}' \
+			'&facet.field={row_facet}&facet.field={col_facet}' \
+			'&stats=true&stats.field={{!tag=piv max=true}}_timestamp' \
+			'&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
+	query = query.format(filters=filters, row_facet=row_facet, col_facet=col_facet)
+
+	return mode.pivot(query, filters, row_facet, col_facet, selected_columns, timestamps=True)
+
+
+def get_exp_sim_stats(project, row_facet, col_facet, source_ids=None, mode=DISTRIBUTED):
+	filters = project_filter(project, source_ids=source_ids)
+	query = 'rows=0&{filters}' \
+			'&facet.field={row_facet}&facet.field={col_facet}' \
+			'&stats=true&stats.field={{!tag=piv countDistinct=true}}variant_label' \
+			'&facet.pivot={{!stats=piv}}{row_facet},{col_facet},experiment_id'
+	query = query.format(filters=filters, row_facet=row_facet, col_facet=col_facet)
+
+	matrix = mode.pivot(query, filters, row_facet, col_facet, levels=('experiment_id', 'variant_label'))
+	result = matrix.cells(np.dstack([matrix.nested, matrix.stat('variant_label')]))
+	result = {row: {col: dict(num_exp=v[0], num_sim=v[1]) for col, v in cols.items()}
+			for row, cols in result.items()}
+
+	return (matrix.rows, matrix.columns, result)
+
+
+def get_facet_value_count(project, row_facet, col_facet, count_facet, selected_columns=None, activity_id=None, source_ids=None,
+						  mode=DISTRIBUTED):
+	filters = project_filter(project, activity_id, source_ids)
+	query = 'rows=0&{filters}' \
+			'&facet.field={row_facet}&facet.field={col_facet}' \
+			'&stats=true&stats.field={{!tag=piv countDistinct=true}}{count_facet}' \
+			'&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
+	query = query.format(filters=filters, row_facet=row_facet, col_facet=col_facet, count_facet=count_facet)
+
+	matrix = mode.pivot(query, filters, row_facet, col_facet, selected_columns, levels=(count_facet,))
+	result = matrix.cells(matrix.stat(count_facet))
+
+	return (matrix.rows, matrix.columns, result)
+
+
+def get_project_tables(project, source_ids=None, mode=DISTRIBUTED):
+	# Tables of the page with ESGF holdings for all activities of this project.
+	# The countDistinct tables can be limited to some models.
+	_source_id_list, _activity_id_list, exp_sim_counts = get_exp_sim_stats(project, 'source_id', 'activity_id',
+																	source_ids=source_ids, mode=mode)
+	_source_id_list, _activity_id_list, variable_counts = get_facet_value_count(project, 'source_id', 'activity_id', 'variable_id',
+																	source_ids=source_ids, mode=mode)
+	frequency_list, _activity_id_list, model_counts = get_facet_value_count(project, 'frequency', 'activity_id', 'source_id',
+																	mode=mode)
+	return dict(frequencies=frequency_list,
+				exp_sim_counts=exp_sim_counts,
+				variable_counts=variable_counts,
+				models_per_frequency=model_counts)
+
+
+def get_activity_tables(project, activity_id, mode=DISTRIBUTED):
+	# Tables of the page with ESGF holdings for one activity, apart from the holdings matrix
+	_source_id_list, _experiment_id_list, simulation_counts = get_facet_value_count(project, 'source_id', 'experiment_id', 'variant_label',
+																	activity_id=activity_id, mode=mode)
+	_source_id_list, _experiment_id_list, variable_counts = get_facet_value_count(project, 'source_id', 'experiment_id', 'variable_id', 
+																	activity_id=activity_id, mode=mode)
+	frequency_list, _experiment_id_list, model_counts = get_facet_value_count(project, 'frequency', 'experiment_id', 'source_id', 
+																	activity_id=activity_id, mode=mode)
+	return dict(frequencies=frequency_list,
+				simulation_counts=simulation_counts,
+				variable_counts=variable_counts,
+				models_per_frequency=model_counts)
+
+
+def load_template(name):
+	# One environment for all pages, see render.template_environment
+	return template_environment().get_template(name)
+
+
+def table_grids(holdings, tables):
+	# Template context with the colour and text of every cell worked out here
+	return dict(total=holdings.total(),
+				column_totals=holdings.column_totals().tolist(),
+				holdings_grid=holdings_grid(holdings),
+				variable_grid=cells_grid(holdings.rows, holdings.columns, tables['variable_counts']),
+				frequency_grid=cells_grid(tables['frequencies'], holdings.columns, tables['models_per_frequency']))
+
+
+def write_project_page(project, output_dir, timestamp, activity_holdings, tables, compress=False):
+	filepath = os.path.join(output_dir, project+'_esgf_holdings.html')
+	exp_sim_grid = cells_grid(activity_holdings.rows, activity_holdings.columns, tables['exp_sim_counts'],
+							lambda v: '{}/{}'.format(v['num_exp'], v['num_sim']))
+	write_template(load_template('esgf_holdings_template.html'), filepath, compress,
+									project=project,
+									timestamp=timestamp,
+									activities=activity_holdings.columns, 
+									exp_sim_grid=exp_sim_grid,
+									**table_grids(activity_holdings, tables))
 
-	pivot = list(js['facet_counts']['facet_pivot'].keys())[0]
-	result = {}
-	for row in js['facet_counts']['facet_pivot'][pivot]:
-		row_val = {}
-		for col in row['pivot']:
-			if col['value'] in columns:
-				num = col['stats']['stats_fields'][count_facet]['countDistinct']
-				row_val[col['value']] = num
-		result[row['value']] = row_val
-			
-	return (rows, columns, result)
 
+def write_activity_page(project, activity_id, output_dir, timestamp, experiment_holdings, tables, compress=False):
+	activities_dir = os.path.join(output_dir, activity_id)
+	if not os.path.isdir(activities_dir):
+		os.mkdir(activities_dir)
 
-def gen_tables(project, output_dir):
+	filepath = os.path.join(activities_dir, 'index.html')
+	simulation_grid = cells_grid(experiment_holdings.rows, experiment_holdings.columns, tables['simulation_counts'])
+	write_template(load_template('esgf_activities_template.html'), filepath, compress,
+									project=project,
+									activity=activity_id,
+									timestamp=timestamp,
+									experiments=experiment_holdings.columns, 
+									simulation_grid=simulation_grid,
+									**table_grids(experiment_holdings, tables))
 
-	timestamp = datetime.datetime.now().strftime("%A %d %B %Y %H:%M:%S")
 
-	holdings_loader = jinja2.FileSystemLoader(os.path.join(os.path.dirname(__file__),'esgf_holdings_template.html'))
-	holdings_env = jinja2.Environment(loader=holdings_loader)
-	holdings_template = holdings_env.get_template('')
+def gen_tables(project, output_dir, compress=False, export_dir=None, formats=export.FORMATS, mode=DISTRIBUTED):
 
-	# Create a page with ESGF holdings for all activities of this project
-	source_id_list, activity_id_list, activity_holdings = get_latest_data_holdings(project, 'source_id', 'activity_id')
-	_source_id_list, _activity_id_list, exp_sim_counts = get_exp_sim_stats(project, 'source_id', 'activity_id')
-	_source_id_list, _activity_id_list, variable_counts = get_facet_value_count(project, 'source_id', 'activity_id', 'variable_id')
-	frequency_list, _activity_id_list, model_counts = get_facet_value_count(project, 'frequency', 'activity_id', 'source_id')
-	html = holdings_template.render(project=project,
-									timestamp=timestamp,
-									models=source_id_list, 
-									activities=activity_id_list, 
-									frequencies=frequency_list,
-									activity_holdings=activity_holdings,
-									exp_sim_counts=exp_sim_counts,
-									variable_counts=variable_counts,
-									models_per_frequency=model_counts)
+	timestamp = datetime.datetime.now().strftime("%A %d %B %Y %H:%M:%S")
 
-	filepath = os.path.join(output_dir, project+'_esgf_holdings.html')
-	with open(filepath,'w') as f:
-		print(html, file=f)
+	# Create a page with ESGF holdings for all activities of this project
+	activity_holdings = get_latest_data_matrix(project, 'source_id', 'activity_id', mode=mode)
+	project_tables = get_project_tables(project, mode=mode)
+	write_project_page(project, output_dir, timestamp, activity_holdings, project_tables, compress)
+	if export_dir is not None:
+		export.export_tables(export_dir, project, activity_holdings, project_tables,
+							dict(project=project, generated=timestamp), formats)
 
 	# Create pages with ESGF holdings for each activity of this project
 	# Display only data for the given list of experiments
 
-	activities_loader = jinja2.FileSystemLoader(os.path.join(os.path.dirname(__file__),'esgf_activities_template.html'))
-	activities_env = jinja2.Environment(loader=activities_loader)
-	activities_template = activities_env.get_template('')
-
-	for activity_id in activity_id_list:
-		source_id_list, experiment_id_list, experiment_holdings = get_latest_data_holdings(project, 'source_id', 'experiment_id', 
-																	activity_id=activity_id)
-		_source_id_list, _experiment_id_list, simulation_counts = get_facet_value_count(project, 'source_id', 'experiment_id', 'variant_label',
-																	activity_id=activity_id)
-		_source_id_list, _experiment_id_list, variable_counts = get_facet_value_count(project, 'source_id', 'experiment_id', 'variable_id', 
-																	activity_id=activity_id)
-		frequency_list, _experiment_id_list, model_counts = get_facet_value_count(project, 'frequency', 'experiment_id', 'source_id', 
-																	activity_id=activity_id)
-		html = activities_template.render(project=project,
-										activity=activity_id,
-										timestamp=timestamp,
-										models=source_id_list, 
-										experiments=experiment_id_list, 
-										frequencies=frequency_list,
-										experiment_holdings=experiment_holdings,
-										simulation_counts=simulation_counts,
-										variable_counts=variable_counts,
-										models_per_frequency=model_counts)
-
-		activities_dir = os.path.join(output_dir, activity_id)
-		if not os.path.isdir(activities_dir):
-			os.mkdir(activities_dir)
-
-		filepath = os.path.join(activities_dir, 'index.html')
-		with open(filepath,'w') as f:
-			print(html, file=f)
+	for activity_id in activity_holdings.columns:
+		experiment_holdings = get_latest_data_matrix(project, 'source_id', 'experiment_id', 
+													activity_id=activity_id, mode=mode)
+		activity_tables = get_activity_tables(project, activity_id, mode)
+		write_activity_page(project, activity_id, output_dir, timestamp, experiment_holdings,
+							activity_tables, compress)
+		if export_dir is not None:
+			export.export_tables(export_dir, project + '_' + activity_id, experiment_holdings, activity_tables,
+								dict(project=project, activity=activity_id, generated=timestamp), formats)
 
 
 def main():
@@ -233,13 +215,37 @@ def main():
 	parser = argparse.ArgumentParser(description="Create HTML tables for the data holdings of ESGF")
 	parser.add_argument("--project", "-p", dest="project", type=str, default="CMIP6", help="MIP project name (default is CMIP6)")
 	parser.add_argument("--output", "-o", dest="output", type=str, default=os.path.curdir, help="Output directory (default is current directory)")
+	parser.add_argument("--gzip", help="Write gzipped pages", action="store_true")
+	parser.add_argument("--state", dest="state", type=str, default=None,
+						help="Directory keeping the matrices of the previous run, enables incremental updates")
+	parser.add_argument("--full", help="Recompute everything even when a previous state exists", action="store_true")
+	parser.add_argument("--refresh-days", dest="refresh_days", type=float, default=7,
+						help="With --state, recompute everything when the last full run is older (default 7)")
+	parser.add_argument("--export", dest="export", type=str, default=None,
+						help="Also write the tables as versioned data files into this directory")
+	parser.add_argument("--export-formats", dest="formats", type=str, default=",".join(export.FORMATS),
+						help="Comma separated export formats among json, csv, npz and parquet (default {})".format(
+							",".join(export.FORMATS)))
+	parser.add_argument("--sharded", help="Query every shard in parallel and merge the pivots here", action="store_true")
+	parser.add_argument("--validate", help="With --sharded, check the merged pivots against the distributed queries",
+						action="store_true")
 	args = parser.parse_args()
 
+	mode = QueryMode(args.sharded, args.validate)
+
 	if not os.path.isdir(args.output):
 		print("{} is not a directory. Exiting.".format(args.output))
 		return
 	
-	gen_tables(args.project, args.output)
+	if args.state is None:
+		gen_tables(args.project, args.output, args.gzip, args.export, args.formats.split(","), mode)
+	else:
+		incremental.update_tables(args.project, args.output, args.state, args.gzip, args.full,
+								args.export, args.formats.split(","), mode, args.refresh_days)
+
+	if mode.mismatches:
+		print("{} differences between the sharded and distributed pivots".format(len(mode.mismatches)), file=sys.stderr)
+		sys.exit(1)
 
 
 if __name__ == '__main__':
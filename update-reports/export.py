@@ -0,0 +1,131 @@
+import csv
+import datetime
+import glob
+import json
+import os
+
+import numpy as np
+
+from render import PageWriter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('json', 'csv', 'npz') + (('parquet',) if pyarrow is not None else ())
+
+
+def holdings_table(matrix, now=None):
+    """(rows, columns, {field: values}, present) of a holdings matrix."""
+    return matrix.rows, matrix.columns, dict(num=matrix.count, days=matrix.age_days(now)), matrix.present
+
+
+def cells_table(rows, cells):
+    """(rows, columns, {field: values}, present) of the {row: {column: value}}
+    tables of the reports, where a value is a number or a dict of numbers."""
+    columns = list(dict.fromkeys(c for r in rows for c in cells.get(r, {})))
+    col_index = dict((c, j) for j, c in enumerate(columns))
+    present = np.zeros((len(rows), len(columns)), dtype=bool)
+    fields = {}
+    for i, r in enumerate(rows):
+        for c, value in cells.get(r, {}).items():
+            j = col_index[c]
+            present[i, j] = True
+            for field, v in (value.items() if isinstance(value, dict) else [('value', value)]):
+                if field not in fields:
+                    fields[field] = np.zeros(present.shape, dtype=np.int64)
+                fields[field][i, j] = v
+    return list(rows), columns, fields, present
+
+
+def report_tables(holdings, tables, now=None):
+    """All the tables of a project or activity page, keyed by name."""
+    result = dict(holdings=holdings_table(holdings, now))
+    for name, cells in tables.items():
+        if isinstance(cells, dict):
+            result[name] = cells_table(list(cells), cells)
+    return result
+
+
+def records(tables):
+    # Long form (table, row, column, field, value) of the populated cells
+    for name, (rows, columns, fields, present) in sorted(tables.items()):
+        for i, j in zip(*np.nonzero(present)):
+            for field, values in fields.items():
+                yield name, rows[i], columns[j], field, int(values[i, j])
+
+
+def write_json(path, meta, tables):
+    doc = dict(meta, tables={})
+    for name, (rows, columns, fields, present) in tables.items():
+        doc['tables'][name] = dict(rows=rows, columns=columns, **dict(
+            (field, np.where(present, values, -1).tolist()) for field, values in fields.items()))
+    with PageWriter(path) as out:
+        out.write(json.dumps(doc, separators=(',', ':')))
+
+
+def write_csv(path, meta, tables):
+    with PageWriter(path) as out:
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(('table', 'row', 'column', 'field', 'value'))
+        writer.writerows(records(tables))
+
+
+def write_npz(path, meta, tables):
+    arrays = dict(meta=np.array(json.dumps(meta)))
+    for name, (rows, columns, fields, present) in tables.items():
+        arrays[name + '_rows'] = np.array(rows, dtype=str)
+        arrays[name + '_columns'] = np.array(columns, dtype=str)
+        arrays[name + '_present'] = present
+        for field, values in fields.items():
+            arrays[name + '_' + field] = values
+    tmp = path[:-len('.npz')] + '.tmp.npz'
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def write_parquet(path, meta, tables):
+    columns = list(zip(*records(tables))) or [()] * 5
+    table = pyarrow.table(dict(zip(('table', 'row', 'column', 'field'), columns[:4]),
+                               value=pyarrow.array(columns[4], type=pyarrow.int64())))
+    table = table.replace_schema_metadata(dict((k, str(v)) for k, v in meta.items()))
+    tmp = path + '.tmp'
+    pyarrow.parquet.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, path)
+
+
+WRITERS = dict(json=write_json, csv=write_csv, npz=write_npz, parquet=write_parquet)
+
+
+def export_tables(export_dir, name, holdings, tables, meta, formats=FORMATS, keep=10, now=None):
+    """Write the tables of one page as <name>.<version>.<format> files.
+
+    The version is the UTC time of the export.  Every file is written to a
+    temporary name and renamed into place, then <name>.latest.json is
+    replaced to point at the new files, so readers always see a complete
+    set.  Only the `keep` most recent versions are kept.
+    """
+    if not os.path.isdir(export_dir):
+        os.makedirs(export_dir)
+    version = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    meta = dict(meta, version=version)
+    data = report_tables(holdings, tables, now)
+
+    files = {}
+    for fmt in formats:
+        if fmt == 'parquet' and pyarrow is None:
+            raise ValueError("Parquet export needs pyarrow")
+        files[fmt] = '{}.{}.{}'.format(name, version, fmt)
+        WRITERS[fmt](os.path.join(export_dir, files[fmt]), meta, data)
+
+    with PageWriter(os.path.join(export_dir, name + '.latest.json')) as out:
+        out.write(json.dumps(dict(meta, files=files), indent=1))
+
+    versions = sorted(set(os.path.basename(p)[len(name) + 1:].split('.')[0]
+                          for p in glob.glob(os.path.join(export_dir, glob.escape(name) + '.*Z.*'))))
+    for old in versions[:-keep]:
+        for path in glob.glob(os.path.join(export_dir, '{}.{}.*'.format(glob.escape(name), old))):
+            os.remove(path)
+    return files
@@ -0,0 +1,137 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+def request_key(path):
+    """The path with its query parameters decoded and sorted, so requests
+    only differing in parameter order or encoding share a fixture."""
+    url = urllib.parse.urlsplit(path)
+    params = sorted(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+    return url.path.rstrip('/') + '?' + '&'.join('{}={}'.format(k, v) for k, v in params)
+
+
+class FixtureStore(object):
+    """Recorded responses, one gzipped JSON file per request key."""
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, key):
+        return os.path.join(self.root, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json.gz')
+
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt') as f:
+            return json.load(f)
+
+    def put(self, key, status, content_type, body):
+        path = self.path(key)
+        tmp = path + '.tmp'
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(dict(key=key, status=status, content_type=content_type, body=body), f)
+        os.replace(tmp, path)
+
+
+class FixtureServer(object):
+    """Serve the recorded responses of `store` on a local port.
+
+    With an `upstream` URL, requests without a fixture are forwarded there
+    and recorded (record mode); otherwise they get a 404.  Every response
+    is delayed by `latency` seconds to stand in for the real index.
+    requests and misses count what was served since the last reset().
+    """
+
+    def __init__(self, store, upstream=None, latency=0.0):
+        self.store = store
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.misses = []
+
+    def response(self, path):
+        key = request_key(path)
+        fixture = self.store.get(key)
+        if fixture is None and self.upstream is not None:
+            resp = requests.get(self.upstream + path)
+            fixture = dict(status=resp.status_code, content_type=resp.headers.get('Content-Type', 'text/plain'),
+                           body=resp.text)
+            self.store.put(key, fixture['status'], fixture['content_type'], fixture['body'])
+        with self.lock:
+            self.requests += 1
+            if fixture is None:
+                self.misses.append(key)
+        return fixture
+
+    def serve(self, port=0, host="127.0.0.1"):
+        """Serve from a daemon thread; port 0 picks a free port, see
+        server.server_address."""
+        fixtures = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fixture = fixtures.response(self.path)
+                if fixtures.latency:
+                    time.sleep(fixtures.latency)
+                if fixture is None:
+                    self.send_error(404, "No fixture recorded for this request")
+                    return
+                body = fixture['body'].encode('utf-8')
+                self.send_response(fixture['status'])
+                self.send_header("Content-Type", fixture['content_type'])
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record Solr responses for the reports and replay them offline. "
+                                                 "Point the reports at the server with "
+                                                 "ESGF_REPORTS_BASE_URL=http://127.0.0.1:<port>")
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("--store", type=str, required=True, help="Fixture directory")
+    parser.add_argument("--port", type=int, default=8999, help="Port to listen on (default 8999)")
+    parser.add_argument("--upstream", type=str, default="https://esgf-node.llnl.gov",
+                        help="Index node recorded from (default https://esgf-node.llnl.gov)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+
+    fixtures = FixtureServer(FixtureStore(args.store), args.upstream if args.mode == 'record' else None,
+                             args.latency)
+    server = fixtures.serve(args.port)
+    print("{} on http://{}:{}/".format(args.mode, *server.server_address[:2]))
+    try:
+        while True:
+            time.sleep(60)
+            print("{} requests, {} without a fixture".format(fixtures.requests, len(fixtures.misses)))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import datetime
+import json
+import os
+
+import numpy as np
+import requests
+
+import esgf_holdings_report as report
+import export
+from pivot import PivotMatrix
+from topology import solr_query_url
+
+
+def get_watermarks(project):
+    """Max _timestamp and _version_ of the project's original datasets,
+    (None, 0) when it has none."""
+    solr_url = solr_query_url(latest=False)
+    query = 'rows=0&facet=false&fq=project:{project}' \
+            '&stats=true&stats.field={{!max=true}}_timestamp&stats.field={{!max=true}}_version_'
+    req = requests.get(solr_url.format(query=query.format(project=project)))
+    stats = json.loads(req.text)['stats']['stats_fields']
+    version = (stats.get('_version_') or {}).get('max')
+    if version is None:
+        return None, 0
+    return stats['_timestamp']['max'], int(version)
+
+
+def get_changes(project, since, until):
+    """(source_ids, activity_ids) of the datasets indexed or updated with a
+    _version_ in (since, until], whatever their latest flag now."""
+    solr_url = solr_query_url(latest=False)
+    query = 'rows=0&fq=project:{project}&fq=_version_:{{{since} TO {until}]' \
+            '&facet.limit=-1&facet.mincount=1&facet.field=source_id&facet.field=activity_id'
+    req = requests.get(solr_url.format(query=query.format(project=project, since=since, until=until)))
+    fields = json.loads(req.text)['facet_counts']['facet_fields']
+    return fields['source_id'][::2], fields['activity_id'][::2]
+
+
+def shade_buckets(matrix, when):
+    # 0: within a week, 1: older than a week, 2: older than 28 days, as in the templates
+    days = matrix.age_days(when)
+    return (days > 7).astype(np.int8) + (days > 28)
+
+
+def needs_render(matrix, page, rendered, output_dir, now):
+    """A page is rendered again when it is missing, its matrix is missing
+    or a cell changed shade."""
+    if matrix is None or page not in rendered or not os.path.exists(os.path.join(output_dir, page)):
+        return True
+    then = datetime.datetime.strptime(rendered[page], '%Y-%m-%dT%H:%M:%S')
+    return bool((shade_buckets(matrix, then) != shade_buckets(matrix, now)).any())
+
+
+class State(object):
+    """Matrices and watermarks of the previous run, kept in `state_dir`."""
+
+    def __init__(self, state_dir, project):
+        self.dir = state_dir
+        self.project = project
+        self.path = os.path.join(state_dir, project + '.json')
+        self.meta = None
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.meta = json.load(f)
+
+    def matrix_path(self, name):
+        return os.path.join(self.dir, '{}_{}.npz'.format(self.project, name))
+
+    def load_matrix(self, name):
+        path = self.matrix_path(name)
+        return PivotMatrix.load(path) if os.path.exists(path) else None
+
+    def save_matrix(self, name, matrix):
+        tmp = self.matrix_path(name + '.tmp')
+        matrix.save(tmp)
+        os.replace(tmp, self.matrix_path(name))
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.path)
+
+
+def update_tables(project, output_dir, state_dir, compress=False, full=False,
+                  export_dir=None, formats=export.FORMATS, mode=report.DISTRIBUTED, refresh_days=7):
+    """Bring the holdings pages up to date with as little Solr work as possible.
+
+    Every table is computed without a previous state, with full=True, or
+    when the last full run is more than `refresh_days` old.  Otherwise
+    only the models with datasets indexed or updated since the _version_
+    watermark are queried again, with the queries of a full run, and
+    their rows replace the stored ones.  The countDistinct tables are
+    refreshed only for the models and activities that changed, and only
+    pages whose data or shading changed are rendered again.
+
+    Datasets deleted from the index leave no newer _version_ behind, so
+    the rows of their models stay stale until the next full run; the
+    periodic full refresh bounds how long.  With `export_dir` the data
+    files of export.py are written for the same pages.  `mode` is the
+    esgf_holdings_report.QueryMode of every table query.
+    """
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    state = State(state_dir, project)
+    now = datetime.datetime.now().replace(microsecond=0)
+    timestamp = now.strftime("%A %d %B %Y %H:%M:%S")
+    ts_mark, version_mark = get_watermarks(project)
+    page = project + '_esgf_holdings.html' + ('.gz' if compress else '')
+
+    activity_holdings = None if state.meta is None else state.load_matrix('activities')
+    if activity_holdings is not None and not full:
+        last_full = datetime.datetime.strptime(state.meta.get('full', '1970-01-01T00:00:00'), '%Y-%m-%dT%H:%M:%S')
+        full = now - last_full > datetime.timedelta(days=refresh_days)
+
+    if activity_holdings is None or full:
+        activity_holdings = report.get_latest_data_matrix(project, 'source_id', 'activity_id', mode=mode)
+        state.meta = dict(project_tables=report.get_project_tables(project, mode=mode),
+                          activity_tables={}, rendered={}, full=now.isoformat())
+        changed_activities = set(activity_holdings.columns)
+        changed = True
+        experiments = {}
+    else:
+        old = state.meta
+        # Rows of the models with any new _version_ are recomputed with the
+        # queries of a full run and replace the stored rows, so published,
+        # superseded, retracted and re-indexed datasets are all accounted
+        # for without counting anything twice.
+        changed_models, changed_activities = get_changes(project, old['version'], version_mark)
+        changed_activities = set(changed_activities)
+        changed = bool(changed_models)
+        print("{} models and {} activities changed since {}".format(
+            len(changed_models), len(changed_activities), old['timestamp']))
+
+        experiments = {}
+        if changed:
+            fresh = report.get_latest_data_matrix(project, 'source_id', 'activity_id', source_ids=changed_models,
+                                                  mode=mode)
+            changed_activities |= set(fresh.columns)
+            activity_holdings = activity_holdings.replace_rows(changed_models, fresh)
+            for activity_id in changed_activities & set(activity_holdings.columns):
+                matrix = state.load_matrix(activity_id)
+                if matrix is None:
+                    continue
+                experiments[activity_id] = matrix.replace_rows(changed_models, report.get_latest_data_matrix(
+                    project, 'source_id', 'experiment_id', activity_id=activity_id, source_ids=changed_models,
+                    mode=mode))
+
+            tables = report.get_project_tables(project, source_ids=changed_models, mode=mode)
+            for name in ('exp_sim_counts', 'variable_counts'):
+                rows = dict((k, v) for k, v in old['project_tables'][name].items() if k not in changed_models)
+                rows.update(tables[name])
+                tables[name] = rows
+            old['project_tables'] = tables
+
+    if changed or needs_render(activity_holdings, page, state.meta['rendered'], output_dir, now):
+        report.write_project_page(project, output_dir, timestamp, activity_holdings,
+                                  state.meta['project_tables'], compress)
+        state.meta['rendered'][page] = now.isoformat()
+        if export_dir is not None:
+            export.export_tables(export_dir, project, activity_holdings, state.meta['project_tables'],
+                                 dict(project=project, generated=timestamp), formats, now=now)
+    state.save_matrix('activities', activity_holdings)
+
+    for activity_id in activity_holdings.columns:
+        activity_page = os.path.join(activity_id, 'index.html' + ('.gz' if compress else ''))
+        stale = activity_id in changed_activities or activity_id not in state.meta['activity_tables']
+        if not stale and activity_id not in experiments:
+            experiments[activity_id] = state.load_matrix(activity_id)
+        if stale or experiments[activity_id] is None:
+            # a changed activity, or one whose matrix was never saved
+            if experiments.get(activity_id) is None:
+                experiments[activity_id] = report.get_latest_data_matrix(project, 'source_id', 'experiment_id',
+                                                                         activity_id=activity_id, mode=mode)
+            state.meta['activity_tables'][activity_id] = report.get_activity_tables(project, activity_id, mode)
+            state.save_matrix(activity_id, experiments[activity_id])
+        elif not needs_render(experiments[activity_id], activity_page, state.meta['rendered'], output_dir, now):
+            continue
+        report.write_activity_page(project, activity_id, output_dir, timestamp, experiments[activity_id],
+                                   state.meta['activity_tables'][activity_id], compress)
+        state.meta['rendered'][activity_page] = now.isoformat()
+        if export_dir is not None:
+            export.export_tables(export_dir, project + '_' + activity_id, experiments[activity_id],
+                                 state.meta['activity_tables'][activity_id],
+                                 dict(project=project, activity=activity_id, generated=timestamp), formats, now=now)
+
+    state.meta['timestamp'] = ts_mark
+    state.meta['version'] = version_mark
+    state.save()
@@ -1,169 +1,166 @@
-import requests, sys, json, datetime
+import requests, json, datetime, argparse
+import concurrent.futures
 
+from pivot import decode_pivot
+from render import PageWriter, TableRenderer
+from snapshots import SnapshotStore, added_per_day
+from topology import solr_query_url
 
 
-PROJECT=sys.argv[1]
-
-#summtable=(len(sys.argv > 2) and sys.argv[2] == "--summtable")
-#backfill=(len(sys.argv > 2) and sys.argv[2] == "--backfill")
-
-#PROJECT="CMIP6"
-
 CMIP_EXP = ["historical", "piControl", "1pctCO2", "amip", "abrupt-4xCO2"]
 
-search_url='https://esgf-node.llnl.gov/esg-search/search?project={}&{}&limit={}&format=application%2fsolr%2bjson&replica=false'
-
-GRAY = "CCCCCC"
 GREEN = "A9F5A9"
-MISSING = ""
-BR= "<br><br>"  # Adjust for space
+BR= "<br><br>\n"  # Adjust for space
 
+Experiment_TXT = "Number of 'datasets' [variables x (# of simulations)] from each model for each of the core experiments (DECK + historical).\n"
 
-row_cell_b="<tr><td><b>{}</b></td>"
-cell = '<td bgcolor="#{}">{}</td>'
+Activity_TXT = "Number of 'datasets' [variables x (# of simulations)]  from each model in support of each CMIP6 activity.\n"
 
-Experiment_TXT = "Number of 'datasets' [variables x (# of simulations)] from each model for each of the core experiments (DECK + historical)."
+Trend_model_TXT = "Number of 'datasets' added by each model on each day.\n"
 
-Activity_TXT = "Number of 'datasets' [variables x (# of simulations)]  from each model in support of each CMIP6 activity."
+Trend_activity_TXT = "Number of 'datasets' added in support of each CMIP6 activity on each day.\n"
 
-def print_header(TableType, columns, other):
+QSTR = "rows=0&fq=project:{project}&facet.limit=-1" \
+	"&facet.field=source_id&facet.field=activity_id&facet.field=experiment_id" \
+	"&facet.pivot=source_id,activity_id&facet.pivot=source_id,experiment_id"
 
-	header_cell = "<th>{}</th>"
+TABLE = TableRenderer(scroll=False)
 
-	print "<table border=\"1\" cellspacing=\"2\" cellpadding=\"4\">"
-	print "<tr><th>source_id</th>"
 
-	for col in columns:
+def get_matrices(project, until=None):
 
-		print header_cell.format(col)
+	# Load the source_id x activity_id and source_id x experiment_id
+	# dataset counts with a single pivot query, optionally only for the
+	# datasets published before the day `until`.  Like the esg-search
+	# query this replaces, every version of the original datasets is
+	# counted, not only the latest one
 
-	# if other:
-	# 	print "<th>Other</th>"		
-	print "</tr>"
+	query = QSTR.format(project=project)
+	if until is not None:
+		query += "&fq=_timestamp:[* TO {}T00:00:00Z}}".format(until.isoformat())
 
-
-def build_matrix(QSTR):
-
-
-	timestamp = datetime.datetime.now().strftime("%A %d %B %Y %H:%M:%S")
-	headstr = "ESGF CMIP6 data holdings as of {}"
-
-	print headstr.format(timestamp)
-
-	# 1 Load all the source ids currently published and get lists 
-
-	resp = requests.get(search_url.format(PROJECT,QSTR,0))
+	resp = requests.get(solr_query_url(latest=False).format(query=query))
 
 	jobj = json.loads(resp.text)
 
-	scid_dict = {}
-
-	activity_list = jobj["facet_counts"]["facet_fields"]["activity_id"][::2]
-	source_id_lst = jobj["facet_counts"]["facet_fields"]["source_id"][::2]
+	activities = decode_pivot(jobj, "source_id", "activity_id", pivot="source_id,activity_id")
+	experiments = decode_pivot(jobj, "source_id", "experiment_id", CMIP_EXP, pivot="source_id,experiment_id")
 
+	return activities, experiments
 
-	# query each to get the valid experiments and actvities
 
-	for fname in source_id_lst:
-		Qbase = "source_id={}&fields=id&facets=activity_id%2Cexperiment_id"
-		QSTR=Qbase.format(fname)
+def build_matrix(project, out):
 
-		resp = requests.get(search_url.format(PROJECT,QSTR,0))
 
-		j2 = json.loads(resp.text)
+	timestamp = datetime.datetime.now().strftime("%A %d %B %Y %H:%M:%S")
+	headstr = "ESGF CMIP6 data holdings as of {}\n"
 
-		scid_dict[fname] = j2
+	out.write(headstr.format(timestamp))
 
+	activities, experiments = get_matrices(project)
 
 	# activity table
 
-	print BR
-	print Activity_TXT
-	print BR
-
-	print_header("MIP Activities", activity_list, False)
-
+	out.write(BR)
+	out.write(Activity_TXT)
+	out.write(BR)
 
-	for fname in source_id_lst:
-
-		d = scid_dict[fname]
-
-		# print the label for
-		print row_cell_b.format(fname)
-
-		act_lst = d["facet_counts"]["facet_fields"]["activity_id"]
-
-		act_dict = {}
-		for k, v in zip(act_lst[::2], act_lst[1::2]):
-			act_dict[k] = v
-
-		for col in activity_list:
-			if col in act_dict:	
-
-				print cell.format(GREEN, act_dict[col])
-			else:
-				print cell.format(GRAY,MISSING)
-
-		print "</tr>"
-	print "</table>"
+	TABLE.render(out, "source_id", activities.rows, activities.columns,
+				activities.count, GREEN, activities.present)
 
 	# experiment table
 
-	print BR
-	print Experiment_TXT
-	print BR
+	out.write(BR)
+	out.write(Experiment_TXT)
+	out.write(BR)
 
-	print_header("CMIP Experiments", CMIP_EXP, True)
+	TABLE.render(out, "source_id", experiments.rows, experiments.columns,
+				experiments.count, GREEN, experiments.present)
 
-	for fname in source_id_lst:
+	return activities
 
-		d = scid_dict[fname]
 
-		exp_lst = d["facet_counts"]["facet_fields"]["experiment_id"]
+def build_daily_table(store, day, activities):
 
-		exp_dict = {}
-		for k, v in zip(exp_lst[::2], exp_lst[1::2]):
-			exp_dict[k] = v
+	store.save(day, activities)
 
-		# print the label for
-		print row_cell_b.format(fname)
 
-		for col in CMIP_EXP:
-			if col in exp_dict:	
+def backfill_tables(project, store, datefrom, dateto, workers=4):
 
-				print cell.format(GREEN, exp_dict[col])
-			else:
-				print cell.format(GRAY,MISSING)
+	# Rebuild the snapshots of past days from the _timestamp of the datasets
+	# that are currently published.  Datasets that have been unpublished
+	# since are not counted, so older snapshots are a lower bound.
 
-		print "</tr>"
-	print "</table>"
+	def backfill_day(day):
+		activities, _experiments = get_matrices(project, until=day + datetime.timedelta(days=1))
+		build_daily_table(store, day, activities)
+		return day
 
+	days = [datefrom + datetime.timedelta(days=n) for n in range((dateto - datefrom).days + 1)]
 
+	with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+		for day in pool.map(backfill_day, days):
+			print("Snapshot for {} done".format(day))
 
-def main():
 
-	QSTR = "facets=source_id%2Cactivity_id&fields=id"
+def assemble_page(project, store, out, ndays=30):
 
-	build_matrix(QSTR)
+	start = datetime.date.today() - datetime.timedelta(days=ndays)
+	days, rows, columns, counts = store.series(start=start)
+	if len(days) < 2:
+		out.write("Not enough snapshots since {} for a trend.\n".format(start))
+		return
 
+	added = added_per_day(counts)
+	dates = [d.isoformat() for d in days[1:]]
 
+	headstr = "ESGF CMIP6 data holdings growth from {} to {}\n"
+	out.write(headstr.format(days[0], days[-1]))
 
-if __name__ == '__main__':
-	main()
-
-
-#def build_daily_table():
+	per_model = added.sum(axis=2).T
+	out.write(BR)
+	out.write(Trend_model_TXT)
+	out.write(BR)
+	TABLE.render(out, "source_id", rows, dates, per_model, GREEN, per_model > 0)
 
+	per_activity = added.sum(axis=1).T
+	out.write(BR)
+	out.write(Trend_activity_TXT)
+	out.write(BR)
+	TABLE.render(out, "activity_id", columns, dates, per_activity, GREEN, per_activity > 0)
 
-#def backfill_tables(datefrom, dateto):
 
-#	for n in range(datefrom, dateto+1):
+def parse_date(text):
+	return datetime.datetime.strptime(text, "%Y-%m-%d").date()
 
 
+def main():
 
-#def assemble_page():
+	parser = argparse.ArgumentParser(description="Create HTML tables for the data holdings of ESGF")
+	parser.add_argument("project", type=str, help="MIP project name")
+	parser.add_argument("--snapshots", type=str, default=None, help="Directory of the daily holdings snapshots")
+	parser.add_argument("--backfill", nargs=2, metavar=("FROM", "TO"), type=parse_date, default=None,
+						help="Rebuild the snapshots of the days FROM to TO (YYYY-MM-DD) instead of writing a page")
+	parser.add_argument("--trend", type=int, metavar="DAYS", default=None,
+						help="Write the growth trend page of the last DAYS days instead of the holdings page")
+	args = parser.parse_args()
 
+	store = SnapshotStore(args.snapshots, args.project) if args.snapshots else None
+	if (args.backfill or args.trend) and store is None:
+		parser.error("--backfill and --trend need --snapshots")
 
+	if args.backfill:
+		backfill_tables(args.project, store, args.backfill[0], args.backfill[1])
+		return
 
+	with PageWriter() as out:
+		if args.trend:
+			assemble_page(args.project, store, out, args.trend)
+		else:
+			activities = build_matrix(args.project, out)
+			if store is not None:
+				build_daily_table(store, datetime.date.today(), activities)
 
 
+if __name__ == '__main__':
+	main()
@@ -1,368 +1,145 @@
-import requests
-import json
 import datetime
 import argparse
-import collections
 
+import numpy as np
 
-def get_solr_query_url():
-    search_url = 'https://esgf-node.llnl.gov/esg-search/search/' \
-                 '?limit=0&format=application%2Fsolr%2Bjson'
-
-    req = requests.get(search_url)
-    js = json.loads(req.text)
-    shards = js['responseHeader']['params']['shards']
-
-    solr_url = 'https://esgf-node.llnl.gov/solr/datasets/select' \
-               '?q=*:*&wt=json&facet=true&fq=type:Dataset' \
-               '&fq=replica:false&fq=latest:true&shards={shards}&{{query}}'
-    
-    return solr_url.format(shards=shards)
-
-
-def get_latest_data_holdings(project, row_facet, col_facet):
-    solr_url = get_solr_query_url()
-    
-    query = 'rows=0&fq=project:{project}' \
-            '&facet.field={row_facet}&facet.field={col_facet}' \
-            '&stats=true&stats.field={{!tag=piv max=true}}_timestamp' \
-            '&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
-    query_url = solr_url.format(query=query.format(project=project, 
-                                                   row_facet=row_facet, 
-                                                   col_facet=col_facet))
-    req = requests.get(query_url)
-    js = json.loads(req.text)
-    
-    rows = js['facet_counts']['facet_fields'][row_facet][::2]
-    columns = js['facet_counts']['facet_fields'][col_facet][::2]
-    
-    pivot = js['facet_counts']['facet_pivot'].keys()[0]
-    result = {}
-    for row in js['facet_counts']['facet_pivot'][pivot]:
-        row_val = {}
-        for col in row['pivot']:
-            ts_str = col['stats']['stats_fields']['_timestamp']['max']
-            timestamp = datetime.datetime.strptime(ts_str[:19], '%Y-%m-%dT%H:%M:%S')
-            row_val[col['value']] = dict(num=col['count'], timestamp=timestamp)
-        result[row['value']] = row_val
-            
-    return (rows, columns, result)
-
-
-def get_exp_sim_stats(project, row_facet, col_facet):
-    solr_url = get_solr_query_url()
-    
-    query = 'rows=0&fq=project:{project}' \
-            '&facet.field={row_facet}&facet.field={col_facet}' \
-            '&stats=true&stats.field={{!tag=piv countDistinct=true}}variant_label' \
-            '&facet.pivot={{!stats=piv}}{row_facet},{col_facet},experiment_id'
-    query_url = solr_url.format(query=query.format(project=project, 
-                                                   row_facet=row_facet, 
-                                                   col_facet=col_facet))
-    req = requests.get(query_url)
-    js = json.loads(req.text)
-    
-    rows = js['facet_counts']['facet_fields'][row_facet][::2]
-    columns = js['facet_counts']['facet_fields'][col_facet][::2]
-    
-    pivot = js['facet_counts']['facet_pivot'].keys()[0]
-    result = {}
-    for row in js['facet_counts']['facet_pivot'][pivot]:
-        row_val = {}
-        for col in row['pivot']:
-            num_exp = 0
-            num_sim = 0
-            for exp in col['pivot']:
-                num_exp += 1
-                num_sim += exp['stats']['stats_fields']['variant_label']['countDistinct']
-            row_val[col['value']] = dict(num_exp=num_exp, num_sim=num_sim)
-        result[row['value']] = row_val
-            
-    return (rows, columns, result)
-
-
-def get_facet_value_count(project, row_facet, col_facet, count_facet):                                           
-    solr_url = get_solr_query_url()
-    
-    query = 'rows=0&fq=project:{project}' \
-            '&facet.field={row_facet}&facet.field={col_facet}' \
-            '&stats=true&stats.field={{!tag=piv countDistinct=true}}{count_facet}' \
-            '&facet.pivot={{!stats=piv}}{row_facet},{col_facet}'
-    query_url = solr_url.format(query=query.format(project=project, 
-                                                   row_facet=row_facet, 
-                                                   col_facet=col_facet,
-												   count_facet=count_facet))
-    req = requests.get(query_url)
-    js = json.loads(req.text)
-    
-    rows = js['facet_counts']['facet_fields'][row_facet][::2]
-    columns = js['facet_counts']['facet_fields'][col_facet][::2]
-    
-    pivot = js['facet_counts']['facet_pivot'].keys()[0]
-    result = {}
-    for row in js['facet_counts']['facet_pivot'][pivot]:
-        row_val = {}
-        for col in row['pivot']:
-            num = col['stats']['stats_fields'][count_facet]['countDistinct']
-            row_val[col['value']] = num
-        result[row['value']] = row_val
-            
-    return (rows, columns, result)
-
-
-def build_holdings_table(holdings, source_id_list, col_total_name, col_names, time_shade=False):
-
-	table_counts = collections.defaultdict(dict)
-	source_totals = {k: 0 for k in source_id_list}
-	column_totals = {k: 0 for k in col_names}
-	total_models = 0
-
-	# counts and totals
-	for source_id in source_id_list:
-		table_counts[source_id] = collections.defaultdict(dict)
-		for col in col_names:
-			if col in holdings[source_id].keys():
-				source_totals[source_id] += 1
-				column_totals[col] += 1
-		total_models += source_totals[source_id]
-
-	GRAY = "CCCCCC"
-	MISSING = ""
-
-	header_cell = "<th>{}</th>"
-	row_cell_b="<tr><td><b>{}</b></td>"
-	cell = '<td bgcolor="#{}">{}</td>'
-	cell_bold = '<td><b>{}</b></td>'
-
-	# If time_shade is enabled, then the cells will be shaded by how recently
-	# the latest datasets were published.  The more recent the dataset, the darker the cell.
-	current_time = datetime.datetime.now()
-	def _time_green(_dt):
-		if time_shade:
-			diff = current_time - _dt
-			if diff.days > 28:  # older than a month
-				return "BBF7BB"
-			elif diff.days > 7: # older than a week
-				return "32E732"
-			else:				# within a week
-				return "15B715"
-		else:
-			return "A9F5A9"
-
-	print "<div style=\"overflow-x:auto;\">"
-	print "<table border=\"1\" cellspacing=\"2\" cellpadding=\"4\">"
-	print "<tr><th>source_id</th>"
-
-	for col in [col_total_name] + col_names:
-		print header_cell.format(col)
-
-	print "</tr>"
-
-	print row_cell_b.format('# of models')
-	print cell_bold.format(total_models)
-
-	for col in col_names:
-		print cell_bold.format(column_totals[col])
-
-	print "</tr>"
-
-	for source_id in source_id_list:
-		print row_cell_b.format(source_id)
-		print cell_bold.format(source_totals[source_id])
-
-		for col in col_names:
-			if col in holdings[source_id].keys():	
-				num_found = holdings[source_id][col]['num']
-				latest = holdings[source_id][col]['timestamp']
-				print cell.format(_time_green(latest), num_found)
-			else:
-				print cell.format(GRAY,MISSING)
-
-		print "</tr>"
-
-	print "</table>"
-	print "</div>"
-
-
-def build_exp_sim_table(exp_sim_counts, source_id_list, activity_id_list):
-
-	WHITE = "FFFFFF"
-	GRAY = "CCCCCC"
-	MISSING = ""
+from planner import QueryPlan
+from topology import solr_query_url
+from render import PageWriter, TableRenderer
 
-	header_cell = "<th>{}</th>"
-	row_cell_b="<tr><td><b>{}</b></td>"
-	cell = '<td bgcolor="#{}">{}</td>'
 
-	print "<div style=\"overflow-x:auto;\">"
-	print "<table border=\"1\" cellspacing=\"2\" cellpadding=\"4\">"
-	print "<tr><th>source_id</th>"
-
-	for activity_id in activity_id_list:
-		print header_cell.format(activity_id)
-
-	print "</tr>"
-
-	for source_id in source_id_list:
-		print row_cell_b.format(source_id)
-
-		for activity_id in activity_id_list:
-			if activity_id in exp_sim_counts[source_id].keys():
-				num_exp = exp_sim_counts[source_id][activity_id]['num_exp']
-				num_sim = exp_sim_counts[source_id][activity_id]['num_sim']
-				data = '{}/{}'.format(num_exp,num_sim)
-				print cell.format(WHITE,data)
-			else:
-				print cell.format(GRAY,MISSING)
-
-		print "</tr>"
-
-	print "</table>"
-	print "</div>"
-
-
-def build_var_table(var_counts, source_id_list, activity_id_list):
-
-	WHITE = "FFFFFF"
-	GRAY = "CCCCCC"
-	MISSING = ""
-
-	header_cell = "<th>{}</th>"
-	row_cell_b="<tr><td><b>{}</b></td>"
-	cell = '<td bgcolor="#{}">{}</td>'
-
-	print "<div style=\"overflow-x:auto;\">"
-	print "<table border=\"1\" cellspacing=\"2\" cellpadding=\"4\">"
-	print "<tr><th>source_id</th>"
-
-	for activity_id in activity_id_list:
-		print header_cell.format(activity_id)
+def get_solr_query_url():
+    # Shards are discovered once, cached and health checked by topology.py
+    return solr_query_url()
 
-	print "</tr>"
 
-	for source_id in source_id_list:
-		print row_cell_b.format(source_id)
+TIMESTAMP = ('_timestamp', 'max=true')
 
-		for activity_id in activity_id_list:
-			if activity_id in var_counts[source_id].keys():
-				num_vars = var_counts[source_id][activity_id]
-				data = '{}'.format(num_vars)
-				print cell.format(WHITE,data)
-			else:
-				print cell.format(GRAY,MISSING)
 
-		print "</tr>"
+def distinct(field):
+    return (field, 'countDistinct=true')
 
-	print "</table>"
-	print "</div>"
 
+TABLE = TableRenderer()
 
-def build_model_table(model_counts, frequency_list, activity_id_list):
 
-	WHITE = "FFFFFF"
-	GRAY = "CCCCCC"
-	MISSING = ""
+def build_holdings_table(out, holdings, col_total_name, row_total_name, time_shade=False):
 
-	header_cell = "<th>{}</th>"
-	row_cell_b="<tr><td><b>{}</b></td>"
-	cell = '<td bgcolor="#{}">{}</td>'
+	# If time_shade is enabled, then the cells will be shaded by how recently
+	# the latest datasets were published.  The more recent the dataset, the darker the cell.
+	if time_shade:
+		days = holdings.age_days()
+		shade = np.where(days > 28, "BBF7BB",			# older than a month
+				np.where(days > 7, "32E732", "15B715"))	# older than a week / within a week
+	else:
+		shade = "A9F5A9"
 
-	print "<div style=\"overflow-x:auto;\">"
-	print "<table border=\"1\" cellspacing=\"2\" cellpadding=\"4\">"
-	print "<tr><th>frequency</th>"
+	TABLE.render(out, 'source_id', holdings.rows, holdings.columns,
+				holdings.count, shade, holdings.present,
+				totals_label=col_total_name,
+				totals_row_label=row_total_name,
+				column_totals=holdings.column_totals(),
+				row_totals=holdings.row_totals(),
+				total=holdings.total())
 
-	for activity_id in activity_id_list:
-		print header_cell.format(activity_id)
 
-	print "</tr>"
+def build_exp_sim_table(out, exp_sim_counts):
+	values = np.char.add(np.char.add(exp_sim_counts.nested.astype(str), '/'),
+						exp_sim_counts.stat('variant_label').astype(str))
+	TABLE.render(out, 'source_id', exp_sim_counts.rows, exp_sim_counts.columns,
+				values, "FFFFFF", exp_sim_counts.present)
 
-	for frequency in frequency_list:
-		print row_cell_b.format(frequency)
 
-		for activity_id in activity_id_list:
-			if activity_id in model_counts[frequency].keys():
-				num_models = model_counts[frequency][activity_id]
-				data = '{}'.format(num_models)
-				print cell.format(WHITE,data)
-			else:
-				print cell.format(GRAY,MISSING)
+def build_var_table(out, var_counts):
+	TABLE.render(out, 'source_id', var_counts.rows, var_counts.columns,
+				var_counts.stat('variable_id'), "FFFFFF", var_counts.present)
 
-		print "</tr>"
 
-	print "</table>"
-	print "</div>"
+def build_model_table(out, model_counts):
+	TABLE.render(out, 'frequency', model_counts.rows, model_counts.columns,
+				model_counts.stat('source_id'), "FFFFFF", model_counts.present)
 
 
-def gen_tables(project, time_shade):
+def gen_tables(project, time_shade, out):
 
 	CMIP_EXP = ["historical", "piControl", "1pctCO2", "amip", "abrupt-4xCO2"]
-	BR= "<br><br>"  # Adjust for space
+	BR= "<br><br>\n"  # Adjust for space
 
-	Experiment_TXT = "Number of 'datasets' [variables x (# of simulations)] from each model for each of the core experiments (DECK + historical)."
+	Experiment_TXT = "Number of 'datasets' [variables x (# of simulations)] from each model for each of the core experiments (DECK + historical).\n"
 
-	Activity_TXT = "Number of 'datasets' [variables x (# of simulations)]  from each model in support of each CMIP6 activity."
+	Activity_TXT = "Number of 'datasets' [variables x (# of simulations)]  from each model in support of each CMIP6 activity.\n"
 
-	EXP_SIM_TXT = "Number of experiments and simulations [(# of experiments) / (# of simulations)] from each model in support of each CMIP6 activity."
+	EXP_SIM_TXT = "Number of experiments and simulations [(# of experiments) / (# of simulations)] from each model in support of each CMIP6 activity.\n"
 
-	Variables_TXT = "Number of variables from each model in support of each CMIP6 activity."
+	Variables_TXT = "Number of variables from each model in support of each CMIP6 activity.\n"
 
-	Models_per_freq_TXT = "Number of models providing output at each sampling frequency in support of each CMIP6 activity."
+	Models_per_freq_TXT = "Number of models providing output at each sampling frequency in support of each CMIP6 activity.\n"
 
 	timestamp = datetime.datetime.now().strftime("%A %d %B %Y %H:%M:%S")
-	headstr = "ESGF CMIP6 data holdings as of {}"
+	headstr = "ESGF CMIP6 data holdings as of {}\n"
 
-	print headstr.format(timestamp)
+	out.write(headstr.format(timestamp))
 
-	print BR
+	out.write(BR)
 
 	# time shading legend
 	if time_shade:
-		print "The cells are shaded by how recently their latest datasets were published."
-		print BR
-		print "<table border=\"1\" cellspacing=\"2\" cellpadding=\"4\"><tr>"
-		print '<td bgcolor="#BBF7BB">More than 28 days</td>'
-		print '<td bgcolor="#32E732">More than 7 days</td>'
-		print '<td bgcolor="#15B715">Less than 7 days</td>'
-		print "</tr></table><br>"
+		out.write("The cells are shaded by how recently their latest datasets were published.\n")
+		out.write(BR)
+		out.write("<table border=\"1\" cellspacing=\"2\" cellpadding=\"4\"><tr>\n"
+				  '<td bgcolor="#BBF7BB">More than 28 days</td>\n'
+				  '<td bgcolor="#32E732">More than 7 days</td>\n'
+				  '<td bgcolor="#15B715">Less than 7 days</td>\n'
+				  "</tr></table><br>\n")
+
+	# All tables come from one plan: the source_id pivots share a request,
+	# the frequency pivot has its own and both run concurrently
+	plan = QueryPlan('fq=project:' + project)
+	activities = plan.add('source_id', 'activity_id', stats=[TIMESTAMP, distinct('variable_id')])
+	experiments = plan.add('source_id', 'experiment_id', stats=[TIMESTAMP])
+	exp_sims = plan.add('source_id', 'activity_id', 'experiment_id', stats=[distinct('variant_label')])
+	frequencies = plan.add('frequency', 'activity_id', stats=[distinct('source_id')])
+	plan.run(get_solr_query_url())
 
 	# activity table
-	print Activity_TXT
-	print BR
+	out.write(Activity_TXT)
+	out.write(BR)
 
-	source_id_list, activity_id_list, activity_holdings = get_latest_data_holdings(project, 'source_id', 'activity_id')
-	build_holdings_table(activity_holdings, source_id_list, '# of activities', activity_id_list, time_shade)
+	activity_holdings = plan.matrix(activities)
+	activity_id_list = activity_holdings.columns
+	build_holdings_table(out, activity_holdings, '# of activities', '# of models', time_shade)
 
 	# experiment table
-	print BR
-	print Experiment_TXT
-	print BR
+	out.write(BR)
+	out.write(Experiment_TXT)
+	out.write(BR)
 
-	source_id_list, experiment_id_list, experiment_holdings = get_latest_data_holdings(project, 'source_id', 'experiment_id')
-	build_holdings_table(experiment_holdings, source_id_list, '# of expts', CMIP_EXP, time_shade)
+	experiment_holdings = plan.matrix(experiments, CMIP_EXP)
+	build_holdings_table(out, experiment_holdings, '# of expts', '# of models', time_shade)
 
 	# # experiments / # of simulations table
-	print BR
-	print EXP_SIM_TXT
-	print BR
+	out.write(BR)
+	out.write(EXP_SIM_TXT)
+	out.write(BR)
 	
-	source_id_list, _activity_id_list, exp_sim_counts = get_exp_sim_stats(project, 'source_id', 'activity_id')
-	build_exp_sim_table(exp_sim_counts, source_id_list, activity_id_list)
+	exp_sim_counts = plan.matrix(exp_sims, activity_id_list)
+	build_exp_sim_table(out, exp_sim_counts)
 
 	# # variables
-	print BR
-	print Variables_TXT
-	print BR
+	out.write(BR)
+	out.write(Variables_TXT)
+	out.write(BR)
 
-	source_id_list, _activity_id_list, var_counts = get_facet_value_count(project, 'source_id', 'activity_id', 'variable_id')
-	build_var_table(var_counts, source_id_list, activity_id_list)
+	# the variable counts come with the activity holdings
+	build_var_table(out, activity_holdings)
 
 	# # models 
-	print BR
-	print Models_per_freq_TXT
-	print BR
+	out.write(BR)
+	out.write(Models_per_freq_TXT)
+	out.write(BR)
 
-	frequency_list, _activity_id_list, model_counts = get_facet_value_count(project, 'frequency', 'activity_id', 'source_id')
-	build_model_table(model_counts, frequency_list, activity_id_list)
+	model_counts = plan.matrix(frequencies, activity_id_list)
+	build_model_table(out, model_counts)
 
 
 def main():
@@ -370,9 +147,12 @@ def main():
 	parser = argparse.ArgumentParser(description="Create HTML tables for the data holdings of ESGF")
 	parser.add_argument("--project", "-p", dest="project", type=str, default="CMIP6", help="MIP project name (default is CMIP6)")
 	parser.add_argument("--timeshade", help="Shade cells based on how recently the datasets were published", action="store_true")
+	parser.add_argument("--output", "-o", dest="output", type=str, default=None, help="Output file (default is stdout)")
+	parser.add_argument("--gzip", help="Gzip the output", action="store_true")
 	args = parser.parse_args()
 
-	gen_tables(args.project, args.timeshade)
+	with PageWriter(args.output, compress=args.gzip) as out:
+		gen_tables(args.project, args.timeshade, out)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+import datetime
+
+import numpy as np
+
+
+class PivotMatrix(object):
+    """Dense matrices decoded from one two-level Solr facet.pivot.
+
+    count[i, j] is the number of datasets for rows[i] x columns[j];
+    timestamp[i, j] the max _timestamp of the cell (NaT when missing);
+    distinct[field][i, j] the countDistinct of a stats field, summed over
+    the third pivot level when there is one, and nested[i, j] the number of
+    third level values.  row_index and col_index map labels to positions.
+    """
+
+    def __init__(self, rows, columns):
+        self.rows = list(rows)
+        self.columns = list(columns)
+        self.row_index = dict((v, i) for i, v in enumerate(self.rows))
+        self.col_index = dict((v, j) for j, v in enumerate(self.columns))
+        shape = (len(self.rows), len(self.columns))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.timestamp = np.full(shape, np.datetime64('NaT'), dtype='datetime64[s]')
+        self.nested = np.zeros(shape, dtype=np.int64)
+        self.distinct = {}
+
+    @property
+    def present(self):
+        return self.count > 0
+
+    def row_totals(self):
+        """Number of populated columns in each row."""
+        return self.present.sum(axis=1)
+
+    def column_totals(self):
+        """Number of populated rows in each column."""
+        return self.present.sum(axis=0)
+
+    def total(self):
+        return int(self.present.sum())
+
+    def age_days(self, now=None):
+        """Whole days since the latest dataset of each cell (-1 when missing)."""
+        if now is None:
+            now = datetime.datetime.now()
+        age = (np.datetime64(now, 's') - self.timestamp).astype('timedelta64[D]').astype(np.int64)
+        return np.where(self.present & ~np.isnat(self.timestamp), age, -1)
+
+    def stat(self, field):
+        """countDistinct matrix of `field`, zero when the response had none."""
+        if field not in self.distinct:
+            return np.zeros(self.count.shape, dtype=np.int64)
+        return self.distinct[field]
+
+    def cells(self, values):
+        """{row: {column: value}} for the populated cells of `values`."""
+        result = dict((r, {}) for r in self.rows)
+        for i, j in zip(*np.nonzero(self.present)):
+            result[self.rows[i]][self.columns[j]] = values[i, j].tolist()
+        return result
+
+    def reindex(self, rows, columns):
+        """A copy laid out on the given labels; unknown labels are dropped."""
+        other = PivotMatrix(rows, columns)
+        src_r = [i for i, v in enumerate(self.rows) if v in other.row_index]
+        src_c = [j for j, v in enumerate(self.columns) if v in other.col_index]
+        dst_r = np.array([other.row_index[self.rows[i]] for i in src_r], dtype=np.intp)
+        dst_c = np.array([other.col_index[self.columns[j]] for j in src_c], dtype=np.intp)
+        src = np.ix_(src_r, src_c)
+        dst = np.ix_(dst_r, dst_c)
+        other.count[dst] = self.count[src]
+        other.timestamp[dst] = self.timestamp[src]
+        other.nested[dst] = self.nested[src]
+        for field, values in self.distinct.items():
+            other.distinct[field] = np.zeros(other.count.shape, dtype=np.int64)
+            other.distinct[field][dst] = values[src]
+        return other
+
+    def merge(self, delta):
+        """Add the counts of `delta`.
+
+        Labels are the union of both matrices and rows or columns left
+        without any dataset are dropped.  Timestamps are the max of both;
+        countDistinct is not mergeable and is not carried over.
+        """
+        rows = self.rows + [r for r in delta.rows if r not in self.row_index]
+        columns = self.columns + [c for c in delta.columns if c not in self.col_index]
+        merged = self.reindex(rows, columns)
+        merged.distinct = {}
+        other = delta.reindex(rows, columns)
+        merged.count = merged.count + other.count
+        merged.timestamp = np.maximum(merged.timestamp.view(np.int64),
+                                      other.timestamp.view(np.int64)).view('datetime64[s]')
+        present = merged.present
+        keep_rows = [r for i, r in enumerate(rows) if present[i].any()]
+        keep_cols = [c for j, c in enumerate(columns) if present[:, j].any()]
+        return merged.reindex(keep_rows, keep_cols)
+
+    def sorted_by_count(self):
+        """A copy with rows and columns by decreasing dataset count, then
+        label, the order of Solr's facet.sort=count."""
+        rows = sorted(self.rows, key=lambda r: (-int(self.count[self.row_index[r]].sum()), r))
+        columns = sorted(self.columns, key=lambda c: (-int(self.count[:, self.col_index[c]].sum()), c))
+        return self.reindex(rows, columns)
+
+    def replace_rows(self, rows, fresh):
+        """A copy with `rows` taken from `fresh` instead of this matrix;
+        rows missing from `fresh` are dropped, as are emptied columns.
+        Labels are sorted by count so the order does not depend on which
+        rows were replaced."""
+        rows = set(rows)
+        kept = self.reindex([r for r in self.rows if r not in rows], self.columns)
+        return kept.merge(fresh.reindex([r for r in fresh.rows if r in rows], fresh.columns)).sorted_by_count()
+
+    def save(self, path):
+        arrays = dict(rows=np.array(self.rows, dtype=str), columns=np.array(self.columns, dtype=str),
+                      count=self.count, timestamp=self.timestamp, nested=self.nested)
+        for field, values in self.distinct.items():
+            arrays['distinct_' + field] = values
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            matrix = cls(arrays['rows'].tolist(), arrays['columns'].tolist())
+            matrix.count = arrays['count']
+            matrix.timestamp = arrays['timestamp']
+            matrix.nested = arrays['nested']
+            for name in arrays.files:
+                if name.startswith('distinct_'):
+                    matrix.distinct[name[len('distinct_'):]] = arrays[name]
+        return matrix
+
+    def to_holdings(self, now=None):
+        """The nested dict layout the holdings templates expect."""
+        age = self.age_days(now)
+        datasets = dict((r, {}) for r in self.rows)
+        for i, j in zip(*np.nonzero(self.present)):
+            datasets[self.rows[i]][self.columns[j]] = dict(num=int(self.count[i, j]), days=int(age[i, j]))
+        return dict(row_totals=dict(zip(self.rows, self.row_totals().tolist())),
+                    column_totals=dict(zip(self.columns, self.column_totals().tolist())),
+                    total=self.total(),
+                    datasets=datasets)
+
+
+def facet_values(js, facet):
+    return js['facet_counts']['facet_fields'][facet][::2]
+
+
+def decode_pivot(js, row_facet, col_facet, selected_columns=None, pivot=None):
+    """Turn a Solr facet.pivot response into a PivotMatrix.
+
+    Rows and columns come from the facet.field counts of the same response,
+    or `selected_columns` to keep only some columns.  `pivot` selects the
+    facet_pivot entry when the response holds more than one.
+    """
+    rows = facet_values(js, row_facet)
+    columns = facet_values(js, col_facet) if selected_columns is None else selected_columns
+    matrix = PivotMatrix(rows, columns)
+
+    pivots = js['facet_counts']['facet_pivot']
+    if pivot is None:
+        pivot = list(pivots.keys())[0]
+    fill_pivot(matrix, pivots[pivot])
+    return matrix
+
+
+def fill_pivot(matrix, entries):
+    """Scatter a list of facet.pivot entries (rows with a nested column
+    pivot) into `matrix`; labels missing from the matrix are skipped."""
+    # Collect flat coordinate/value lists in one pass over the JSON, then
+    # scatter them into the matrices with vectorised assignments.
+    ri, ci, counts, nested, ts_i, ts = [], [], [], [], [], []
+    distinct = {}
+    n = 0
+    for row in entries:
+        i = matrix.row_index.get(row['value'])
+        if i is None:
+            continue
+        for col in row.get('pivot', ()):
+            j = matrix.col_index.get(col['value'])
+            if j is None:
+                continue
+            ri.append(i)
+            ci.append(j)
+            counts.append(col['count'])
+            inner = col.get('pivot')
+            if inner is None:
+                nested.append(0)
+                stats = [col.get('stats', {}).get('stats_fields', {})]
+            else:
+                nested.append(len(inner))
+                stats = [sub.get('stats', {}).get('stats_fields', {}) for sub in inner]
+            for fields in stats:
+                for field, values in fields.items():
+                    if values.get('max') is not None and field == '_timestamp':
+                        ts_i.append(n)
+                        ts.append(values['max'][:19])
+                    if 'countDistinct' in values:
+                        distinct.setdefault(field, []).append((n, values['countDistinct']))
+            n += 1
+
+    r = np.array(ri, dtype=np.intp)
+    c = np.array(ci, dtype=np.intp)
+    matrix.count[r, c] = counts
+    matrix.nested[r, c] = nested
+    if ts:
+        # numpy parses ISO 8601 strings in bulk; cells with several nested
+        # stats keep the latest timestamp
+        idx = np.array(ts_i, dtype=np.intp)
+        np.maximum.at(matrix.timestamp.view(np.int64), (r[idx], c[idx]),
+                      np.array(ts, dtype='datetime64[s]').view(np.int64))
+    for field, pairs in distinct.items():
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        values = np.zeros(matrix.count.shape, dtype=np.int64)
+        np.add.at(values, (r[pairs[:, 0]], c[pairs[:, 0]]), pairs[:, 1])
+        matrix.distinct[field] = values
@@ -0,0 +1,74 @@
+import concurrent.futures
+import json
+
+import requests
+
+from pivot import decode_pivot
+
+
+class QueryPlan(object):
+    """The pivots needed by a page, fetched with as few requests as possible.
+
+    Tables register the pivot and stats they need with add() and get the
+    decoded matrices from matrix() once run() has been called.  A pivot
+    over the same facets is only requested once with the union of the
+    stats wanted from it, and pivots sharing their row facet go into the
+    same request.  The requests of different row facets run concurrently.
+    """
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.pivots = {}
+        self.responses = {}
+
+    def add(self, row_facet, col_facet, nested=None, stats=()):
+        """Register a row_facet x col_facet pivot, optionally with a third
+        level, and (field, local params) stats such as ('_timestamp',
+        'max=true').  Returns the key to pass to matrix()."""
+        fields = (row_facet, col_facet) + ((nested,) if nested else ())
+        self.pivots.setdefault(fields, set()).update(stats)
+        return fields
+
+    def queries(self):
+        """{row facet: query string}, one request per row facet."""
+        groups = {}
+        for fields in self.pivots:
+            groups.setdefault(fields[0], []).append(fields)
+
+        queries = {}
+        for row_facet, pivots in groups.items():
+            facets = dict.fromkeys(f for fields in pivots for f in fields[:2])
+            stats = {}
+            for fields in pivots:
+                for field, params in self.pivots[fields]:
+                    stats.setdefault(field, set()).add(params)
+            tags = dict((field, 's{}'.format(k)) for k, field in enumerate(sorted(stats)))
+
+            query = 'rows=0&' + self.filters + ''.join('&facet.field=' + f for f in facets)
+            if stats:
+                query += '&stats=true' + ''.join(
+                    '&stats.field={{!tag={} {}}}{}'.format(tags[field], ' '.join(sorted(stats[field])), field)
+                    for field in sorted(stats))
+            for fields in pivots:
+                wanted = sorted(set(tags[field] for field, _params in self.pivots[fields]))
+                query += '&facet.pivot=' + ('{{!stats={}}}'.format(','.join(wanted)) if wanted else '') + \
+                         ','.join(fields)
+            queries[row_facet] = query
+        return queries
+
+    def run(self, solr_url, workers=3):
+        """Send the requests, `solr_url` being a select URL with a {query} slot."""
+        queries = self.queries()
+
+        def fetch(query):
+            req = requests.get(solr_url.format(query=query))
+            req.raise_for_status()
+            return json.loads(req.text)
+
+        with concurrent.futures.ThreadPoolExecutor(max(1, min(workers, len(queries)))) as pool:
+            self.responses = dict(zip(queries, pool.map(fetch, queries.values())))
+        return self
+
+    def matrix(self, key, selected_columns=None):
+        """The PivotMatrix of a pivot registered with add()."""
+        return decode_pivot(self.responses[key[0]], key[0], key[1], selected_columns, pivot=','.join(key))
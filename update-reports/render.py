@@ -0,0 +1,180 @@
+import functools
+import gzip
+import io
+import os
+import sys
+
+import jinja2
+import numpy as np
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+GRAY = "CCCCCC"
+WHITE = "FFFFFF"
+# Holdings cells published within a week, more than 7 days and more than 28 days ago
+SHADES = ("15B715", "32E732", "BBF7BB")
+
+
+class PageWriter(object):
+    """Buffered output for a report page.
+
+    Text is collected in memory and written out in chunks of at least
+    `chunk_size` characters, to `path` or to `stream` (stdout by default).
+    With compress=True the output is gzipped.  A page written to a path is
+    first written to a temporary file next to it and renamed into place on
+    close(), so readers never see a half written page.  An uncompressed
+    page goes to a text stream without a binary buffer, such as StringIO,
+    as str.
+    """
+
+    def __init__(self, path=None, stream=None, compress=False, chunk_size=1 << 16):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        if path is not None:
+            self.tmp_path = path + '.tmp'
+            raw = open(self.tmp_path, 'wb')
+        else:
+            raw = getattr(stream or sys.stdout, 'buffer', stream or sys.stdout)
+        self.raw = raw
+        self.text = isinstance(raw, io.TextIOBase)
+        if compress and self.text:
+            raise ValueError('cannot write gzipped output to a text stream')
+        self.out = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self.buffer:
+            text = ''.join(self.buffer)
+            self.out.write(text if self.text else text.encode('utf-8'))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.out is not self.raw:
+            self.out.close()
+        if self.path is not None:
+            self.raw.close()
+            os.replace(self.tmp_path, self.path)
+        else:
+            self.raw.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.path is not None:
+            self.raw.close()
+            os.remove(self.tmp_path)
+            return False
+        self.close()
+        return False
+
+
+class TableRenderer(object):
+    """Renders a label x column matrix as an HTML table.
+
+    The cell markup is compiled once into bound str.format methods and each
+    row is joined into a single string before it is handed to the writer.
+    """
+
+    def __init__(self, table_open='<table border="1" cellspacing="2" cellpadding="4">',
+                 header='<th>{}</th>', label='<tr><td><b>{}</b></td>',
+                 cell='<td bgcolor="#{}">{}</td>', bold='<td><b>{}</b></td>',
+                 scroll=True):
+        self.table_open = table_open
+        self.header = header.format
+        self.label = label.format
+        self.cell = cell.format
+        self.bold = bold.format
+        self.scroll = scroll
+
+    def render(self, out, row_name, rows, columns, values, colours, present,
+               totals_label=None, totals_row_label=None, column_totals=None, row_totals=None, total=None):
+        """Write the table to `out`.
+
+        values and colours are 2-D arrays matching rows x columns; cells
+        where `present` is false are rendered empty and gray.  When
+        totals_label is given, a totals column headed by it and a totals row
+        labelled totals_row_label are added.
+        """
+        values = np.where(present, np.asarray(values).astype(str), "")
+        colours = np.where(present, colours, GRAY)
+        cell = self.cell
+        chunks = []
+        if self.scroll:
+            chunks.append('<div style="overflow-x:auto;">\n')
+        chunks.append(self.table_open + '\n')
+        header = [row_name] + ([totals_label] if totals_label else []) + list(columns)
+        chunks.append('<tr>' + ''.join(self.header(h) for h in header) + '</tr>\n')
+        if totals_label:
+            chunks.append(self.label(totals_row_label) + self.bold(total) +
+                          ''.join(self.bold(n) for n in column_totals) + '</tr>\n')
+        out.write(''.join(chunks))
+
+        for i, row in enumerate(rows):
+            line = self.label(row)
+            if totals_label:
+                line += self.bold(row_totals[i])
+            line += ''.join(map(cell, colours[i], values[i]))
+            out.write(line + '</tr>\n')
+
+        out.write('</table>\n' + ('</div>\n' if self.scroll else ''))
+
+
+def write_template(template, path, compress=False, **context):
+    """Stream a Jinja template into `path` through a PageWriter."""
+    if compress:
+        path += '.gz'
+    with PageWriter(path, compress=compress) as out:
+        out.writelines(template.generate(**context))
+        out.write('\n')
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def template_environment(directory=TEMPLATE_DIR, cache_dir=None):
+    """The Jinja environment shared by all pages, with compiled templates
+    cached in memory and their bytecode on disk between runs.
+
+    The bytecode goes to Jinja's private per-user directory unless
+    `cache_dir` is given, which is then created readable by its owner
+    only.  Templates edited on disk are still picked up.
+    """
+    if cache_dir is not None and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, mode=0o700)
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(directory),
+                              bytecode_cache=jinja2.FileSystemBytecodeCache(cache_dir))
+
+
+def holdings_grid(matrix, now=None):
+    """(row, row total, [(colour, text), ...]) of each row of a holdings
+    matrix, with the cells shaded by the age of their latest dataset.
+    Rows are generated while the template renders them."""
+    days = matrix.age_days(now)
+    shades = np.array(SHADES + (GRAY,))
+    shade = np.where(matrix.present, (days > 7).astype(np.intp) + (days > 28), len(SHADES))
+    present = matrix.present
+    for i, (row, total) in enumerate(zip(matrix.rows, matrix.row_totals().tolist())):
+        text = np.where(present[i], matrix.count[i].astype(str), '')
+        yield row, total, list(zip(shades[shade[i]].tolist(), text.tolist()))
+
+
+def cells_grid(rows, columns, cells, fmt=str):
+    """(row, [(colour, text), ...]) of each row of a {row: {column: value}}
+    table; populated cells are white with fmt(value), the others gray."""
+    empty = (GRAY, '')
+    for row in rows:
+        values = cells.get(row, {})
+        yield row, [(WHITE, fmt(values[c])) if c in values else empty for c in columns]
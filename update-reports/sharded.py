@@ -0,0 +1,184 @@
+import concurrent.futures
+import json
+
+import numpy as np
+import requests
+
+from pivot import PivotMatrix
+from topology import TOPOLOGY, shard_query_url
+
+# Values returned per parent below the row and column levels; a shard
+# reaching it falls back to the distributed countDistinct
+LEVEL_LIMIT = 2000
+
+
+def shard_query(filters, row_facet, col_facet, levels=(), timestamps=False, facet_limit=-1,
+                level_limit=LEVEL_LIMIT):
+    """Pivot query for a single shard.
+
+    The row and column values are limited to `facet_limit` like in the
+    distributed query (see QueryMode), and the countDistinct stats are
+    replaced by extra pivot levels so that the exact value sets of every
+    shard can be united.  Those levels are capped at `level_limit` values
+    per parent.
+    """
+    query = 'rows=0&{}&facet.limit={}&facet.mincount=1' \
+            '&facet.field={}&facet.field={}'.format(filters, facet_limit, row_facet, col_facet)
+    query += ''.join('&f.{}.facet.limit={}'.format(level, level_limit) for level in levels)
+    pivot = ','.join((row_facet, col_facet) + tuple(levels))
+    if timestamps:
+        query += '&stats=true&stats.field={!tag=piv max=true}_timestamp&facet.pivot={!stats=piv}' + pivot
+    else:
+        query += '&facet.pivot=' + pivot
+    return query
+
+
+def fetch_shards(query, latest=True, shards=None, timeout=300):
+    """Responses of `query` sent directly to every healthy shard core in parallel."""
+    if shards is None:
+        shards = TOPOLOGY.healthy_shards()
+
+    def fetch(shard):
+        req = requests.get(shard_query_url(shard, latest).format(query=query), timeout=timeout)
+        req.raise_for_status()
+        return json.loads(req.text)
+
+    with concurrent.futures.ThreadPoolExecutor(len(shards)) as pool:
+        return list(pool.map(fetch, shards))
+
+
+def truncated(responses, level_limit, depth):
+    """True when a pivot level below the first `depth` returned `level_limit` values somewhere."""
+    def walk(entries, level):
+        for entry in entries:
+            inner = entry.get('pivot', ())
+            if level >= depth and len(inner) >= level_limit:
+                return True
+            if walk(inner, level + 1):
+                return True
+        return False
+    return any(walk(entries, 1) for js in responses for entries in js['facet_counts']['facet_pivot'].values())
+
+
+def _leaves(entries, path=()):
+    # Value paths from the entries down to the deepest pivot level
+    for entry in entries:
+        if entry.get('pivot'):
+            for leaf in _leaves(entry['pivot'], path + (entry['value'],)):
+                yield leaf
+        else:
+            yield path + (entry['value'],)
+
+
+def _labels(responses, facet):
+    # Facet values by decreasing total count, as Solr sorts them
+    totals = {}
+    for js in responses:
+        counts = js['facet_counts']['facet_fields'][facet]
+        for value, count in zip(counts[::2], counts[1::2]):
+            totals[value] = totals.get(value, 0) + count
+    return sorted(totals, key=lambda v: (-totals[v], v))
+
+
+def merge_shards(responses, row_facet, col_facet, selected_columns=None, levels=()):
+    """Merge the per-shard responses of shard_query into one PivotMatrix.
+
+    Counts are summed and timestamps are the max over the shards.  With
+    extra pivot levels the value paths below each cell are united across
+    shards: nested is the number of distinct values of the first level and
+    distinct[levels[-1]] the number of distinct paths, which is what the
+    distributed countDistinct gives, summed over the first level when
+    there are two.
+    """
+    rows = _labels(responses, row_facet)
+    columns = _labels(responses, col_facet) if selected_columns is None else selected_columns
+    matrix = PivotMatrix(rows, columns)
+
+    # Flat coordinate lists over all the shards, aggregated with unbuffered
+    # numpy operations as in pivot.fill_pivot
+    ri, ci, counts, ts_i, ts = [], [], [], [], []
+    path_ids, first_ids, leaf_cell, leaf_path, leaf_first = {}, {}, [], [], []
+    n = 0
+    for js in responses:
+        for entries in js['facet_counts']['facet_pivot'].values():
+            for row in entries:
+                i = matrix.row_index.get(row['value'])
+                if i is None:
+                    continue
+                for col in row.get('pivot', ()):
+                    j = matrix.col_index.get(col['value'])
+                    if j is None:
+                        continue
+                    ri.append(i)
+                    ci.append(j)
+                    counts.append(col['count'])
+                    max_ts = col.get('stats', {}).get('stats_fields', {}).get('_timestamp', {}).get('max')
+                    if max_ts is not None:
+                        ts_i.append(n)
+                        ts.append(max_ts[:19])
+                    if levels:
+                        for path in _leaves(col.get('pivot', ())):
+                            leaf_cell.append(n)
+                            leaf_path.append(path_ids.setdefault(path, len(path_ids)))
+                            leaf_first.append(first_ids.setdefault(path[0], len(first_ids)))
+                    n += 1
+
+    r = np.array(ri, dtype=np.intp)
+    c = np.array(ci, dtype=np.intp)
+    np.add.at(matrix.count, (r, c), np.array(counts, dtype=np.int64))
+    if ts:
+        idx = np.array(ts_i, dtype=np.intp)
+        np.maximum.at(matrix.timestamp.view(np.int64), (r[idx], c[idx]),
+                      np.array(ts, dtype='datetime64[s]').view(np.int64))
+
+    if levels:
+        # distinct (cell, value) pairs counted per cell
+        cells = np.ravel_multi_index((r, c), matrix.count.shape)
+        cell = cells[np.array(leaf_cell, dtype=np.intp)]
+
+        def distinct(ids):
+            pairs = np.unique(np.stack([cell, np.array(ids, dtype=np.int64)]), axis=1)
+            return np.bincount(pairs[0], minlength=matrix.count.size).reshape(matrix.count.shape)
+
+        matrix.distinct[levels[-1]] = distinct(leaf_path)
+        matrix.nested = distinct(leaf_first)
+    return matrix
+
+
+def shard_pivot(filters, row_facet, col_facet, selected_columns=None, levels=(), timestamps=False,
+                facet_limit=-1, latest=True, shards=None, level_limit=LEVEL_LIMIT):
+    """The pivot of `filters` computed by the shards and merged here, or
+    None when a shard cut an extra level short at `level_limit`."""
+    query = shard_query(filters, row_facet, col_facet, levels, timestamps, facet_limit, level_limit)
+    responses = fetch_shards(query, latest, shards)
+    if levels and truncated(responses, level_limit, 2):
+        return None
+    return merge_shards(responses, row_facet, col_facet, selected_columns, levels)
+
+
+def compare(matrix, reference, levels=()):
+    """Differences of a merged matrix from the distributed `reference`,
+    on the labels of both, as a list of messages."""
+    rows = reference.rows + [r for r in matrix.rows if r not in reference.row_index]
+    columns = reference.columns + [c for c in matrix.columns if c not in reference.col_index]
+    diffs = ['missing row {}'.format(r) for r in reference.rows if r not in matrix.row_index]
+    diffs += ['extra row {}'.format(r) for r in matrix.rows if r not in reference.row_index]
+    diffs += ['missing column {}'.format(c) for c in reference.columns if c not in matrix.col_index]
+    diffs += ['extra column {}'.format(c) for c in matrix.columns if c not in reference.col_index]
+    merged = matrix.reindex(rows, columns)
+    reference = reference.reindex(rows, columns)
+    arrays = [('count', merged.count, reference.count)]
+    if not np.isnat(reference.timestamp).all():
+        arrays.append(('timestamp', merged.timestamp, reference.timestamp))
+    if len(levels) > 1:
+        arrays.append(('nested', merged.nested, reference.nested))
+    if levels:
+        arrays.append((levels[-1], merged.stat(levels[-1]), reference.stat(levels[-1])))
+    for name, ours, theirs in arrays:
+        if name == 'timestamp':
+            differ = ours.view(np.int64) != theirs.view(np.int64)
+        else:
+            differ = ours != theirs
+        for i, j in zip(*np.nonzero(differ)):
+            diffs.append('{} {},{}: {} != {}'.format(name, rows[i], columns[j], ours[i, j], theirs[i, j]))
+    return diffs
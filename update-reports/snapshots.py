@@ -0,0 +1,59 @@
+import datetime
+import os
+
+import numpy as np
+
+from pivot import PivotMatrix
+
+
+class SnapshotStore(object):
+    """Daily holdings count matrices, one compressed .npz file per day.
+
+    A snapshot only keeps the row and column labels and the counts as
+    int32, which compresses to a few kB per day for CMIP6 sized grids.
+    Files live in <root>/<project>/<YYYY-MM-DD>.npz.
+    """
+
+    def __init__(self, root, project):
+        self.dir = os.path.join(root, project)
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+
+    def path(self, day):
+        return os.path.join(self.dir, day.isoformat() + '.npz')
+
+    def save(self, day, matrix):
+        tmp = os.path.join(self.dir, '.' + day.isoformat() + '.tmp.npz')
+        np.savez_compressed(tmp, rows=np.array(matrix.rows, dtype=str),
+                            columns=np.array(matrix.columns, dtype=str),
+                            count=matrix.count.astype(np.int32))
+        os.replace(tmp, self.path(day))
+
+    def load(self, day):
+        with np.load(self.path(day)) as arrays:
+            matrix = PivotMatrix(arrays['rows'].tolist(), arrays['columns'].tolist())
+            matrix.count = arrays['count'].astype(np.int64)
+        return matrix
+
+    def days(self, start=None, end=None):
+        days = sorted(datetime.datetime.strptime(name[:10], '%Y-%m-%d').date()
+                      for name in os.listdir(self.dir)
+                      if name.endswith('.npz') and not name.startswith('.'))
+        return [d for d in days if (start is None or d >= start) and (end is None or d <= end)]
+
+    def series(self, start=None, end=None):
+        """(days, rows, columns, counts) with counts[day, row, column] on
+        the union of the labels of all snapshots in the range."""
+        days = self.days(start, end)
+        matrices = [self.load(d) for d in days]
+        rows = list(dict.fromkeys(r for matrix in matrices for r in matrix.rows))
+        columns = list(dict.fromkeys(c for matrix in matrices for c in matrix.columns))
+        counts = np.zeros((len(days), len(rows), len(columns)), dtype=np.int64)
+        for k, matrix in enumerate(matrices):
+            counts[k] = matrix.reindex(rows, columns).count
+        return days, rows, columns, counts
+
+
+def added_per_day(counts):
+    """Datasets added between consecutive snapshots (never negative)."""
+    return np.maximum(np.diff(counts, axis=0), 0)
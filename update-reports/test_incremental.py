@@ -0,0 +1,159 @@
+import json
+import os
+
+import numpy as np
+
+import incremental
+
+
+class Response(object):
+
+    def __init__(self, js):
+        self.text = json.dumps(js)
+
+
+def fake_get(js, urls):
+    def get(url):
+        urls.append(url)
+        return Response(js)
+    return get
+
+
+def solr_url(latest=True):
+    return 'http://solr/select?fq=replica:false' + ('&fq=latest:true' if latest else '') + '&{query}'
+
+
+def test_watermarks_of_an_empty_project(monkeypatch):
+    js = dict(stats=dict(stats_fields=dict(_timestamp=dict(max=None), _version_=dict(max=None))))
+    monkeypatch.setattr(incremental, 'solr_query_url', solr_url)
+    monkeypatch.setattr(incremental.requests, 'get', fake_get(js, []))
+    assert incremental.get_watermarks('CMIP6') == (None, 0)
+
+
+def test_watermarks(monkeypatch):
+    js = dict(stats=dict(stats_fields=dict(_timestamp=dict(max='2020-01-01T00:00:00Z'),
+                                           _version_=dict(max=1.6e18))))
+    monkeypatch.setattr(incremental, 'solr_query_url', solr_url)
+    monkeypatch.setattr(incremental.requests, 'get', fake_get(js, []))
+    assert incremental.get_watermarks('CMIP6') == ('2020-01-01T00:00:00Z', 1600000000000000000)
+
+
+def test_changes_query_all_versions(monkeypatch):
+    js = dict(facet_counts=dict(facet_fields=dict(source_id=['A', 2, 'B', 1], activity_id=['CMIP', 3])))
+    urls = []
+    monkeypatch.setattr(incremental, 'solr_query_url', solr_url)
+    monkeypatch.setattr(incremental.requests, 'get', fake_get(js, urls))
+    assert incremental.get_changes('CMIP6', 10, 20) == (['A', 'B'], ['CMIP'])
+    assert '_version_:{10 TO 20]' in urls[0] and 'latest:true' not in urls[0]
+
+
+class FakeIndex(object):
+    """Latest datasets of a project as (source_id, activity_id, experiment_id,
+    _version_); tables are computed from them as a full Solr query would."""
+
+    def __init__(self, datasets):
+        self.datasets = list(datasets)
+        self.pages = []
+
+    def select(self, activity_id=None, source_ids=None):
+        return [d for d in self.datasets if (activity_id is None or d[1] == activity_id) and
+                (source_ids is None or d[0] in source_ids)]
+
+    def matrix(self, project, row_facet, col_facet, selected_columns=None, activity_id=None, source_ids=None,
+               mode=None):
+        col = 1 if col_facet == 'activity_id' else 2
+        cells = {}
+        for d in self.select(activity_id, source_ids):
+            cells[(d[0], d[col])] = cells.get((d[0], d[col]), 0) + 1
+        rows = sorted(set(r for r, c in cells))
+        columns = sorted(set(c for r, c in cells))
+        matrix = incremental.PivotMatrix(rows, columns)
+        for (r, c), n in cells.items():
+            matrix.count[matrix.row_index[r], matrix.col_index[c]] = n
+        matrix.timestamp[matrix.present] = np.datetime64('2020-01-01T00:00:00')
+        return matrix.sorted_by_count()
+
+    def tables(self, project, source_ids=None, mode=None):
+        models = sorted(set(d[0] for d in self.select(source_ids=source_ids)))
+        counts = dict((m, {}) for m in models)
+        return dict(frequencies=[], exp_sim_counts=counts, variable_counts=counts, models_per_frequency={})
+
+    def activity_tables(self, project, activity_id, mode=None):
+        return dict(frequencies=[], simulation_counts={}, variable_counts={}, models_per_frequency={})
+
+    def changes(self, project, since, until):
+        changed = [d for d in self.datasets if since < d[3] <= until]
+        return sorted(set(d[0] for d in changed)), sorted(set(d[1] for d in changed))
+
+    def watermarks(self, project):
+        return '2020-01-01T00:00:00Z', max(d[3] for d in self.datasets)
+
+    def write_project_page(self, project, output_dir, *args):
+        open(os.path.join(output_dir, project + '_esgf_holdings.html'), 'w').close()
+        self.pages.append('project')
+
+    def write_activity_page(self, project, activity_id, output_dir, *args):
+        if not os.path.isdir(os.path.join(output_dir, activity_id)):
+            os.mkdir(os.path.join(output_dir, activity_id))
+        open(os.path.join(output_dir, activity_id, 'index.html'), 'w').close()
+        self.pages.append(activity_id)
+
+
+def fake_index(monkeypatch, datasets):
+    index = FakeIndex(datasets)
+    monkeypatch.setattr(incremental, 'get_watermarks', index.watermarks)
+    monkeypatch.setattr(incremental, 'get_changes', index.changes)
+    monkeypatch.setattr(incremental.report, 'get_latest_data_matrix', index.matrix)
+    monkeypatch.setattr(incremental.report, 'get_project_tables', index.tables)
+    monkeypatch.setattr(incremental.report, 'get_activity_tables', index.activity_tables)
+    monkeypatch.setattr(incremental.report, 'write_project_page', index.write_project_page)
+    monkeypatch.setattr(incremental.report, 'write_activity_page', index.write_activity_page)
+    return index
+
+
+def assert_same(matrix, expected):
+    assert matrix.rows == expected.rows and matrix.columns == expected.columns
+    assert matrix.count.tolist() == expected.count.tolist()
+
+
+def test_update_tables_matches_a_full_run(monkeypatch, tmp_path):
+    index = fake_index(monkeypatch, [('A', 'CMIP', 'historical', 1), ('A', 'CMIP', 'piControl', 2),
+                                     ('B', 'CMIP', 'historical', 3), ('D', 'DAMIP', 'hist-nat', 4)])
+    state_dir, output = str(tmp_path / 'state'), str(tmp_path)
+    incremental.update_tables('CMIP6', output, state_dir)
+    assert sorted(index.pages) == ['CMIP', 'DAMIP', 'project']
+
+    # a new model, and a model whose dataset was superseded by a new version
+    index.datasets.remove(('B', 'CMIP', 'historical', 3))
+    index.datasets += [('B', 'CMIP', 'historical', 5), ('B', 'CMIP', 'amip', 6), ('C', 'CMIP', 'amip', 7),
+                       ('C', 'CMIP', 'piControl', 8), ('C', 'CMIP', 'historical', 9)]
+    index.pages = []
+    incremental.update_tables('CMIP6', output, state_dir)
+    # DAMIP has no new dataset and its page is not rendered again
+    assert sorted(index.pages) == ['CMIP', 'project']
+
+    state = incremental.State(state_dir, 'CMIP6')
+    assert state.meta['version'] == 9
+    assert_same(state.load_matrix('activities'), index.matrix('CMIP6', 'source_id', 'activity_id'))
+    assert_same(state.load_matrix('CMIP'), index.matrix('CMIP6', 'source_id', 'experiment_id', activity_id='CMIP'))
+    assert state.load_matrix('activities').rows == ['C', 'A', 'B', 'D']
+
+
+def test_update_tables_recomputes_missing_matrices_and_old_state(monkeypatch, tmp_path):
+    index = fake_index(monkeypatch, [('A', 'CMIP', 'historical', 1), ('B', 'DAMIP', 'hist-nat', 2)])
+    state_dir, output = str(tmp_path / 'state'), str(tmp_path)
+    incremental.update_tables('CMIP6', output, state_dir)
+    state = incremental.State(state_dir, 'CMIP6')
+    os.remove(state.matrix_path('DAMIP'))
+    index.pages = []
+    incremental.update_tables('CMIP6', output, state_dir)
+    assert index.pages == ['DAMIP']
+    assert incremental.State(state_dir, 'CMIP6').load_matrix('DAMIP').rows == ['B']
+
+    # a state older than refresh_days is recomputed in full
+    state = incremental.State(state_dir, 'CMIP6')
+    state.meta['full'] = '2000-01-01T00:00:00'
+    state.save()
+    index.pages = []
+    incremental.update_tables('CMIP6', output, state_dir)
+    assert sorted(index.pages) == ['CMIP', 'DAMIP', 'project']
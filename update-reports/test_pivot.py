@@ -0,0 +1,104 @@
+import datetime
+
+import numpy as np
+
+from pivot import PivotMatrix, decode_pivot
+
+
+def response():
+    cell = lambda value, count, ts: dict(value=value, count=count, stats=dict(stats_fields=dict(
+        _timestamp=dict(max=ts + 'Z'), experiment_id=dict(countDistinct=count % 3 + 1))))
+    return dict(facet_counts=dict(
+        facet_fields=dict(source_id=['B', 5, 'A', 3], activity_id=['CMIP', 6, 'DAMIP', 2]),
+        facet_pivot={'source_id,activity_id': [
+            dict(value='B', count=5, pivot=[cell('CMIP', 4, '2020-01-10T00:00:00'),
+                                            cell('UNKNOWN', 1, '2020-01-01T00:00:00')]),
+            dict(value='A', count=3, pivot=[cell('CMIP', 2, '2020-01-05T12:00:00'),
+                                            cell('DAMIP', 1, '2019-12-01T00:00:00')]),
+        ]}))
+
+
+def test_decode_pivot():
+    m = decode_pivot(response(), 'source_id', 'activity_id')
+    assert m.rows == ['B', 'A'] and m.columns == ['CMIP', 'DAMIP']
+    assert m.count.tolist() == [[4, 0], [2, 1]]
+    assert m.timestamp[0, 0] == np.datetime64('2020-01-10T00:00:00')
+    assert np.isnat(m.timestamp[0, 1])
+    assert m.stat('experiment_id').tolist() == [[2, 0], [3, 2]]
+    assert m.stat('missing').tolist() == [[0, 0], [0, 0]]
+    assert m.row_totals().tolist() == [1, 2] and m.column_totals().tolist() == [2, 1] and m.total() == 3
+
+
+def test_decode_pivot_selected_columns():
+    m = decode_pivot(response(), 'source_id', 'activity_id', selected_columns=['DAMIP'])
+    assert m.count.tolist() == [[0], [1]]
+
+
+def test_nested_pivot_keeps_latest_timestamp_and_sums_distinct():
+    js = response()
+    js['facet_counts']['facet_pivot']['source_id,activity_id'][0]['pivot'][0]['pivot'] = [
+        dict(value='r1', count=2, stats=dict(stats_fields=dict(_timestamp=dict(max='2020-02-01T00:00:00Z'),
+                                                               variable_id=dict(countDistinct=4)))),
+        dict(value='r2', count=2, stats=dict(stats_fields=dict(_timestamp=dict(max='2020-03-01T00:00:00Z'),
+                                                               variable_id=dict(countDistinct=5)))),
+    ]
+    m = decode_pivot(js, 'source_id', 'activity_id')
+    assert m.nested[0, 0] == 2
+    assert m.timestamp[0, 0] == np.datetime64('2020-03-01T00:00:00')
+    assert m.stat('variable_id')[0, 0] == 9
+
+
+def test_age_days():
+    m = decode_pivot(response(), 'source_id', 'activity_id')
+    assert m.age_days(datetime.datetime(2020, 1, 11)).tolist() == [[1, -1], [5, 41]]
+
+
+def test_merge_adds():
+    m = decode_pivot(response(), 'source_id', 'activity_id')
+    delta = PivotMatrix(['C', 'A'], ['CMIP', 'ScenarioMIP'])
+    delta.count[:] = [[1, 0], [0, 2]]
+    delta.timestamp[1, 1] = np.datetime64('2020-02-01T00:00:00')
+    added = m.merge(delta)
+    assert added.rows == ['B', 'A', 'C'] and added.columns == ['CMIP', 'DAMIP', 'ScenarioMIP']
+    assert added.count.tolist() == [[4, 0, 0], [2, 1, 2], [1, 0, 0]]
+    assert added.timestamp[1, 2] == np.datetime64('2020-02-01T00:00:00')
+    assert added.timestamp[0, 0] == np.datetime64('2020-01-10T00:00:00')
+    assert added.distinct == {}
+
+
+def test_save_load_round_trip(tmp_path):
+    m = decode_pivot(response(), 'source_id', 'activity_id')
+    path = str(tmp_path / 'm.npz')
+    m.save(path)
+    loaded = PivotMatrix.load(path)
+    assert loaded.rows == m.rows and loaded.columns == m.columns
+    assert (loaded.count == m.count).all() and (loaded.stat('experiment_id') == m.stat('experiment_id')).all()
+    assert loaded.to_holdings(datetime.datetime(2020, 1, 11)) == m.to_holdings(datetime.datetime(2020, 1, 11))
+
+
+def test_to_holdings():
+    h = decode_pivot(response(), 'source_id', 'activity_id').to_holdings(datetime.datetime(2020, 1, 11))
+    assert h['total'] == 3
+    assert h['datasets']['A'] == {'CMIP': dict(num=2, days=5), 'DAMIP': dict(num=1, days=41)}
+    assert h['row_totals'] == {'B': 1, 'A': 2}
+
+
+def test_replace_rows():
+    m = decode_pivot(response(), 'source_id', 'activity_id')
+    fresh = PivotMatrix(['A', 'C'], ['CMIP', 'ScenarioMIP'])
+    fresh.count[:] = [[0, 7], [1, 1]]
+    replaced = m.replace_rows(['A', 'D'], fresh)
+    # A is taken from fresh, C is not a replaced row, DAMIP is left empty;
+    # labels are sorted by count as in a full run
+    assert replaced.rows == ['A', 'B'] and replaced.columns == ['ScenarioMIP', 'CMIP']
+    assert replaced.count.tolist() == [[7, 0], [0, 4]]
+    assert m.replace_rows(['A'], PivotMatrix([], [])).rows == ['B']
+
+
+def test_replace_rows_order_does_not_depend_on_history():
+    m = decode_pivot(response(), 'source_id', 'activity_id')
+    fresh = PivotMatrix(['C'], ['CMIP'])
+    fresh.count[:] = [[5]]
+    once = m.replace_rows(['C'], fresh)
+    assert once.rows == ['C', 'B', 'A']
+    assert once.replace_rows(['C'], fresh).rows == once.rows
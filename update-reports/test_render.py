@@ -0,0 +1,50 @@
+import gzip
+import io
+import os
+
+import numpy as np
+
+from render import PageWriter, TableRenderer, template_environment
+
+
+def test_page_writer_text_and_binary_streams():
+    text = io.StringIO()
+    with PageWriter(stream=text, chunk_size=4) as out:
+        out.write('<p>café</p>')
+    assert text.getvalue() == '<p>café</p>'
+
+    raw = io.BytesIO()
+    with PageWriter(stream=raw, compress=True) as out:
+        out.write('<p>')
+    assert gzip.decompress(raw.getvalue()) == b'<p>'
+
+
+def test_page_writer_replaces_the_page_on_close(tmp_path):
+    path = str(tmp_path / 'page.html')
+    with PageWriter(path) as out:
+        out.write('new')
+        assert not (tmp_path / 'page.html').exists()
+    assert (tmp_path / 'page.html').read_text() == 'new'
+
+
+def test_table_totals_labels():
+    out = io.StringIO()
+    present = np.array([[True, False]])
+    TableRenderer(scroll=False).render(out, 'frequency', ['mon'], ['CMIP', 'DAMIP'], np.array([[3, 0]]), 'FFFFFF',
+                                       present, totals_label='# of activities', totals_row_label='# of freqs',
+                                       column_totals=[1, 0], row_totals=[1], total=1)
+    html = out.getvalue()
+    assert '<th>frequency</th><th># of activities</th><th>CMIP</th>' in html
+    assert '<tr><td><b># of freqs</b></td><td><b>1</b></td>' in html
+    assert '<td bgcolor="#FFFFFF">3</td><td bgcolor="#CCCCCC"></td>' in html
+
+
+def test_template_environment_reloads_edited_templates(tmp_path):
+    page = tmp_path / 'page.html'
+    page.write_text('old')
+    env = template_environment(str(tmp_path), str(tmp_path / 'cache'))
+    assert env.get_template('page.html').render() == 'old'
+    page.write_text('new')
+    os.utime(str(page), (1, 2e9))
+    assert env.get_template('page.html').render() == 'new'
+    assert (tmp_path / 'cache').stat().st_mode & 0o777 == 0o700
@@ -0,0 +1,95 @@
+import esgf_holdings_report as report
+import sharded
+import topology
+
+
+def shard(rows):
+    # rows: {source_id: {activity_id: [(experiment_id, [variant_label, ...]), ...]}}
+    entries, sources, activities = [], {}, {}
+    for source, cols in rows.items():
+        pivot = []
+        for activity, experiments in cols.items():
+            count = sum(len(variants) for _exp, variants in experiments)
+            pivot.append(dict(value=activity, count=count, pivot=[
+                dict(value=exp, count=len(variants), pivot=[dict(value=v, count=1) for v in variants])
+                for exp, variants in experiments]))
+            sources[source] = sources.get(source, 0) + count
+            activities[activity] = activities.get(activity, 0) + count
+        entries.append(dict(value=source, count=sources[source], pivot=pivot))
+    flat = lambda counts: [x for item in counts.items() for x in item]
+    return dict(facet_counts=dict(facet_fields=dict(source_id=flat(sources), activity_id=flat(activities)),
+                                  facet_pivot={'source_id,activity_id,experiment_id,variant_label': entries}))
+
+
+LEVELS = ('experiment_id', 'variant_label')
+
+
+def test_shard_query_caps_the_extra_levels():
+    query = sharded.shard_query('fq=project:CMIP6', 'source_id', 'activity_id', LEVELS, facet_limit=50, level_limit=10)
+    assert '&facet.limit=50' in query
+    assert '&f.experiment_id.facet.limit=10&f.variant_label.facet.limit=10' in query
+
+
+def test_merge_unites_paths_across_shards():
+    one = shard({'A': {'CMIP': [('historical', ['r1', 'r2'])]}})
+    two = shard({'A': {'CMIP': [('historical', ['r2']), ('piControl', ['r1'])]}, 'B': {'CMIP': [('amip', ['r1'])]}})
+    m = sharded.merge_shards([one, two], 'source_id', 'activity_id', levels=LEVELS)
+    assert m.rows == ['A', 'B'] and m.columns == ['CMIP']
+    assert m.count.tolist() == [[4], [1]]
+    assert m.nested.tolist() == [[2], [1]]
+    assert m.stat('variant_label').tolist() == [[3], [1]]
+
+
+def test_merge_keeps_the_latest_timestamp():
+    one, two = shard({'A': {'CMIP': []}}), shard({'A': {'CMIP': []}})
+    for js, ts in ((one, '2020-01-02T00:00:00Z'), (two, '2020-01-01T00:00:00Z')):
+        js['facet_counts']['facet_pivot']['source_id,activity_id,experiment_id,variant_label'][0]['pivot'][0]['stats'] = \
+            dict(stats_fields=dict(_timestamp=dict(max=ts)))
+    m = sharded.merge_shards([one, two], 'source_id', 'activity_id')
+    assert str(m.timestamp[0, 0]) == '2020-01-02T00:00:00'
+
+
+def test_shard_query_url_scheme():
+    assert topology.shard_query_url('localhost:8983/solr/datasets').startswith('http://localhost:8983/solr/datasets/select?')
+    assert topology.shard_query_url('https://s1:8983/solr/datasets').startswith('https://s1:8983/solr/datasets/select?')
+
+
+def test_truncated_extra_level():
+    responses = [shard({'A': {'CMIP': [('historical', ['r1', 'r2'])]}})]
+    assert not sharded.truncated(responses, 3, 2)
+    assert sharded.truncated(responses, 2, 2)
+    # the row and column levels are never capped
+    assert not sharded.truncated([shard({'A': {'CMIP': [], 'DAMIP': []}})], 2, 2)
+
+
+def test_compare_reports_differences():
+    m = sharded.merge_shards([shard({'A': {'CMIP': [('historical', ['r1'])]}})], 'source_id', 'activity_id',
+                             levels=LEVELS)
+    ref = sharded.merge_shards([shard({'A': {'CMIP': [('historical', ['r1', 'r2'])]}, 'B': {'CMIP': []}})],
+                               'source_id', 'activity_id', levels=LEVELS)
+    diffs = sharded.compare(m, ref, LEVELS)
+    assert 'missing row B' in diffs
+    assert 'count A,CMIP: 1 != 2' in diffs and 'variant_label A,CMIP: 1 != 2' in diffs
+
+
+def test_compare_reports_labels_only_in_the_merged_matrix():
+    m = sharded.merge_shards([shard({'A': {'CMIP': [('historical', ['r1'])]}, 'C': {'DAMIP': [('hist-nat', ['r1'])]}})],
+                             'source_id', 'activity_id', levels=LEVELS)
+    ref = sharded.merge_shards([shard({'A': {'CMIP': [('historical', ['r1'])]}})], 'source_id', 'activity_id',
+                               levels=LEVELS)
+    diffs = sharded.compare(m, ref, LEVELS)
+    assert 'extra row C' in diffs and 'extra column DAMIP' in diffs
+    assert 'count C,DAMIP: 1 != 0' in diffs
+
+
+def test_truncated_shards_fall_back_to_the_distributed_query(monkeypatch):
+    reference = sharded.merge_shards([shard({'A': {'CMIP': [('historical', ['r1'])]}})], 'source_id', 'activity_id')
+    monkeypatch.setattr(sharded, 'shard_pivot', lambda *args: None)
+    monkeypatch.setattr(report, 'decode_pivot', lambda *args: reference)
+    monkeypatch.setattr(report, 'solr_query_url', lambda: '{query}')
+    urls = []
+    monkeypatch.setattr(report.requests, 'get', lambda url: urls.append(url) or type('Response', (), dict(text='{}')))
+    mode = report.QueryMode(sharded=True, validate=True, facet_limit=50)
+    assert mode.pivot('', '', 'source_id', 'activity_id', levels=LEVELS) is reference
+    assert mode.mismatches == []
+    assert urls == ['&facet.limit=50']
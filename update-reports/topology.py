@@ -0,0 +1,136 @@
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+# The index node all reports query, fixtures.py serves recorded responses
+# for offline runs when this points at it
+BASE_URL = os.environ.get('ESGF_REPORTS_BASE_URL', 'https://esgf-node.llnl.gov').rstrip('/')
+
+SEARCH_URL = BASE_URL + '/esg-search/search/?limit=0&format=application%2Fsolr%2Bjson'
+
+SOLR_URL = BASE_URL + '/solr/datasets/select'
+
+# Comma separated host:port/solr/<core> shards queried instead of the ones
+# esg-search uses, for nodes whose shards are not reachable under those names
+CONFIGURED_SHARDS = [s for s in os.environ.get('ESGF_REPORTS_SHARDS', '').split(',') if s]
+
+# Scheme of the shard entries without one, Solr's urlScheme for its shards
+SHARD_SCHEME = os.environ.get('ESGF_REPORTS_SHARD_SCHEME', 'http')
+
+# Used when the shard list cannot be discovered from esg-search
+DEFAULT_SHARDS = [
+    "localhost:8983/solr/datasets",
+    "localhost:8985/solr/datasets",
+    "localhost:8987/solr/datasets",
+    "localhost:8988/solr/datasets",
+    "localhost:8990/solr/datasets",
+    "localhost:8993/solr/datasets",
+    "localhost:8995/solr/datasets"
+]
+
+
+class ShardTopology(object):
+    """The Solr shards behind the index, discovered once and cached.
+
+    The shard list is taken from the `shards` parameter esg-search uses
+    and is kept for `ttl` seconds, unless ESGF_REPORTS_SHARDS configures
+    the shards.  Every shard is health checked
+    concurrently with a rows=0 query restricted to that shard; the result
+    is kept for `health_ttl` seconds.  Both are cached in memory and in
+    `cache_path`, so consecutive report runs share them.
+    """
+
+    def __init__(self, cache_path=None, ttl=86400, health_ttl=300, timeout=10):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.health_ttl = health_ttl
+        self.timeout = timeout
+        self.cache = {}
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path) as f:
+                    self.cache = json.load(f)
+            except ValueError:
+                self.cache = {}
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        tmp = self.cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp, self.cache_path)
+
+    def discover(self):
+        req = requests.get(SEARCH_URL, timeout=self.timeout)
+        req.raise_for_status()
+        return json.loads(req.text)['responseHeader']['params']['shards'].split(',')
+
+    def check(self, shard):
+        """True when `shard` answers a query on its own in time."""
+        try:
+            req = requests.get(SOLR_URL, timeout=self.timeout,
+                               params={'q': '*:*', 'rows': 0, 'wt': 'json', 'shards': shard})
+            return req.status_code == 200 and 'error' not in json.loads(req.text)
+        except (requests.RequestException, ValueError):
+            return False
+
+    def all_shards(self):
+        if CONFIGURED_SHARDS:
+            return list(CONFIGURED_SHARDS)
+        now = time.time()
+        if now - self.cache.get('discovered', 0) > self.ttl:
+            try:
+                self.cache = dict(discovered=now, shards=self.discover())
+            except (requests.RequestException, ValueError, KeyError) as ex:
+                print("Warning: shard discovery failed ({}), using the default shards".format(ex), file=sys.stderr)
+                # try discovering again once the health check expires
+                self.cache = dict(discovered=now - self.ttl + self.health_ttl, shards=list(DEFAULT_SHARDS))
+            self._save()
+        return self.cache['shards']
+
+    def healthy_shards(self):
+        shards = self.all_shards()
+        now = time.time()
+        if now - self.cache.get('checked', 0) > self.health_ttl:
+            with concurrent.futures.ThreadPoolExecutor(len(shards)) as pool:
+                alive = list(pool.map(self.check, shards))
+            healthy = [s for s, ok in zip(shards, alive) if ok]
+            dead = [s for s, ok in zip(shards, alive) if not ok]
+            if dead:
+                print("Warning: leaving out unresponsive shards {}".format(", ".join(dead)), file=sys.stderr)
+            # never query with an empty shard list, let the coordinator report the error
+            self.cache.update(checked=now, healthy=healthy or shards)
+            self._save()
+        return self.cache['healthy']
+
+
+TOPOLOGY = ShardTopology(os.environ.get('ESGF_REPORTS_SHARD_CACHE',
+                                        os.path.join(tempfile.gettempdir(), 'esgf-update-reports-shards.json')))
+
+
+def solr_query_url(latest=True, shards=None):
+    """Distributed select URL over the healthy shards, with a {query} slot."""
+    if shards is None:
+        shards = TOPOLOGY.healthy_shards()
+    solr_url = SOLR_URL + \
+               '?q=*:*&wt=json&facet=true&fq=type:Dataset' \
+               '&fq=replica:false{latest}&shards={shards}&{{query}}'
+    return solr_url.format(shards=",".join(shards), latest='&fq=latest:true' if latest else '')
+
+
+def shard_query_url(shard, latest=True):
+    """Select URL of one shard core queried directly (distrib=false), with a
+    {query} slot; `shard` is a [scheme://]host:port/solr/<core> entry of the
+    topology, by default reached over SHARD_SCHEME like Solr does."""
+    if '://' not in shard:
+        shard = SHARD_SCHEME + '://' + shard
+    solr_url = shard + '/select' \
+               '?q=*:*&wt=json&distrib=false&facet=true&fq=type:Dataset' \
+               '&fq=replica:false{latest}&{{query}}'
+    return solr_url.format(latest='&fq=latest:true' if latest else '')